@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from io import BytesIO
+
+from PIL import Image
+from dotenv import load_dotenv
+
+from ai.gimini_client import analyze_currency, MODEL_NAME, PROMPT_VERSION
+
+load_dotenv()
+# gemini = Gemini only, local = local classifier only,
+# cascade = local first, Gemini when the local model is not confident.
+# A local model only answers when its labels have counterfeit classes, one
+# that only knows genuine notes can't tell a fake (see LocalBackend)
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "gemini").lower()
+LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", "ai/models/currency_classifier.onnx")
+LOCAL_LABELS_PATH = os.getenv("LOCAL_LABELS_PATH", "ai/models/labels.json")
+LOCAL_INPUT_SIZE = int(os.getenv("LOCAL_INPUT_SIZE", "224"))
+LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("LOCAL_CONFIDENCE_THRESHOLD", "0.9"))
+LOCAL_THREADS = int(os.getenv("LOCAL_THREADS", "1"))
+
+# ImageNet normalization, what the usual pretrained backbones expect
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+class InferenceBackend(ABC):
+    """
+    Something that turns a JPEG into the analyze_currency result dict:
+    currency_code, confidence, name_en, name_ar, denomination_value, is_counterfeit
+    `name` identifies the backend/model version (used in cache keys).
+    """
+
+    name = "base"
+    # Whether is_counterfeit is a real judgement (see LocalBackend)
+    screens_counterfeits = True
+
+    @abstractmethod
+    def analyze(self, image_bytes: bytes) -> dict:
+        """Blocking, called from the inference executor threads."""
+
+    def stats(self) -> dict:
+        return {"name": self.name}
+
+
+class GeminiBackend(InferenceBackend):
+    name = f"gemini:{MODEL_NAME}:{PROMPT_VERSION}"
+
+    def analyze(self, image_bytes: bytes) -> dict:
+        return analyze_currency(image_bytes)
+
+
+class LocalBackend(InferenceBackend):
+    """
+    CPU-only ONNX Runtime classifier over known banknotes.
+
+    The labels file is a JSON list, one entry per model output class:
+    {"currency_code": "SDG", "denomination_value": 100,
+     "name_en": "...", "name_ar": "...", "is_counterfeit": false}
+
+    is_counterfeit comes from the winning class, so the model only screens
+    counterfeits when it was trained with counterfeit classes
+    (`screens_counterfeits`). Without them every answer would say genuine:
+    INFERENCE_MODE=local refuses such a model and the cascade sends
+    everything to Gemini.
+    """
+
+    def __init__(self, model_path: str, labels_path: str, input_size: int, threads: int):
+        try:
+            import numpy as np
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError(
+                "Local inference needs numpy and onnxruntime installed") from e
+
+        self._np = np
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.input_size = input_size
+        with open(labels_path, encoding="utf-8") as f:
+            self.labels = json.load(f)
+        self.screens_counterfeits = any(label.get("is_counterfeit") for label in self.labels)
+
+        self.name = f"local:{os.path.basename(model_path)}:{os.path.getmtime(model_path):.0f}"
+        self._mean = np.array(MEAN, dtype=np.float32).reshape(3, 1, 1)
+        self._std = np.array(STD, dtype=np.float32).reshape(3, 1, 1)
+
+    def _preprocess(self, image_bytes: bytes):
+        np = self._np
+        img = Image.open(BytesIO(image_bytes))
+        # The model only needs input_size pixels, let the JPEG decoder downscale
+        img.draft("RGB", (self.input_size, self.input_size))
+        img = img.convert("RGB").resize(
+            (self.input_size, self.input_size), Image.Resampling.BILINEAR)
+        arr = np.asarray(img, dtype=np.float32).transpose(2, 0, 1) / 255.0
+        arr = (arr - self._mean) / self._std
+        return arr[np.newaxis, ...]
+
+    def analyze(self, image_bytes: bytes) -> dict:
+        np = self._np
+        logits = self.session.run(None, {self.input_name: self._preprocess(image_bytes)})[0][0]
+        exp = np.exp(logits - logits.max())
+        probs = exp / exp.sum()
+        index = int(probs.argmax())
+        label = self.labels[index]
+        return {
+            "currency_code": str(label["currency_code"]).upper(),
+            "confidence": float(probs[index]),
+            "name_en": label["name_en"],
+            "name_ar": label["name_ar"],
+            "denomination_value": int(label["denomination_value"]),
+            "is_counterfeit": bool(label.get("is_counterfeit", False)),
+        }
+
+
+class CascadeBackend(InferenceBackend):
+    """
+    Local model first, falls back to Gemini below `threshold` confidence.
+    A local model that does not screen counterfeits never answers alone.
+    """
+
+    def __init__(self, local: InferenceBackend, remote: InferenceBackend, threshold: float):
+        self.local = local
+        self.remote = remote
+        self.threshold = threshold
+        self.name = f"cascade:{local.name}@{threshold}|{remote.name}"
+        self._lock = threading.Lock()
+        self.local_answers = 0
+        self.fallbacks = 0
+
+    def analyze(self, image_bytes: bytes) -> dict:
+        if self.local.screens_counterfeits:
+            result = self.local.analyze(image_bytes)
+            if result["confidence"] >= self.threshold:
+                with self._lock:
+                    self.local_answers += 1
+                return result
+        with self._lock:
+            self.fallbacks += 1
+        return self.remote.analyze(image_bytes)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "local_answers": self.local_answers,
+            "fallbacks": self.fallbacks,
+        }
+
+
+_backend: InferenceBackend | None = None
+
+
+def load_backend() -> InferenceBackend:
+    """Builds the configured backend once (call at startup)."""
+    global _backend
+    if _backend is not None:
+        return _backend
+
+    if INFERENCE_MODE not in ("gemini", "local", "cascade"):
+        raise ValueError(f"Unknown INFERENCE_MODE '{INFERENCE_MODE}'")
+
+    if INFERENCE_MODE == "gemini":
+        _backend = GeminiBackend()
+        return _backend
+
+    try:
+        local = LocalBackend(
+            LOCAL_MODEL_PATH, LOCAL_LABELS_PATH, LOCAL_INPUT_SIZE, LOCAL_THREADS)
+        if not local.screens_counterfeits:
+            raise RuntimeError(
+                f"Local model labels ({LOCAL_LABELS_PATH}) have no counterfeit class, "
+                "it would report every banknote as genuine")
+    except Exception as e:
+        if INFERENCE_MODE == "local":
+            raise
+        # Cascade without a usable local model is just Gemini
+        print(f"[Inference] Local model unavailable, using Gemini only: {e}")
+        _backend = GeminiBackend()
+        return _backend
+
+    if INFERENCE_MODE == "local":
+        _backend = local
+    else:
+        _backend = CascadeBackend(local, GeminiBackend(), LOCAL_CONFIDENCE_THRESHOLD)
+    return _backend
+
+
+def get_backend() -> InferenceBackend:
+    return _backend or load_backend()
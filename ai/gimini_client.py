@@ -1,117 +1,325 @@
-import base64
-import json
-from io import BytesIO
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from PIL import Image
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from pydantic import BaseModel, Field, ValidationError, field_validator
+import requests
 import os
 from dotenv import load_dotenv
 
+from ai.resilience import (
+    CircuitBreaker,
+    TokenBucket,
+    LatencyTracker,
+    GeminiDeadlineError,
+    GeminiInvalidResponseError,
+    GeminiUnavailableError,
+    backoff_delay,
+    hedged_call,
+)
+
 load_dotenv()
 API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_NAME = "gemini-2.5-flash"  # or whatever model you ended up using
-genai.configure(api_key=API_KEY)
+# Bump whenever the prompt changes so cached results are not reused
+PROMPT_VERSION = "2"
 
+# Point at a local fake Gemini server (REST), e.g. http://localhost:8089
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+# Whole call incl. retries, keep below INFERENCE_TIMEOUT_SECONDS
+GEMINI_DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE_SECONDS", "25"))
+GEMINI_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT_SECONDS", "15"))
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "3"))
+GEMINI_BACKOFF_BASE_SECONDS = float(os.getenv("GEMINI_BACKOFF_BASE_SECONDS", "0.5"))
+GEMINI_BACKOFF_MAX_SECONDS = float(os.getenv("GEMINI_BACKOFF_MAX_SECONDS", "8"))
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_RESET_SECONDS = float(os.getenv("GEMINI_BREAKER_RESET_SECONDS", "30"))
+# Send a second request when the first is slower than this latency percentile
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "false").lower() == "true"
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "0.95"))
+# Client-side limiter matching the API quota (requests per second / burst)
+GEMINI_RATE_PER_SECOND = float(os.getenv("GEMINI_RATE_PER_SECOND", "10"))
+GEMINI_RATE_BURST = float(os.getenv("GEMINI_RATE_BURST", "10"))
 
-def analyze_currency(image_bytes: bytes):
+if GEMINI_API_ENDPOINT:
+    genai.configure(
+        api_key=API_KEY or "fake-key",
+        transport="rest",
+        client_options={"api_endpoint": GEMINI_API_ENDPOINT},
+    )
+else:
+    genai.configure(api_key=API_KEY)
+
+# Errors worth retrying: throttling, upstream 5xx, timeouts, network
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+    TimeoutError,
+    GeminiDeadlineError,
+)
+
+
+class GeminiClient:
     """
-    Sends image bytes to Gemini and returns structured JSON with:
-    currency_code, confidence, name_en, name_ar, denomination_value, is_counterfeit
+    generate_content with a deadline, retries (exponential backoff + jitter),
+    a circuit breaker, an optional hedged second request and a client-side
+    token bucket. Blocking, meant to run in the inference executor threads.
     """
 
-    # 1) Re-encode image as JPEG base64
-    img = Image.open(BytesIO(image_bytes)).convert("RGB")
-    buffered = BytesIO()
-    img.save(buffered, format="JPEG")
-    encoded_image = base64.b64encode(buffered.getvalue()).decode("utf-8")
-
-    # 2) Prompt with strong JSON-only instruction
-    prompt = """
-You are a currency authentication expert.
-
-Analyze the provided banknote image and return a JSON ONLY with these fields:
-
-{
-  "currency_code": "string",
-  "confidence": float (0-1),
-  "name_en": "string",
-  "name_ar": "string",
-  "denomination_value": int,
-  "is_counterfeit": boolean
-}
+    def __init__(self):
+        self.deadline = GEMINI_DEADLINE_SECONDS
+        self.attempt_timeout = GEMINI_ATTEMPT_TIMEOUT_SECONDS
+        self.max_attempts = GEMINI_MAX_ATTEMPTS
+        self.hedge_enabled = GEMINI_HEDGE_ENABLED
+        self.breaker = CircuitBreaker(
+            GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_RESET_SECONDS)
+        self.limiter = TokenBucket(GEMINI_RATE_PER_SECOND, GEMINI_RATE_BURST)
+        self.latency = LatencyTracker()
+        self._hedge_pool = ThreadPoolExecutor(
+            max_workers=16, thread_name_prefix="gemini-hedge")
+        # Optional callable(phase, seconds, error class name or None) told
+        # about every attempt ("call") and response parse ("parse")
+        self.observer = None
+        # Optional callable(prompt, output, thoughts tokens) for every call
+        self.usage_observer = None
+
+        # Metrics
+        self.calls = 0
+        self.retries = 0
+        self.errors = 0
+        self.hedges = 0
+        self.invalid_responses = 0
+        self.error_classes: dict[str, int] = {}
+        self.tokens = {"prompt": 0, "output": 0, "thoughts": 0, "calls": 0}
+
+    def record(self, phase: str, seconds: float, error: Exception | None = None):
+        if error is not None:
+            name = type(error).__name__
+            self.error_classes[name] = self.error_classes.get(name, 0) + 1
+        if self.observer is not None:
+            self.observer(phase, seconds, type(error).__name__ if error is not None else None)
 
-Rules:
-- Reply with JSON ONLY. Do not include any extra text, markdown, or explanation.
-- Do NOT wrap the JSON in ``` or ```json.
-- If unsure, confidence must be lower.
-- denomination_value must be an integer (100, 200, 500, 1000 for SDG).
-- If fake or suspicious => is_counterfeit = true.
-- name_ar MUST be Arabic translation.
-"""
-
-    model = genai.GenerativeModel(MODEL_NAME)
-
-    response = model.generate_content(
-        [
-            prompt,
-            {
-                "mime_type": "image/jpeg",
-                "data": encoded_image,
+    def generate(self, model, contents, parse=None):
+        """
+        Response of `model.generate_content(contents)`, or `parse(response)`
+        when given: a reply it rejects with ValueError is asked for again,
+        within the same attempts and deadline.
+        """
+        self.calls += 1
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            # Fail fast while the upstream is known to be down
+            self.breaker.before_call()
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise GeminiDeadlineError(
+                        f"Gemini call exceeded {self.deadline:.0f}s")
+                self.limiter.acquire(timeout=remaining)
+            except BaseException:
+                # Nothing was sent, a half-open trial must not stay taken
+                self.breaker.cancel_call()
+                raise
+
+            timeout = min(self.attempt_timeout, deadline - time.monotonic())
+            started = time.monotonic()
+            try:
+                response = self._call(model, contents, timeout)
+            except RETRYABLE_ERRORS as e:
+                self.errors += 1
+                self.record("call", time.monotonic() - started, e)
+                self.breaker.record_failure()
+                delay = backoff_delay(
+                    attempt, GEMINI_BACKOFF_BASE_SECONDS, GEMINI_BACKOFF_MAX_SECONDS)
+                if attempt >= self.max_attempts or time.monotonic() + delay >= deadline:
+                    raise GeminiUnavailableError(
+                        f"Gemini failed after {attempt} attempt(s): {e}") from e
+                self.retries += 1
+                time.sleep(delay)
+                continue
+            except Exception as e:
+                # Bad request etc.: upstream answered, it is not degraded
+                self.errors += 1
+                self.record("call", time.monotonic() - started, e)
+                self.breaker.record_success()
+                raise
+
+            elapsed = time.monotonic() - started
+            self.latency.record(elapsed)
+            self.record("call", elapsed)
+            self.breaker.record_success()
+            self.record_usage(response)
+            if parse is None:
+                return response
+
+            parse_started = time.monotonic()
+            try:
+                result = parse(response)
+            except ValueError as e:
+                # Upstream is fine, this one reply is not: ask again
+                self.invalid_responses += 1
+                self.record("parse", time.monotonic() - parse_started, e)
+                if attempt >= self.max_attempts or time.monotonic() >= deadline:
+                    raise GeminiInvalidResponseError(
+                        f"Gemini gave no usable reply in {attempt} attempt(s): {e}") from e
+                self.retries += 1
+                continue
+            self.record("parse", time.monotonic() - parse_started)
+            return result
+
+    def record_usage(self, response):
+        """Token counts of one call, from the response's usage metadata."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        prompt = usage.prompt_token_count or 0
+        output = usage.candidates_token_count or 0
+        # Reasoning tokens of the 2.5 models, billed as output
+        thoughts = getattr(usage, "thoughts_token_count", 0) or 0
+        self.tokens["prompt"] += prompt
+        self.tokens["output"] += output
+        self.tokens["thoughts"] += thoughts
+        self.tokens["calls"] += 1
+        if self.usage_observer is not None:
+            self.usage_observer(prompt, output, thoughts)
+
+    def _call(self, model, contents, timeout: float):
+        def call():
+            # retry=None: the SDK would otherwise retry 429 / 503 by itself,
+            # past our deadline, backoff and circuit breaker
+            return model.generate_content(
+                contents, request_options={"timeout": timeout, "retry": None})
+
+        if not self.hedge_enabled:
+            return call()
+
+        response, hedged = hedged_call(
+            self._hedge_pool,
+            call,
+            hedge_after=self.latency.percentile(GEMINI_HEDGE_PERCENTILE),
+            # A hedge is an extra request, only send it if quota allows
+            can_hedge=self.limiter.try_acquire,
+            timeout=timeout,
+        )
+        if hedged:
+            self.hedges += 1
+        return response
+
+    def stats(self) -> dict:
+        calls = self.tokens["calls"]
+        return {
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.opened_count,
+            "calls": self.calls,
+            "retries": self.retries,
+            "errors": self.errors,
+            "hedges": self.hedges,
+            "invalid_responses": self.invalid_responses,
+            "error_classes": dict(self.error_classes),
+            "tokens": {
+                **self.tokens,
+                "prompt_per_call": self.tokens["prompt"] / calls if calls else 0.0,
+                "output_per_call": (self.tokens["output"] + self.tokens["thoughts"]) / calls
+                if calls else 0.0,
             },
-        ]
+            "latency_p50": self.latency.percentile(0.5),
+            "latency_p95": self.latency.percentile(0.95),
+        }
+
+
+gemini_client = GeminiClient()
+
+
+# Field meanings live in the response schema, the prompt only sets the task.
+# Bump PROMPT_VERSION with any change here or in the schema.
+PROMPT = (
+    "You are a currency authentication expert. Identify the banknote in the "
+    "image. Lower the confidence when unsure; mark fake or suspicious notes "
+    "as counterfeit."
+)
+
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "currency_code": {"type": "string", "description": "ISO 4217 code, e.g. SDG"},
+        "confidence": {"type": "number", "description": "0 to 1"},
+        "name_en": {"type": "string", "description": "e.g. 100 Sudanese Pounds"},
+        "name_ar": {"type": "string", "description": "Arabic translation of name_en"},
+        "denomination_value": {"type": "integer", "description": "e.g. 100, 200, 500, 1000"},
+        "is_counterfeit": {"type": "boolean"},
+    },
+    "required": ["currency_code", "confidence", "name_en", "name_ar",
+                 "denomination_value", "is_counterfeit"],
+}
+
+
+class CurrencyResult(BaseModel):
+    """What analyze_currency returns (as a dict)."""
+
+    currency_code: str
+    confidence: float = Field(ge=0, le=1)
+    name_en: str
+    name_ar: str
+    denomination_value: int
+    is_counterfeit: bool
+
+    @field_validator("currency_code")
+    @classmethod
+    def upper_code(cls, value: str) -> str:
+        return value.strip().upper()
+
+
+# Built once: the model carries the prompt and the JSON mode generation config
+gemini_model = genai.GenerativeModel(
+    MODEL_NAME,
+    system_instruction=PROMPT,
+    generation_config={
+        "response_mime_type": "application/json",
+        "response_schema": RESPONSE_SCHEMA,
+    },
+)
+
+
+def analyze_currency(image_bytes: bytes):
+    """
+    Sends image bytes to Gemini and returns structured JSON with:
+    currency_code, confidence, name_en, name_ar, denomination_value, is_counterfeit
+
+    image_bytes must already be a JPEG sized for the model
+    (see app.utils.image_utils.decode_image), it is sent as-is.
+    The reply is constrained to RESPONSE_SCHEMA; one that still does not
+    validate is asked for again (GeminiInvalidResponseError when none did).
+    """
+    return gemini_client.generate(
+        gemini_model,
+        [{"mime_type": "image/jpeg", "data": image_bytes}],
+        parse=parse_response,
     )
 
-    # 3) Extract text safely
-    raw_text = (response.text or "").strip()
-
-    # In case Gemini still sends markdown fences, strip them
-    if raw_text.startswith("```"):
-        # Remove first ```... line
-        lines = raw_text.splitlines()
-        # Drop first line if it starts with ```
-        if lines and lines[0].startswith("```"):
-            lines = lines[1:]
-        # Drop last line if it is just ```
-        if lines and lines[-1].strip() == "```":
-            lines = lines[:-1]
-        raw_text = "\n".join(lines).strip()
-
-    # 4) Parse JSON safely
-    try:
-        data = json.loads(raw_text)
-    except json.JSONDecodeError as e:
-        # Raise clear error for FastAPI to catch
-        raise ValueError(
-            f"Gemini returned invalid JSON. Raw output: {raw_text}"
-        ) from e
 
-    # 5) Basic validation / normalization
-    # Ensure required keys exist
-    required_keys = [
-        "currency_code",
-        "confidence",
-        "name_en",
-        "name_ar",
-        "denomination_value",
-        "is_counterfeit",
-    ]
-    for k in required_keys:
-        if k not in data:
-            raise ValueError(
-                f"Gemini response missing key '{k}'. Raw output: {raw_text}"
-            )
-
-    # Normalize types
+def parse_response(response) -> dict:
+    """Result dict out of the model's JSON reply (raises ValueError when unusable)."""
     try:
-        data["currency_code"] = str(data["currency_code"]).upper()
-        data["name_en"] = str(data["name_en"])
-        data["name_ar"] = str(data["name_ar"])
-        data["confidence"] = float(data["confidence"])
-        data["denomination_value"] = int(data["denomination_value"])
-        data["is_counterfeit"] = bool(data["is_counterfeit"])
-    except Exception as e:
+        raw_text = response.text
+    except ValueError as e:
+        # Blocked or empty candidate
+        raise ValueError(f"Gemini returned no text: {e}") from e
+    try:
+        # Parsed and validated in one pass by pydantic-core's JSON parser
+        return CurrencyResult.model_validate_json(raw_text).model_dump()
+    except ValidationError as e:
         raise ValueError(
-            f"Gemini response has wrong field types. Parsed: {data}"
+            f"Gemini returned an invalid result ({e.error_count()} error(s): "
+            f"{e.errors(include_url=False)[0]['msg']}). Raw output: {raw_text[:200]}"
         ) from e
-
-    return data
@@ -0,0 +1,185 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class GeminiError(Exception):
+    """Base class for errors raised by the resilient Gemini client."""
+
+
+class GeminiUnavailableError(GeminiError):
+    """Upstream is failing (circuit open or retries exhausted)."""
+
+
+class GeminiRateLimitedError(GeminiError):
+    """Client-side quota exhausted for longer than the call deadline."""
+
+
+class GeminiDeadlineError(GeminiError):
+    """The overall deadline for a call was exceeded."""
+
+
+class GeminiInvalidResponseError(GeminiError):
+    """Every reply within the attempts failed to parse into a result."""
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls fail fast for `reset_timeout` seconds. Then a single trial call is
+    let through: success closes the circuit, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self.opened_count = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def before_call(self):
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise GeminiUnavailableError(
+                        "Gemini circuit is open, upstream is degraded")
+                self._state = self.HALF_OPEN
+                self._trial_running = False
+            if self._state == self.HALF_OPEN:
+                if self._trial_running:
+                    raise GeminiUnavailableError(
+                        "Gemini circuit is half-open, trial call in progress")
+                self._trial_running = True
+
+    def cancel_call(self):
+        """The call allowed by before_call() was never sent (a half-open trial is freed)."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.opened_count += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class TokenBucket:
+    """Client-side rate limiter: `rate` requests per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self, timeout: float):
+        """Blocks until a token is available, at most `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate
+            if time.monotonic() + wait_for > deadline:
+                raise GeminiRateLimitedError("Gemini request quota exhausted")
+            time.sleep(wait_for)
+
+
+class LatencyTracker:
+    """Rolling window of call latencies, used to pick the hedging delay."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def backoff_delay(attempt: int, base: float, max_delay: float) -> float:
+    """Exponential backoff with full jitter (attempt starts at 1)."""
+    return random.uniform(0, min(max_delay, base * (2 ** (attempt - 1))))
+
+
+def hedged_call(pool: ThreadPoolExecutor, func, hedge_after: float | None,
+                can_hedge, timeout: float):
+    """
+    Runs `func()` and, if it has not finished after `hedge_after` seconds
+    and `can_hedge()` allows it, starts a second identical call. The first
+    successful result wins; the loser is left to finish in the background.
+    """
+    futures = [pool.submit(func)]
+    deadline = time.monotonic() + timeout
+    hedged = False
+
+    if hedge_after is not None and hedge_after < timeout:
+        done, _ = wait(futures, timeout=hedge_after)
+        if not done and can_hedge():
+            futures.append(pool.submit(func))
+            hedged = True
+
+    error = None
+    pending = set(futures)
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result(), hedged
+            error = future.exception()
+    if error is not None and not pending:
+        raise error
+    raise GeminiDeadlineError(f"Gemini call exceeded {timeout:.1f}s")
@@ -0,0 +1,73 @@
+"""baseline: users, system_logs, predictions
+
+The schema the app created with Base.metadata.create_all before
+migrations were introduced. Tables and indexes that already exist (a
+database created that way) are left alone, see app.utils.migrations.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.utils.migrations import create_table, create_index
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    create_table(
+        "users",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("full_name", sa.String(length=50), nullable=False),
+        sa.Column("email", sa.String(length=100), nullable=False),
+        sa.Column("hashed_password", sa.String(length=255), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("email"),
+        sa.UniqueConstraint("full_name"),
+    )
+    create_index("ix_users_id", "users", ["id"])
+
+    create_table(
+        "system_logs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("action", sa.String(length=100), nullable=False),
+        sa.Column("message", sa.Text(), nullable=True),
+        sa.Column("timestamp", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    create_index("ix_system_logs_id", "system_logs", ["id"])
+
+    create_table(
+        "predictions",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("currency_code", sa.String(length=10), nullable=False),
+        sa.Column("confidence", sa.Float(), nullable=False),
+        sa.Column("name_en", sa.String(length=100), nullable=False),
+        sa.Column("name_ar", sa.String(length=100), nullable=False),
+        sa.Column("denomination_value", sa.Integer(), nullable=True),
+        sa.Column("is_counterfeit", sa.Boolean(), nullable=False),
+        sa.Column("image_path", sa.String(length=255), nullable=False),
+        sa.Column("timestamp", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    create_index("ix_predictions_id", "predictions", ["id"])
+
+
+def downgrade():
+    op.drop_index("ix_predictions_id", table_name="predictions")
+    op.drop_table("predictions")
+    op.drop_index("ix_system_logs_id", table_name="system_logs")
+    op.drop_table("system_logs")
+    op.drop_index("ix_users_id", table_name="users")
+    op.drop_table("users")
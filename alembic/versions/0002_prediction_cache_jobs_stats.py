@@ -0,0 +1,91 @@
+"""prediction cache, jobs, daily stats, phash and history index
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.utils.migrations import add_column, create_table, create_index
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column("predictions", sa.Column("phash", sa.BigInteger(), nullable=True))
+    create_index(
+        "ix_predictions_user_ts_id", "predictions", ["user_id", "timestamp", "id"])
+
+    create_table(
+        "prediction_cache",
+        sa.Column("key", sa.String(length=64), nullable=False),
+        sa.Column("result", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("hits", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("key"),
+    )
+    create_index("ix_prediction_cache_created_at", "prediction_cache", ["created_at"])
+
+    create_table(
+        "prediction_jobs",
+        sa.Column("id", sa.String(length=36), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("image_path", sa.String(length=255), nullable=False),
+        sa.Column("callback_url", sa.String(length=500), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("run_after", sa.DateTime(), nullable=False),
+        sa.Column("locked_until", sa.DateTime(), nullable=True),
+        sa.Column("prediction_id", sa.Integer(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["prediction_id"], ["predictions.id"], ondelete="SET NULL"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    create_index("ix_prediction_jobs_user_id", "prediction_jobs", ["user_id"])
+    create_index(
+        "ix_prediction_jobs_status_run_after", "prediction_jobs", ["status", "run_after"])
+
+    create_table(
+        "prediction_user_daily_stats",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("currency_code", sa.String(length=10), nullable=False),
+        sa.Column("denomination_value", sa.Integer(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("counterfeit_count", sa.Integer(), nullable=False),
+        sa.Column("confidence_sum", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "day", "currency_code", "denomination_value"),
+    )
+
+    create_table(
+        "prediction_global_daily_stats",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("currency_code", sa.String(length=10), nullable=False),
+        sa.Column("denomination_value", sa.Integer(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("counterfeit_count", sa.Integer(), nullable=False),
+        sa.Column("confidence_sum", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("day", "currency_code", "denomination_value"),
+    )
+
+
+def downgrade():
+    op.drop_table("prediction_global_daily_stats")
+    op.drop_table("prediction_user_daily_stats")
+    op.drop_index("ix_prediction_jobs_status_run_after", table_name="prediction_jobs")
+    op.drop_index("ix_prediction_jobs_user_id", table_name="prediction_jobs")
+    op.drop_table("prediction_jobs")
+    op.drop_index("ix_prediction_cache_created_at", table_name="prediction_cache")
+    op.drop_table("prediction_cache")
+    op.drop_index("ix_predictions_user_ts_id", table_name="predictions")
+    with op.batch_alter_table("predictions") as batch:
+        batch.drop_column("phash")
@@ -0,0 +1,26 @@
+"""predictions.has_derivatives
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.utils.migrations import add_column
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column("predictions", sa.Column(
+        "has_derivatives", sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade():
+    with op.batch_alter_table("predictions") as batch:
+        batch.drop_column("has_derivatives")
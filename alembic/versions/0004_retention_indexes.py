@@ -0,0 +1,25 @@
+"""timestamp indexes for the retention job
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+from app.utils.migrations import create_index
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    create_index("ix_predictions_timestamp", "predictions", ["timestamp"])
+    create_index("ix_system_logs_timestamp", "system_logs", ["timestamp"])
+
+
+def downgrade():
+    op.drop_index("ix_system_logs_timestamp", table_name="system_logs")
+    op.drop_index("ix_predictions_timestamp", table_name="predictions")
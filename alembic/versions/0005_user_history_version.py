@@ -0,0 +1,28 @@
+"""users.history_version / history_changed_at (ETags of the history)
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.utils.migrations import add_column
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column("users", sa.Column(
+        "history_version", sa.Integer(), nullable=False, server_default="0"))
+    add_column("users", sa.Column("history_changed_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("history_changed_at")
+        batch.drop_column("history_version")
@@ -0,0 +1,32 @@
+"""predictions.timestamp NOT NULL (history cursors key on it)
+
+Rows without a timestamp get the oldest one of the table, so they stay at
+the end of the history instead of jumping to its top.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "UPDATE predictions SET timestamp = COALESCE("
+        "(SELECT MIN(timestamp) FROM predictions), CURRENT_TIMESTAMP) "
+        "WHERE timestamp IS NULL"
+    )
+    with op.batch_alter_table("predictions") as batch:
+        batch.alter_column("timestamp", existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table("predictions") as batch:
+        batch.alter_column("timestamp", existing_type=sa.DateTime(), nullable=True)
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from app.config import (
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL_SECONDS,
+    USER_CACHE_REDIS_URL,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    AUTH_TRUST_CLAIMS,
+)
+
+# A deleted user must stay rejected for as long as their tokens are valid
+TOMBSTONE_TTL_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:32]
+
+
+def user_snapshot(user) -> dict:
+    """The columns kept in the cache (never the password hash)."""
+    return {
+        "id": user.id,
+        "full_name": user.full_name,
+        "email": user.email,
+        "created_at": user.created_at.isoformat() if user.created_at else None,
+    }
+
+
+class MemoryUserStore:
+    """In-process LRU, each worker has its own copy."""
+
+    name = "memory"
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._deleted: dict[int, float] = {}
+        self.evictions = 0
+
+    async def get(self, user_id: int, key: str) -> tuple[dict | None, bool]:
+        """Returns (snapshot, deleted)."""
+        deleted_until = self._deleted.get(user_id)
+        if deleted_until is not None:
+            if deleted_until > time.monotonic():
+                return None, True
+            del self._deleted[user_id]
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+        expires_at, snapshot = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None, False
+        self._entries.move_to_end(key)
+        return snapshot, False
+
+    async def set(self, key: str, snapshot: dict, ttl: int):
+        self._entries[key] = (time.monotonic() + ttl, snapshot)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def mark_deleted(self, user_id: int):
+        prefix = f"{user_id}:"
+        for key in [k for k in self._entries if k.startswith(prefix)]:
+            del self._entries[key]
+        now = time.monotonic()
+        self._deleted = {u: t for u, t in self._deleted.items() if t > now}
+        self._deleted[user_id] = now + TOMBSTONE_TTL_SECONDS
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisUserStore:
+    """Shared between workers, so a profile deletion is seen by all of them."""
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError(
+                "USER_CACHE_REDIS_URL needs the redis package installed") from e
+        self._redis = redis.from_url(url)
+        self.evictions = 0
+
+    async def get(self, user_id: int, key: str) -> tuple[dict | None, bool]:
+        deleted, raw = await self._redis.mget(
+            f"user_cache:deleted:{user_id}", f"user_cache:{key}")
+        if deleted is not None:
+            return None, True
+        return (json.loads(raw) if raw is not None else None), False
+
+    async def set(self, key: str, snapshot: dict, ttl: int):
+        await self._redis.set(f"user_cache:{key}", json.dumps(snapshot), ex=ttl)
+
+    async def mark_deleted(self, user_id: int):
+        # Cached snapshots expire on their own, the tombstone hides them meanwhile
+        await self._redis.set(
+            f"user_cache:deleted:{user_id}", "1", ex=TOMBSTONE_TTL_SECONDS)
+
+    def size(self) -> int | None:
+        return None
+
+
+class UserCache:
+    """
+    Short-TTL cache of authenticated users, keyed by user id + token.
+
+    get_current_user reads it before querying the users table. Profile
+    deletion calls invalidate(), which also leaves a tombstone so the
+    still-valid tokens of a deleted user are rejected (see
+    get_current_user_readonly). With the memory store other workers keep
+    their copy for at most `ttl` seconds; the redis store has no such gap.
+    USER_CACHE_TTL_SECONDS=0 disables caching (tombstones still apply).
+    A store failure is treated as a miss, the database stays the authority.
+    """
+
+    def __init__(self, ttl: int, store):
+        self.ttl = ttl
+        self.store = store
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.errors = 0
+
+    @staticmethod
+    def _key(user_id: int, token: str) -> str:
+        return f"{user_id}:{token_digest(token)}"
+
+    async def get(self, user_id: int, token: str) -> tuple[dict | None, bool]:
+        """Returns (snapshot, deleted); both falsy means a miss."""
+        try:
+            snapshot, deleted = await self.store.get(user_id, self._key(user_id, token))
+        except Exception as e:
+            print(f"[UserCache] Lookup failed: {e}")
+            self.errors += 1
+            snapshot, deleted = None, False
+
+        if deleted:
+            self.rejected += 1
+        elif snapshot is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return snapshot, deleted
+
+    async def set(self, user, token: str):
+        if self.ttl <= 0:
+            return
+        try:
+            await self.store.set(self._key(user.id, token), user_snapshot(user), self.ttl)
+        except Exception as e:
+            print(f"[UserCache] Store failed: {e}")
+            self.errors += 1
+
+    async def invalidate(self, user_id: int):
+        try:
+            await self.store.mark_deleted(user_id)
+        except Exception as e:
+            print(f"[UserCache] Invalidation failed: {e}")
+            self.errors += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "store": self.store.name,
+            "size": self.store.size(),
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "evictions": self.store.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def parse_created_at(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value) if value else None
+
+
+# Shared cache for the whole app
+user_cache = UserCache(
+    ttl=USER_CACHE_TTL_SECONDS,
+    store=RedisUserStore(USER_CACHE_REDIS_URL) if USER_CACHE_REDIS_URL
+    else MemoryUserStore(USER_CACHE_SIZE),
+)
+
+# Trusted claims skip the users table, the tombstone is the only thing that
+# rejects a deleted user's tokens: every worker must see it
+if AUTH_TRUST_CLAIMS and user_cache.store.name != "redis":
+    raise RuntimeError(
+        "AUTH_TRUST_CLAIMS needs USER_CACHE_REDIS_URL (shared deletion tombstones)")
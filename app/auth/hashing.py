@@ -1,6 +1,25 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.config import (
+    BCRYPT_ROUNDS,
+    PASSWORD_HASH_POOL,
+    PASSWORD_HASH_WORKERS,
+    PASSWORD_HASH_MAX_QUEUE,
+)
+
+# min/max pinned to the configured cost: any other cost "needs update",
+# so changing BCRYPT_ROUNDS rehashes passwords on the next login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 
 def hash_password(password: str):
@@ -9,3 +28,117 @@ def hash_password(password: str):
 
 def verify_password(plain_password: str, hashed_password: str):
     return pwd_context.verify(plain_password, hashed_password)
+
+
+def verify_and_update(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """(valid, new hash when the stored one uses another cost, else None)"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordHasherBusyError(Exception):
+    """Raised when too many password hashes are already waiting."""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a dedicated pool so a login never blocks the event loop
+    (each hash is ~100-300 ms of CPU at cost 12).
+
+    - at most `workers` hashes run at the same time, which also caps the
+      CPU logins can take away from prediction traffic
+    - at most `max_queue` hashes wait, extra ones are rejected
+    - workers=0 hashes inline on the event loop (old behaviour)
+    """
+
+    def __init__(self, pool: str, workers: int, max_queue: int):
+        if pool not in ("thread", "process"):
+            raise ValueError(f"Unknown PASSWORD_HASH_POOL '{pool}'")
+        self.pool_kind = pool
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool = None
+        self._semaphore = asyncio.Semaphore(max(workers, 1))
+        self._waiting = 0
+
+        # Metrics
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.hash_time_total = 0.0
+        self.queue_wait_total = 0.0
+
+    def _get_pool(self):
+        # Created lazily: a process pool must not be forked at import time
+        if self._pool is None:
+            if self.pool_kind == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._pool
+
+    async def _run(self, func, *args):
+        if self.workers <= 0:
+            started_at = time.perf_counter()
+            result = func(*args)
+            self._record(started_at, 0.0)
+            return result
+
+        if self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusyError("Too many password checks in progress")
+
+        enqueued_at = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            started_at = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_pool(), func, *args)
+            self._record(started_at, started_at - enqueued_at)
+            return result
+        finally:
+            self._semaphore.release()
+
+    def _record(self, started_at: float, queue_wait: float):
+        self.completed += 1
+        self.hash_time_total += time.perf_counter() - started_at
+        self.queue_wait_total += queue_wait
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify_and_update(self, plain_password: str,
+                                hashed_password: str) -> tuple[bool, str | None]:
+        valid, new_hash = await self._run(verify_and_update, plain_password, hashed_password)
+        if valid and new_hash is not None:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def stats(self) -> dict:
+        return {
+            "pool": self.pool_kind if self.workers > 0 else "inline",
+            "workers": self.workers,
+            "rounds": BCRYPT_ROUNDS,
+            "waiting": self._waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "hash_time_avg": self.hash_time_total / self.completed if self.completed else 0.0,
+            "queue_wait_avg": self.queue_wait_total / self.completed if self.completed else 0.0,
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Shared hasher for the whole app
+password_hasher = PasswordHasher(
+    pool=PASSWORD_HASH_POOL,
+    workers=PASSWORD_HASH_WORKERS,
+    max_queue=PASSWORD_HASH_MAX_QUEUE,
+)
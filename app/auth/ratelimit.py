@@ -0,0 +1,120 @@
+import ipaddress
+import math
+import time
+
+from fastapi import Request
+
+from app.config import (
+    LOGIN_RATE_WINDOW_SECONDS,
+    LOGIN_RATE_LIMIT_PER_IP,
+    LOGIN_RATE_LIMIT_PER_EMAIL,
+    TRUSTED_PROXIES,
+)
+
+
+class RateLimitedError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many attempts, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class FixedWindowLimiter:
+    """
+    At most `limit` hits per key in each `window` seconds. In-process: with
+    several workers each one applies the limit on its own.
+    """
+
+    def __init__(self, limit: int, window: int, max_keys: int = 100_000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._counters: dict[str, tuple[float, int]] = {}
+        self.rejected = 0
+
+    def hit(self, key: str):
+        """Counts one attempt, raises RateLimitedError when over the limit."""
+        if self.limit <= 0:
+            return
+        now = time.monotonic()
+        window_start, count = self._counters.get(key, (now, 0))
+        if now - window_start >= self.window:
+            window_start, count = now, 0
+        if count >= self.limit:
+            self.rejected += 1
+            raise RateLimitedError(math.ceil(window_start + self.window - now))
+        self._counters[key] = (window_start, count + 1)
+        if len(self._counters) > self.max_keys:
+            self._prune(now)
+
+    def _prune(self, now: float):
+        self._counters = {
+            k: v for k, v in self._counters.items() if now - v[0] < self.window
+        }
+
+
+class LoginRateLimiter:
+    """
+    Per client IP (login + register) and per account email (login) limits.
+    Rejected attempts never reach bcrypt, so a login burst cannot eat the
+    CPU prediction requests need.
+    """
+
+    def __init__(self, per_ip: int, per_email: int, window: int):
+        self.by_ip = FixedWindowLimiter(per_ip, window)
+        self.by_email = FixedWindowLimiter(per_email, window)
+
+    def check(self, ip: str | None, email: str | None = None):
+        self.by_ip.hit(ip or "unknown")
+        if email is not None:
+            self.by_email.hit(email.strip().lower())
+
+    def stats(self) -> dict:
+        return {
+            "window_seconds": self.by_ip.window,
+            "per_ip": self.by_ip.limit,
+            "per_email": self.by_email.limit,
+            "rejected_ip": self.by_ip.rejected,
+            "rejected_email": self.by_email.rejected,
+        }
+
+
+class ClientAddress:
+    """
+    The client's IP behind trusted reverse proxies. X-Forwarded-For is read
+    from the right, the end our proxies appended: entries of trusted
+    proxies are skipped and the first other one is the client. Anything
+    further left was sent by the client and can be forged.
+    """
+
+    def __init__(self, trusted: list[str]):
+        self.trust_any_peer = "*" in trusted
+        self.networks = [ipaddress.ip_network(p, strict=False) for p in trusted if p != "*"]
+
+    def _is_proxy(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.networks)
+
+    def of(self, request: Request) -> str | None:
+        peer = request.client.host if request.client else None
+        if peer is None or not (self.trust_any_peer or self._is_proxy(peer)):
+            return peer
+        forwarded = [part.strip() for header in request.headers.getlist("x-forwarded-for")
+                     for part in header.split(",") if part.strip()]
+        for address in reversed(forwarded):
+            if not self._is_proxy(address):
+                return address
+        return forwarded[0] if forwarded else peer
+
+
+# Shared resolver of client addresses
+client_address = ClientAddress(TRUSTED_PROXIES)
+
+# Shared limiter for the auth routes
+login_rate_limiter = LoginRateLimiter(
+    per_ip=LOGIN_RATE_LIMIT_PER_IP,
+    per_email=LOGIN_RATE_LIMIT_PER_EMAIL,
+    window=LOGIN_RATE_WINDOW_SECONDS,
+)
@@ -1,29 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.database import get_db
 from app.auth.models import User
 from app.auth.utils import get_current_user
+from app.auth.cache import user_cache
 from app.auth.schemas import UserCreate, UserLogin, UserOut, UserUpdate
-from app.auth.hashing import hash_password, verify_password
+from app.auth.hashing import password_hasher, PasswordHasherBusyError
+from app.auth.ratelimit import client_address, login_rate_limiter, RateLimitedError
 from app.auth.utils import create_access_token
 from app.utils.logger import create_log
+from app.utils.metrics import span
+from app.prediction.stats import remove_user_from_rollups
+from app.prediction.retention import delete_predictions
+from app.models.prediction import Prediction
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+
+def check_rate_limit(request: Request, email: str | None = None):
+    try:
+        login_rate_limiter.check(client_address.of(request), email)
+    except RateLimitedError as e:
+        raise HTTPException(status_code=429, detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)})
+
+
+async def run_password_check(coro):
+    try:
+        # bcrypt in the hasher pool, including the wait for a worker
+        with span("auth.password"):
+            return await coro
+    except PasswordHasherBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": "1"})
+
 # -----------------------------
 # Register
 # -----------------------------
 
 
 @router.post("/register", response_model=UserOut)
-async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
+async def register(user: UserCreate, request: Request, db: AsyncSession = Depends(get_db)):
+    check_rate_limit(request)
     result = await db.execute(select(User).filter(User.email == user.email))
     existing_user = result.scalar_one_or_none()
     if existing_user:
         raise HTTPException(status_code=400, detail="Eready registered")
 
-    pw = hash_password(user.password)
+    pw = await run_password_check(password_hasher.hash(user.password))
     new_user = User(full_name=user.full_name,
                     email=user.email, hashed_password=pw,
                     )
@@ -41,13 +66,29 @@ async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
 # Login
 # -----------------------------
 @router.post("/login")
-async def login(user: UserLogin, db: AsyncSession = Depends(get_db)):
+async def login(user: UserLogin, request: Request, db: AsyncSession = Depends(get_db)):
+    # ✅ Before any bcrypt work: a burst of logins is rejected cheaply
+    check_rate_limit(request, user.email)
     result = await db.execute(select(User).filter(User.email == user.email))
     existing_user = result.scalar_one_or_none()
-    if not existing_user or not verify_password(user.password, existing_user.hashed_password):
+    if not existing_user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await run_password_check(
+        password_hasher.verify_and_update(user.password, existing_user.hashed_password))
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    access_token = create_access_token({"sub": str(existing_user.id)})
+    # BCRYPT_ROUNDS changed since this password was hashed: store the new hash
+    if new_hash is not None:
+        existing_user.hashed_password = new_hash
+        await db.commit()
+
+    access_token = create_access_token({
+        "sub": str(existing_user.id),
+        # Lets read-only endpoints skip the user lookup (AUTH_TRUST_CLAIMS)
+        "name": existing_user.full_name,
+        "email": existing_user.email,
+    })
     # Log login
     await create_log(db, action="LOGIN", message=f"User {existing_user.full_name} logged in", user_id=existing_user.id)
     return {"access_token": access_token, "token_type": "bearer"}
@@ -73,11 +114,18 @@ async def delete_profile(
 
     try:
 
-        # Log action
-        await create_log(db, action="DELETE_PROFILE", message=f"User {current_user.full_name} deleted profile", user_id=current_user.id)
+        # Log action (not linked to the user row, which is deleted below)
+        await create_log(db, action="DELETE_PROFILE", message=f"User {current_user.full_name} (id {current_user.id}) deleted profile")
 
+        # Predictions in short batches with their images, so the cascade
+        # below only has what was made meanwhile
+        await delete_predictions(Prediction.user_id == current_user.id)
+        # Predictions go with the user (cascade), take them out of global stats
+        await remove_user_from_rollups(db, current_user.id)
         await db.delete(current_user)
         await db.commit()
+        # Tokens of the deleted user stop working right away
+        await user_cache.invalidate(current_user.id)
 
         return {"message": "Profile deleted successfully"}
     except Exception as e:
@@ -1,14 +1,17 @@
 from datetime import datetime, timedelta
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, WebSocket, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from app.auth.models import User
-from app.database import get_db
+from app.database import get_db, AsyncSessionLocal
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.orm import make_transient_to_detached
 
 
-from app.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, AUTH_TRUST_CLAIMS, ADMIN_EMAILS
+from app.auth.cache import user_cache, parse_created_at
+from app.utils.metrics import span
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
@@ -20,28 +23,114 @@ def create_access_token(data: dict):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: AsyncSession = Depends(get_db)
-):
-    credentials_exception = HTTPException(
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+
+def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
+        if payload.get("sub") is None:
+            raise credentials_exception()
     except JWTError:
-        raise credentials_exception
+        raise credentials_exception()
+    return payload
+
+
+def detached_user(id: int, full_name: str, email: str, created_at=None) -> User:
+    """A User for a known row, built without querying it."""
+    user = User(id=id, full_name=full_name, email=email, created_at=created_at)
+    make_transient_to_detached(user)
+    return user
+
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db)
+):
+    payload = decode_token(token)
+    user_id = int(payload["sub"])
 
-    query = select(User).where(User.id == int(user_id))
-    result = await db.execute(query)
+    # ✅ Recently seen user: no query, the user is attached to this session
+    # as if it had been loaded (db.delete(current_user) keeps working)
+    with span("auth.user_cache"):
+        snapshot, deleted = await user_cache.get(user_id, token)
+    if deleted:
+        raise credentials_exception()
+    if snapshot is not None:
+        user = detached_user(
+            snapshot["id"], snapshot["full_name"], snapshot["email"],
+            parse_created_at(snapshot["created_at"]))
+        return await db.merge(user, load=False)
+
+    query = select(User).where(User.id == user_id)
+    with span("auth.user_query"):
+        result = await db.execute(query)
     user = result.scalars().first()
 
     if user is None:
-        raise credentials_exception
+        raise credentials_exception()
+    await user_cache.set(user, token)
     return user
+
+
+async def get_current_user_readonly(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    For endpoints that only read the user's own data. With
+    AUTH_TRUST_CLAIMS the user is built from the signed token claims, no
+    cache or database lookup beyond the deletion tombstone. The returned
+    User is not attached to the session, only read its columns.
+    """
+    if not AUTH_TRUST_CLAIMS:
+        return await get_current_user(token, db)
+
+    payload = decode_token(token)
+    if "name" not in payload or "email" not in payload:
+        # Token issued before claims were added
+        return await get_current_user(token, db)
+
+    user_id = int(payload["sub"])
+    _, deleted = await user_cache.get(user_id, token)
+    if deleted:
+        raise credentials_exception()
+    return detached_user(user_id, payload["name"], payload["email"])
+
+
+def is_admin(user: User) -> bool:
+    return (user.email or "").lower() in ADMIN_EMAILS
+
+
+async def get_admin_user(current_user: User = Depends(get_current_user)):
+    """
+    Users listed in ADMIN_EMAILS, 403 for everyone else. The email is the
+    one of the user row (cached or queried), never a token claim.
+    """
+    if not is_admin(current_user):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    return current_user
+
+
+async def get_websocket_user(websocket: WebSocket):
+    """
+    User of a WebSocket handshake, from the `Authorization: Bearer` header
+    or, for clients that cannot set headers (browsers), the `token` query
+    parameter. Raises the same 401 HTTPException as get_current_user. The
+    session is closed before returning, the connection may stay open for
+    minutes.
+    """
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer "):]
+    else:
+        token = websocket.query_params.get("token")
+    if not token:
+        raise credentials_exception()
+    async with AsyncSessionLocal() as db:
+        return await get_current_user_readonly(token, db)
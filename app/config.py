@@ -8,3 +8,211 @@ DATABASE_URL = os.getenv(
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+
+# Inference executor (Gemini calls run in a bounded thread pool)
+INFERENCE_MAX_CONCURRENCY = int(os.getenv("INFERENCE_MAX_CONCURRENCY", "8"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "32"))
+INFERENCE_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_TIMEOUT_SECONDS", "30"))
+INFERENCE_RETRY_AFTER_SECONDS = int(os.getenv("INFERENCE_RETRY_AFTER_SECONDS", "5"))
+# Waiting calls are served by weighted fair queuing over (user, priority):
+# interactive = single predictions and camera scans, bulk = batches and
+# async jobs. One user can hold at most this many of the queue slots
+# (0 = no limit; keep it above MAX_BATCH_FILES - INFERENCE_MAX_CONCURRENCY)
+INFERENCE_INTERACTIVE_WEIGHT = float(os.getenv("INFERENCE_INTERACTIVE_WEIGHT", "4"))
+INFERENCE_BULK_WEIGHT = float(os.getenv("INFERENCE_BULK_WEIGHT", "1"))
+INFERENCE_MAX_QUEUE_PER_USER = int(os.getenv("INFERENCE_MAX_QUEUE_PER_USER", "16"))
+
+# Inference quotas, counted in model calls (cache hits are free) over
+# sliding windows; 0 = no limit, the default. The global limit covers all
+# users together (e.g. the Gemini requests per minute). A per-minute quota
+# must be at least MAX_BATCH_FILES, or a full batch could never go through
+USER_QUOTA_PER_MINUTE = int(os.getenv("USER_QUOTA_PER_MINUTE", "0"))
+USER_QUOTA_PER_DAY = int(os.getenv("USER_QUOTA_PER_DAY", "0"))
+GLOBAL_QUOTA_PER_MINUTE = int(os.getenv("GLOBAL_QUOTA_PER_MINUTE", "0"))
+# redis://... to count across workers (otherwise each worker counts alone)
+QUOTA_REDIS_URL = os.getenv("QUOTA_REDIS_URL", "")
+
+# Prediction result cache (keyed on image hash + model + prompt version)
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "1024"))
+PREDICTION_CACHE_TTL_SECONDS = int(
+    os.getenv("PREDICTION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+PREDICTION_CACHE_PERSISTENT = os.getenv(
+    "PREDICTION_CACHE_PERSISTENT", "true").lower() == "true"
+
+# Upload ingest / image preprocessing
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1600"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "90"))
+
+# Quality gate: photos that are too small, blurry, dark / overexposed or
+# plain surfaces get a 422 instead of a model call. Sharpness (Laplacian
+# variance), brightness and contrast are measured on a greyscale copy
+# scaled to QUALITY_ANALYSIS_SIDE, on the 0-255 scale
+QUALITY_GATE_ENABLED = os.getenv("QUALITY_GATE_ENABLED", "true").lower() == "true"
+QUALITY_ANALYSIS_SIDE = int(os.getenv("QUALITY_ANALYSIS_SIDE", "512"))
+QUALITY_MIN_SIDE = int(os.getenv("QUALITY_MIN_SIDE", "240"))
+QUALITY_MAX_ASPECT_RATIO = float(os.getenv("QUALITY_MAX_ASPECT_RATIO", "4"))
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "15"))
+QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", "40"))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", "235"))
+# Share of pixels crushed to black / blown to white
+QUALITY_MAX_CLIPPED = float(os.getenv("QUALITY_MAX_CLIPPED", "0.6"))
+QUALITY_MIN_CONTRAST = float(os.getenv("QUALITY_MIN_CONTRAST", "12"))
+# Share of pixels on an edge; banknote print is dense, walls and desks are not
+QUALITY_MIN_DETAIL = float(os.getenv("QUALITY_MIN_DETAIL", "0.005"))
+
+# Batch prediction
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "20"))
+
+# Camera scanning (WebSocket /predict/stream): frames beyond STREAM_MAX_FPS
+# are dropped unseen, the sharpest usable frame of each window goes to the
+# model unless it is within STREAM_DEDUP_DISTANCE bits (dHash) of a frame
+# already analyzed. The answer is final after STREAM_STABLE_RESULTS distinct
+# frames agree, or at once with a confidence of STREAM_ACCEPT_CONFIDENCE
+STREAM_WINDOW_MS = int(os.getenv("STREAM_WINDOW_MS", "800"))
+STREAM_MAX_FPS = float(os.getenv("STREAM_MAX_FPS", "5"))
+STREAM_DEDUP_DISTANCE = int(os.getenv("STREAM_DEDUP_DISTANCE", "6"))
+STREAM_STABLE_RESULTS = int(os.getenv("STREAM_STABLE_RESULTS", "2"))
+STREAM_ACCEPT_CONFIDENCE = float(os.getenv("STREAM_ACCEPT_CONFIDENCE", "0.9"))
+STREAM_MAX_SECONDS = float(os.getenv("STREAM_MAX_SECONDS", "60"))
+# Open scanning sessions per worker
+STREAM_MAX_SESSIONS = int(os.getenv("STREAM_MAX_SESSIONS", "100"))
+
+# Async prediction jobs (POST /predict/?mode=async)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# false = run workers separately with `python -m app.prediction.jobs`
+JOB_WORKER_IN_PROCESS = os.getenv("JOB_WORKER_IN_PROCESS", "true").lower() == "true"
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "2"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("JOB_WEBHOOK_TIMEOUT_SECONDS", "5"))
+# Hosts callback_url may point to (comma separated, empty = any public host).
+# Private, loopback, link-local and reserved addresses are always refused.
+JOB_WEBHOOK_ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.getenv("JOB_WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()
+}
+
+# Prediction history pagination
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+
+# Response compression: gzip, br (brotli, needs the brotli-asgi package,
+# gzip for clients without it) or off. Smaller bodies are sent as they are;
+# images and event streams never are compressed
+HTTP_COMPRESSION = os.getenv("HTTP_COMPRESSION", "gzip").lower()
+HTTP_COMPRESSION_MIN_BYTES = int(os.getenv("HTTP_COMPRESSION_MIN_BYTES", "1024"))
+# 1-9 for gzip (brotli: 0-11); the default 9 costs a lot of CPU for little
+HTTP_COMPRESSION_LEVEL = int(os.getenv("HTTP_COMPRESSION_LEVEL", "5"))
+
+# System log sink: db (buffered bulk inserts), file / stdout (JSON lines),
+# direct (one insert + commit per entry, old behaviour)
+LOG_SINK = os.getenv("LOG_SINK", "db").lower()
+LOG_FILE_PATH = os.getenv("LOG_FILE_PATH", "logs/system_log.jsonl")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_FLUSH_INTERVAL_MS = int(os.getenv("LOG_FLUSH_INTERVAL_MS", "500"))
+LOG_FLUSH_BATCH_SIZE = int(os.getenv("LOG_FLUSH_BATCH_SIZE", "200"))
+
+# Authenticated user cache (skips the users lookup on every request)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "4096"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+# redis://... to share the cache (and deletions) between workers
+USER_CACHE_REDIS_URL = os.getenv("USER_CACHE_REDIS_URL", "")
+# Read-only endpoints trust the name/email claims signed into the token
+# (needs USER_CACHE_REDIS_URL, refused at startup without it)
+AUTH_TRUST_CLAIMS = os.getenv("AUTH_TRUST_CLAIMS", "false").lower() in ("1", "true", "yes")
+
+# Password hashing (bcrypt runs off the event loop)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# thread (bcrypt releases the GIL) or process; PASSWORD_HASH_WORKERS=0 runs inline
+PASSWORD_HASH_POOL = os.getenv("PASSWORD_HASH_POOL", "thread").lower()
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+# Login / register rate limits (per worker, fixed windows)
+LOGIN_RATE_WINDOW_SECONDS = int(os.getenv("LOGIN_RATE_WINDOW_SECONDS", "60"))
+LOGIN_RATE_LIMIT_PER_IP = int(os.getenv("LOGIN_RATE_LIMIT_PER_IP", "30"))
+LOGIN_RATE_LIMIT_PER_EMAIL = int(os.getenv("LOGIN_RATE_LIMIT_PER_EMAIL", "10"))
+# Reverse proxies whose X-Forwarded-For is believed (comma separated IPs or
+# networks, "*" = whatever the peer is, for hosts only reachable through
+# their proxy like Render). Empty = the socket peer is the client.
+TRUSTED_PROXIES = [p.strip() for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()]
+
+# Database engine (per uvicorn worker: pool_size + max_overflow connections)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+# Statements slower than this are logged (0 disables)
+DB_SLOW_QUERY_MS = int(os.getenv("DB_SLOW_QUERY_MS", "500"))
+# asyncpg prepared statement cache per connection, 0 behind pgbouncer
+# in transaction pooling mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# Optional read replica for history / stats reads
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "")
+# Schema comes from Alembic migrations (alembic upgrade head); true creates
+# the tables at startup instead (local SQLite, benchmarks)
+DB_CREATE_ALL = os.getenv("DB_CREATE_ALL", "false").lower() == "true"
+
+# Image storage: local (sharded directories) or s3 (any S3-compatible store)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+STORAGE_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", "app/static/uploads")
+# Public URL prefix of stored images (CDN, bucket website); for local
+# storage it defaults to the app's /static/uploads mount
+STORAGE_PUBLIC_BASE_URL = os.getenv("STORAGE_PUBLIC_BASE_URL", "")
+# Store uploads in the background while the model runs; the prediction
+# row is only committed once the write succeeded (503 otherwise)
+STORAGE_ASYNC_WRITES = os.getenv("STORAGE_ASYNC_WRITES", "true").lower() == "true"
+# Stored images older than this are deleted (0 keeps them forever)
+STORAGE_RETENTION_DAYS = int(os.getenv("STORAGE_RETENTION_DAYS", "0"))
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "uploads/")
+# MinIO / R2 / moto, empty for AWS
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "") or None
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_PRESIGN_TTL_SECONDS = int(os.getenv("S3_PRESIGN_TTL_SECONDS", "3600"))
+
+# Derivative images for history views (name:longest side in px)
+THUMBNAIL_SIZES = {
+    name: int(size)
+    for name, size in (
+        item.split(":") for item in os.getenv("THUMBNAIL_SIZES", "thumb:160,preview:640").split(",")
+    )
+}
+THUMBNAIL_FORMATS = tuple(os.getenv("THUMBNAIL_FORMATS", "webp,jpeg").lower().split(","))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "75"))
+# Background generation: concurrent renders and queued predictions (beyond
+# that, derivatives are made on demand the first time they are requested)
+THUMBNAIL_CONCURRENCY = int(os.getenv("THUMBNAIL_CONCURRENCY", "2"))
+THUMBNAIL_MAX_PENDING = int(os.getenv("THUMBNAIL_MAX_PENDING", "100"))
+# Lifetime of the signed on-demand derivative URLs (0 = they never expire)
+DERIVATIVE_URL_TTL_SECONDS = int(os.getenv("DERIVATIVE_URL_TTL_SECONDS", "86400"))
+
+# Bulk export (GET /predict/export)
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "5000"))
+# Users allowed to export every user's predictions (comma separated)
+ADMIN_EMAILS = {
+    email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()
+}
+
+# Retention job: predictions (with their images) and system logs older
+# than this are deleted (0 keeps them forever)
+PREDICTION_RETENTION_DAYS = int(os.getenv("PREDICTION_RETENTION_DAYS", "0"))
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "0"))
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "24"))
+# Rows per delete transaction and the pause between transactions, so bulk
+# deletes (retention, clear history) never hold locks for long
+DELETE_BATCH_ROWS = int(os.getenv("DELETE_BATCH_ROWS", "1000"))
+DELETE_BATCH_PAUSE_MS = int(os.getenv("DELETE_BATCH_PAUSE_MS", "20"))
+
+# Observability: Prometheus histograms/counters on /metrics (off: the
+# spans and middleware cost nothing but a flag check)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+# How often the event loop lag is sampled
+EVENT_LOOP_LAG_INTERVAL_MS = int(os.getenv("EVENT_LOOP_LAG_INTERVAL_MS", "500"))
+# OpenTelemetry traces over OTLP/HTTP (endpoint etc. from the standard
+# OTEL_EXPORTER_OTLP_* variables), needs the opentelemetry packages
+OTEL_ENABLED = os.getenv("OTEL_ENABLED", "false").lower() == "true"
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "currency-detector")
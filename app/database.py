@@ -1,8 +1,24 @@
+from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from dotenv import load_dotenv
 import os
+import time
+
+from app.config import (
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_ECHO,
+    DB_SLOW_QUERY_MS,
+    DB_STATEMENT_CACHE_SIZE,
+    DATABASE_REPLICA_URL,
+    METRICS_ENABLED,
+)
+from app.utils.metrics import db_query_seconds
 
 # Load environment variables
 load_dotenv()
@@ -12,14 +28,85 @@ if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set.")
 
 
+class SlowQueryLog:
+    """
+    Logs statements slower than `threshold_ms` (instead of echoing all of
+    them) and, with METRICS_ENABLED, records every statement's latency.
+    """
+
+    def __init__(self, threshold_ms: int):
+        self.threshold_ms = threshold_ms
+        self.count = 0
+        self.max_ms = 0.0
+
+    def attach(self, engine: AsyncEngine, name: str):
+        if self.threshold_ms <= 0 and not METRICS_ENABLED:
+            return
+        sync_engine = engine.sync_engine
+
+        @event.listens_for(sync_engine, "before_cursor_execute")
+        def before(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+        @event.listens_for(sync_engine, "after_cursor_execute")
+        def after(conn, cursor, statement, parameters, context, executemany):
+            elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+            # SELECT / INSERT / UPDATE / DELETE / BEGIN...
+            db_query_seconds.observe(
+                elapsed_ms / 1000, name, statement.split(None, 1)[0].upper())
+            if 0 < self.threshold_ms <= elapsed_ms:
+                self.count += 1
+                self.max_ms = max(self.max_ms, elapsed_ms)
+                print(f"[SlowQuery] {name} {elapsed_ms:.0f} ms: {' '.join(statement.split())[:500]}")
+
+        @event.listens_for(sync_engine, "handle_error")
+        def failed(context):
+            # after_cursor_execute does not run for a failed statement
+            if context.connection is not None and context.connection.info.get("query_start"):
+                context.connection.info["query_start"].pop()
+
+    def stats(self) -> dict:
+        return {"threshold_ms": self.threshold_ms, "count": self.count, "max_ms": self.max_ms}
+
+
+slow_query_log = SlowQueryLog(DB_SLOW_QUERY_MS)
+
+
+def build_engine(url: str, name: str) -> AsyncEngine:
+    """Async engine with the pool settings from app.config."""
+    kwargs = {"echo": DB_ECHO, "future": True}
+    if not url.startswith("sqlite"):
+        # SQLite has no server connections to pool
+        kwargs.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+        )
+    if url.startswith("postgresql+asyncpg"):
+        kwargs["connect_args"] = {
+            # SQLAlchemy's prepared statement cache and asyncpg's own one
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        }
+    new_engine = create_async_engine(url, **kwargs)
+    slow_query_log.attach(new_engine, name)
+    return new_engine
+
+
 # Create SQLAlchemy engine
 # engine = create_engine(DATABASE_URL)
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+engine = build_engine(DATABASE_URL, "primary")
+# Reads that tolerate replication lag go to the replica when there is one
+read_engine = build_engine(DATABASE_REPLICA_URL, "replica") if DATABASE_REPLICA_URL else engine
 
 # Create SessionLocal class for database sessions
 # SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 AsyncSessionLocal = sessionmaker(
     bind=engine, class_=AsyncSession, expire_on_commit=False)
+ReadSessionLocal = sessionmaker(
+    bind=read_engine, class_=AsyncSession, expire_on_commit=False)
 
 # Base class for all ORM models
 Base = declarative_base()
@@ -34,6 +121,33 @@ async def get_db():
         finally:
             await session.close()
 
+
+async def get_read_db():
+    """Session on the read replica (primary when none is configured)."""
+    async with ReadSessionLocal() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+def _pool_status(pool) -> dict:
+    if not hasattr(pool, "checkedout"):
+        return {"pool": type(pool).__name__}
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": pool.overflow(),
+    }
+
+
+def pool_stats() -> dict:
+    stats = {"primary": _pool_status(engine.pool), "slow_queries": slow_query_log.stats()}
+    if read_engine is not engine:
+        stats["replica"] = _pool_status(read_engine.pool)
+    return stats
+
 # Test the connection
 
 
@@ -43,6 +157,3 @@ async def test_connection():
             print("✅ Database connection successful!")
     except SQLAlchemyError as e:
         print("❌ Database connection failed:", e)
-
-
-
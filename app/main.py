@@ -1,14 +1,48 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
+from fastapi.responses import PlainTextResponse
 
 # from app.routers import currency
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from app.database import test_connection
-from app.database import engine, Base
+from app.database import engine, read_engine, Base, pool_stats
 from app.auth.routes import router as auth_router
 # Ensure models are imported
-from app.models import prediction, system_log, user
+from app import models  # noqa: F401
 from app.prediction.routes import router as predict_router
-# import asyncio
+from app.prediction.executor import inference_executor
+from app.prediction.cache import prediction_cache
+from app.prediction.quality import quality_gate
+from app.prediction.stream import scan_sessions
+from app.prediction.quota import usage_quota
+from app.prediction.versions import history_versions
+from app.prediction.jobs import job_worker
+from app.prediction.thumbnails import derivative_generator
+from app.prediction.retention import retention_job
+from app.config import (
+    JOB_WORKER_IN_PROCESS,
+    DB_CREATE_ALL,
+    METRICS_ENABLED,
+    HTTP_COMPRESSION,
+    HTTP_COMPRESSION_MIN_BYTES,
+    HTTP_COMPRESSION_LEVEL,
+)
+from app.utils.storage import storage
+from app.utils.logger import log_sink
+from app.auth.cache import user_cache
+from app.auth.hashing import password_hasher
+from app.auth.ratelimit import login_rate_limiter
+from app.auth.utils import get_admin_user
+from app.utils.metrics import (
+    MetricsMiddleware,
+    event_loop_monitor,
+    observe_gemini,
+    observe_gemini_usage,
+    registry,
+    shutdown_tracing,
+)
+from ai.gimini_client import gemini_client
+from ai.backends import load_backend
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 
@@ -20,8 +54,9 @@ BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
 
 STATIC_DIR.mkdir(parents=True, exist_ok=True)
-(STATIC_DIR / "uploads").mkdir(parents=True, exist_ok=True)
 
+# Uploaded images are only served from here with the local storage
+# backend; with S3 clients get presigned URLs to the bucket
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 # Allow frontend connection
@@ -31,15 +66,74 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # pagination and caching headers of /predict/history
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "Link", "ETag", "Last-Modified"],
 )
 # https://currency-detection-ui-v16.vercel.app/
 
+# Compress large JSON / CSV bodies (history pages, exports)
+if HTTP_COMPRESSION == "br":
+    try:
+        from brotli_asgi import BrotliMiddleware
+    except ImportError as e:
+        raise RuntimeError("HTTP_COMPRESSION=br needs the brotli-asgi package installed") from e
+    app.add_middleware(BrotliMiddleware, quality=min(HTTP_COMPRESSION_LEVEL, 11),
+                       minimum_size=HTTP_COMPRESSION_MIN_BYTES, gzip_fallback=True)
+elif HTTP_COMPRESSION == "gzip":
+    app.add_middleware(GZipMiddleware, minimum_size=HTTP_COMPRESSION_MIN_BYTES,
+                       compresslevel=HTTP_COMPRESSION_LEVEL)
+
+# Request latency by route
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 @app.on_event("startup")
 async def startup_event():
+    # Load the inference backend (local model) ONCE
+    backend = load_backend()
+    print(f"✅ Inference backend: {backend.name}")
+
     # test_connection()
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        print("✅ Database and tables created successfully")
+    # Schema is managed by Alembic (alembic upgrade head, see Procfile)
+    if DB_CREATE_ALL:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            print("✅ Database and tables created successfully")
+
+    # System logs are buffered and written in batches
+    if log_sink is not None:
+        log_sink.start()
+
+    await storage.start()
+    # Old predictions, images and system logs (when retention is configured)
+    retention_job.start()
+
+    if JOB_WORKER_IN_PROCESS:
+        job_worker.start()
+
+    if METRICS_ENABLED:
+        event_loop_monitor.start()
+        gemini_client.observer = observe_gemini
+        gemini_client.usage_observer = observe_gemini_usage
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_worker.stop()
+    await retention_job.stop()
+    await event_loop_monitor.stop()
+    await derivative_generator.stop()
+    # Uploads still being written (or deleted) in the background
+    await storage.close()
+    inference_executor.shutdown()
+    password_hasher.shutdown()
+    # Flush the buffered system logs last, the steps above may still log
+    if log_sink is not None:
+        await log_sink.stop()
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+    shutdown_tracing()
 
 
 @app.get("/")
@@ -47,6 +141,51 @@ def home():
     return {"message": "Currency Recognition API running"}
 
 
+# Component stats, on /health and (as gauges) on /metrics
+COMPONENT_STATS = {
+    "database": pool_stats,
+    # queue wait vs. model time for the inference executor
+    "inference": inference_executor.stats,
+    "quota": usage_quota.stats,
+    "history_etags": history_versions.stats,
+    "backend": lambda: load_backend().stats(),
+    "gemini": gemini_client.stats,
+    "prediction_cache": prediction_cache.stats,
+    "quality_gate": quality_gate.stats,
+    "stream": scan_sessions.stats,
+    "jobs": job_worker.stats,
+    "storage": storage.stats,
+    "thumbnails": derivative_generator.stats,
+    "retention": retention_job.stats,
+    "user_cache": user_cache.stats,
+    "password_hasher": password_hasher.stats,
+    "login_rate_limit": login_rate_limiter.stats,
+    "system_log": lambda: log_sink.stats() if log_sink is not None else {"sink": "direct"},
+    "event_loop": event_loop_monitor.stats,
+}
+for component, stats in COMPONENT_STATS.items():
+    registry.register_stats(component, stats)
+
+
+@app.get("/health")
+def health():
+    # Public (load balancer probes), the component details are admin only
+    return {"status": "ok"}
+
+
+@app.get("/health/details")
+def health_details(_=Depends(get_admin_user)):
+    return {"status": "ok", **{component: stats() for component, stats in COMPONENT_STATS.items()}}
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus scrape endpoint (METRICS_ENABLED)."""
+    if not METRICS_ENABLED:
+        return PlainTextResponse("Metrics are disabled (METRICS_ENABLED=false)\n", status_code=404)
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 # Authentication and Prediction Routers
 app.include_router(auth_router)
 app.include_router(predict_router)
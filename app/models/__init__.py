@@ -1,3 +1,6 @@
 from app.models.user import User
 from app.models.system_log import SystemLog
 from app.models.prediction import Prediction
+from app.models.prediction_cache import PredictionCacheEntry
+from app.models.prediction_job import PredictionJob
+from app.models.prediction_stats import UserDailyStats, GlobalDailyStats
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, ForeignKey, Boolean, Index, false
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -6,6 +6,12 @@ from app.database import Base
 
 class Prediction(Base):
     __tablename__ = "predictions"
+    __table_args__ = (
+        # history pages: WHERE user_id = ? ORDER BY timestamp DESC, id DESC
+        Index("ix_predictions_user_ts_id", "user_id", "timestamp", "id"),
+        # retention: WHERE timestamp < cutoff
+        Index("ix_predictions_timestamp", "timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey(
@@ -21,6 +27,11 @@ class Prediction(Base):
     is_counterfeit = Column(Boolean, nullable=False)  # 0 = False, 1 = True
     # stored file path
     image_path = Column(String(255), nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    # 64 bit perceptual hash (dHash) of the image, stored signed
+    phash = Column(BigInteger, nullable=True)
+    # thumbnail / preview derivatives exist in the image storage
+    has_derivatives = Column(Boolean, nullable=False, default=False, server_default=false())
+    # never NULL: history cursors are (timestamp, id)
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     user = relationship("User", back_populates="predictions")
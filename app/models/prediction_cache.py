@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text
+from datetime import datetime
+from app.database import Base
+
+
+class PredictionCacheEntry(Base):
+    __tablename__ = "prediction_cache"
+
+    # sha256 of image hash + model name + prompt version
+    key = Column(String(64), primary_key=True)
+    # JSON encoded analyze_currency result
+    result = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    hits = Column(Integer, nullable=False, default=0)
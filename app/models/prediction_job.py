@@ -0,0 +1,30 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index
+from datetime import datetime
+from app.database import Base
+
+
+class PredictionJob(Base):
+    __tablename__ = "prediction_jobs"
+    __table_args__ = (
+        # worker claim query: status = 'queued' AND run_after <= now
+        Index("ix_prediction_jobs_status_run_after", "status", "run_after"),
+    )
+
+    # uuid4, handed to the client to poll
+    id = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey(
+        "users.id", ondelete="CASCADE"), nullable=False, index=True)
+    # queued -> running -> succeeded / failed (running -> queued on retry)
+    status = Column(String(20), nullable=False, default="queued")
+    image_path = Column(String(255), nullable=False)
+    callback_url = Column(String(500), nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    # not picked up before this time (retry backoff)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # worker lease, an expired lease means the worker died
+    locked_until = Column(DateTime, nullable=True)
+    prediction_id = Column(Integer, ForeignKey(
+        "predictions.id", ondelete="SET NULL"), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,29 @@
+from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey
+from app.database import Base
+
+
+class UserDailyStats(Base):
+    """Per user, per day rollup of predictions (kept up to date on write)."""
+    __tablename__ = "prediction_user_daily_stats"
+
+    user_id = Column(Integer, ForeignKey(
+        "users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    currency_code = Column(String(10), primary_key=True)
+    # 0 when the model returned no denomination (primary keys can't be NULL)
+    denomination_value = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    counterfeit_count = Column(Integer, nullable=False, default=0)
+    confidence_sum = Column(Float, nullable=False, default=0.0)
+
+
+class GlobalDailyStats(Base):
+    """Same rollup across all users."""
+    __tablename__ = "prediction_global_daily_stats"
+
+    day = Column(Date, primary_key=True)
+    currency_code = Column(String(10), primary_key=True)
+    denomination_value = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    counterfeit_count = Column(Integer, nullable=False, default=0)
+    confidence_sum = Column(Float, nullable=False, default=0.0)
@@ -13,6 +13,7 @@ class SystemLog(Base):
     # e.g., 'LOGIN', 'PREDICT', 'REGISTER'
     action = Column(String(100), nullable=False)
     message = Column(Text, nullable=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    # indexed for retention (WHERE timestamp < cutoff)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
     user = relationship("User", back_populates="logs")
@@ -12,6 +12,9 @@ class User(Base):
     email = Column(String(100), unique=True, nullable=False)
     hashed_password = Column(String(255), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Bumped with every change to the user's predictions (history ETags)
+    history_version = Column(Integer, nullable=False, default=0, server_default="0")
+    history_changed_at = Column(DateTime, nullable=True)
 
     predictions = relationship("Prediction", back_populates="user",
                                cascade="all, delete-orphan", passive_deletes=True)
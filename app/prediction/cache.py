@@ -0,0 +1,135 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import (
+    PREDICTION_CACHE_SIZE,
+    PREDICTION_CACHE_TTL_SECONDS,
+    PREDICTION_CACHE_PERSISTENT,
+)
+from app.models.prediction_cache import PredictionCacheEntry
+from ai.backends import get_backend
+
+
+def make_cache_key(image_digest: str) -> str:
+    """
+    Builds the cache key from the sha256 hex digest of the uploaded image.
+    The backend name (model name, prompt version, local model file) is part
+    of the key so a model or prompt change never serves results produced by
+    the old one.
+    """
+    raw = f"{get_backend().name}:{image_digest}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class PredictionCache:
+    """
+    Two tier cache for analyze_currency results.
+
+    - memory: in-process LRU bounded by `max_size`
+    - persistent: `prediction_cache` table, shared by all workers/restarts
+
+    Both tiers expire entries after `ttl` seconds.
+    """
+
+    def __init__(self, max_size: int, ttl: int, persistent: bool):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persistent = persistent
+        self._memory: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+        # Metrics
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    async def get(self, db: AsyncSession, key: str) -> dict | None:
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if expires_at > time.monotonic():
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return dict(result)
+            del self._memory[key]
+
+        if self.persistent:
+            try:
+                row = await db.get(PredictionCacheEntry, key)
+                if row is not None:
+                    age = datetime.utcnow() - row.created_at
+                    if age < timedelta(seconds=self.ttl):
+                        row.hits += 1
+                        result = json.loads(row.result)
+                        self._remember(
+                            key, result, self.ttl - age.total_seconds())
+                        self.persistent_hits += 1
+                        return dict(result)
+                    # Expired, drop it now instead of waiting for a purge
+                    await db.delete(row)
+            except Exception as e:
+                print(f"[PredictionCache] Persistent lookup failed: {e}")
+                await db.rollback()
+
+        self.misses += 1
+        return None
+
+    async def set(self, db: AsyncSession, key: str, result: dict):
+        await self.set_many(db, [(key, result)])
+
+    async def set_many(self, db: AsyncSession, items: list[tuple[str, dict]]):
+        """Stores several results with a single commit."""
+        now = datetime.utcnow()
+        for key, result in items:
+            self._remember(key, result, self.ttl)
+            self.stores += 1
+
+        if self.persistent:
+            try:
+                for key, result in items:
+                    await db.merge(PredictionCacheEntry(
+                        key=key,
+                        result=json.dumps(result),
+                        created_at=now,
+                        hits=0,
+                    ))
+                await db.commit()
+            except Exception as e:
+                # Losing a cache write is harmless, the next scan recomputes it
+                print(f"[PredictionCache] Failed to store result: {e}")
+                await db.rollback()
+
+    def _remember(self, key: str, result: dict, ttl: float):
+        self._memory[key] = (time.monotonic() + ttl, dict(result))
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.persistent_hits
+        lookups = hits + self.misses
+        return {
+            "size": len(self._memory),
+            "max_size": self.max_size,
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+# Shared cache for the whole app
+prediction_cache = PredictionCache(
+    max_size=PREDICTION_CACHE_SIZE,
+    ttl=PREDICTION_CACHE_TTL_SECONDS,
+    persistent=PREDICTION_CACHE_PERSISTENT,
+)
@@ -0,0 +1,214 @@
+import asyncio
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import (
+    INFERENCE_MAX_CONCURRENCY,
+    INFERENCE_MAX_QUEUE,
+    INFERENCE_TIMEOUT_SECONDS,
+    INFERENCE_INTERACTIVE_WEIGHT,
+    INFERENCE_BULK_WEIGHT,
+    INFERENCE_MAX_QUEUE_PER_USER,
+)
+from app.utils.metrics import inference_queue_seconds, inference_model_seconds
+
+# Priorities of model calls: someone waiting on the screen vs. batches / jobs
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+
+class InferenceBusyError(Exception):
+    """Raised when the inference queue is full and the call was rejected."""
+
+
+class InferenceTimeoutError(Exception):
+    """Raised when a model call takes longer than the configured timeout."""
+
+
+class FairQueue:
+    """
+    Hands out `slots` by self-clocked weighted fair queuing. Every flow
+    (user, priority) stamps its waiting calls with finish tags:
+
+        start = max(virtual time, the flow's previous finish tag)
+        finish = start + 1 / weight
+
+    A freed slot goes to the smallest tag and the virtual time moves up to
+    it. While flows wait, a weight 4 flow is served four times as often as
+    a weight 1 flow, and a flow with many queued calls only pushes its own
+    tags back: a user's fiftieth call waits behind everyone else's first.
+    """
+
+    def __init__(self, slots: int):
+        self.free = slots
+        self._heap: list[tuple[float, int, asyncio.Future]] = []
+        self._finish: dict = {}
+        self._virtual_time = 0.0
+        self._seq = 0
+
+    def _tag(self, flow, weight: float) -> float:
+        finish = max(self._virtual_time, self._finish.get(flow, 0.0)) + 1 / weight
+        self._finish[flow] = finish
+        if len(self._finish) > 10_000:
+            # Tags at or behind the virtual time change nothing, drop them
+            self._finish = {f: t for f, t in self._finish.items() if t > self._virtual_time}
+        return finish
+
+    async def acquire(self, flow, weight: float):
+        finish = self._tag(flow, weight)
+        if self.free > 0 and not self._heap:
+            self.free -= 1
+            self._virtual_time = max(self._virtual_time, finish)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._heap, (finish, self._seq, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Given the slot just as the caller went away, pass it on
+                self.release()
+            raise
+
+    def release(self):
+        while self._heap:
+            finish, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                self._virtual_time = max(self._virtual_time, finish)
+                future.set_result(None)
+                return
+        self.free += 1
+
+
+class InferenceExecutor:
+    """
+    Runs blocking model calls (e.g. analyze_currency) in a thread pool so
+    the event loop keeps serving other requests.
+
+    - at most `max_concurrency` calls run at the same time
+    - at most `max_queue` calls wait for a free slot, extra calls are rejected,
+      and at most `max_queue_per_user` of them per user
+    - a freed slot goes to the next call in weighted fair order (FairQueue)
+    - each call is limited to `timeout` seconds of model time
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, timeout: float,
+                 weights: dict[str, float], max_queue_per_user: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.timeout = timeout
+        self.weights = weights
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="inference")
+        self._queue = FairQueue(max_concurrency)
+        self._waiting = 0
+        self._waiting_by_user: dict[int | None, int] = {}
+        self._running = 0
+
+        # Metrics
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.rejected = 0
+        self.rejected_user = 0
+        self.started_by_priority = {priority: 0 for priority in weights}
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.model_time_total = 0.0
+        self.model_time_max = 0.0
+
+    async def run(self, func, *args, user_id: int | None = None, priority: str = INTERACTIVE):
+        if self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise InferenceBusyError("Inference queue is full")
+        if (user_id is not None and self.max_queue_per_user > 0
+                and self._waiting_by_user.get(user_id, 0) >= self.max_queue_per_user):
+            self.rejected_user += 1
+            raise InferenceBusyError("Too many of your predictions are already waiting")
+
+        self.submitted += 1
+        enqueued_at = time.perf_counter()
+        self._waiting += 1
+        self._waiting_by_user[user_id] = self._waiting_by_user.get(user_id, 0) + 1
+        try:
+            await self._queue.acquire((user_id, priority), self.weights[priority])
+        finally:
+            self._waiting -= 1
+            remaining = self._waiting_by_user.pop(user_id) - 1
+            if remaining:
+                self._waiting_by_user[user_id] = remaining
+
+        started_at = time.perf_counter()
+        queue_wait = started_at - enqueued_at
+        self.started += 1
+        self.started_by_priority[priority] += 1
+        self.queue_wait_total += queue_wait
+        self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+        inference_queue_seconds.observe(queue_wait)
+
+        self._running += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self._pool, lambda: func(*args))
+        # The slot is released when the thread really finishes, not when the
+        # caller stops waiting, so a timed out call still counts against the cap.
+        future.add_done_callback(lambda _: self._release(started_at))
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise InferenceTimeoutError(
+                f"Model call exceeded {self.timeout:.0f}s") from None
+        except Exception:
+            self.failed += 1
+            raise
+
+    def _release(self, started_at: float):
+        model_time = time.perf_counter() - started_at
+        self.model_time_total += model_time
+        self.model_time_max = max(self.model_time_max, model_time)
+        inference_model_seconds.observe(model_time)
+        self.completed += 1
+        self._running -= 1
+        self._queue.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "waiting": self._waiting,
+            "waiting_users": len(self._waiting_by_user),
+            "weights": self.weights,
+            "started_by_priority": dict(self.started_by_priority),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "rejected": self.rejected,
+            "rejected_user": self.rejected_user,
+            "queue_wait_avg": self.queue_wait_total / self.started if self.started else 0.0,
+            "queue_wait_max": self.queue_wait_max,
+            "model_time_avg": self.model_time_total / self.completed if self.completed else 0.0,
+            "model_time_max": self.model_time_max,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Shared executor for the whole app
+inference_executor = InferenceExecutor(
+    max_concurrency=INFERENCE_MAX_CONCURRENCY,
+    max_queue=INFERENCE_MAX_QUEUE,
+    timeout=INFERENCE_TIMEOUT_SECONDS,
+    weights={INTERACTIVE: INFERENCE_INTERACTIVE_WEIGHT, BULK: INFERENCE_BULK_WEIGHT},
+    max_queue_per_user=INFERENCE_MAX_QUEUE_PER_USER,
+)
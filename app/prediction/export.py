@@ -0,0 +1,170 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app.config import EXPORT_BATCH_ROWS
+from app.database import ReadSessionLocal
+from app.models.prediction import Prediction
+
+EXPORT_COLUMNS = (
+    Prediction.id,
+    Prediction.user_id,
+    Prediction.timestamp,
+    Prediction.currency_code,
+    Prediction.denomination_value,
+    Prediction.name_en,
+    Prediction.name_ar,
+    Prediction.confidence,
+    Prediction.is_counterfeit,
+    Prediction.image_path,
+)
+FIELDS = tuple(column.key for column in EXPORT_COLUMNS)
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_query(user_id: int | None, date_from: datetime | None, date_to: datetime | None):
+    query = select(*EXPORT_COLUMNS)
+    if user_id is not None:
+        query = query.where(Prediction.user_id == user_id)
+    if date_from is not None:
+        query = query.where(Prediction.timestamp >= date_from)
+    if date_to is not None:
+        query = query.where(Prediction.timestamp < date_to)
+    # Served by ix_predictions_user_ts_id for a single user
+    return query.order_by(Prediction.timestamp, Prediction.id)
+
+
+async def stream_rows(query, batch_rows: int = EXPORT_BATCH_ROWS):
+    """
+    Yields lists of at most `batch_rows` rows through a server-side cursor,
+    so memory does not depend on the number of rows exported. Uses its own
+    session: the response body is sent after the request's session closed.
+    """
+    async with ReadSessionLocal() as session:
+        result = await session.stream(query.execution_options(yield_per=batch_rows))
+        async for partition in result.partitions():
+            yield partition
+
+
+def _csv_chunk(rows, header: bool) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(FIELDS)
+    for row in rows:
+        writer.writerow(
+            value.isoformat() if isinstance(value, datetime) else value for value in row)
+    return out.getvalue().encode("utf-8")
+
+
+def _ndjson_chunk(rows) -> bytes:
+    return "".join(
+        json.dumps(
+            {field: value.isoformat() if isinstance(value, datetime) else value
+             for field, value in zip(FIELDS, row)},
+            ensure_ascii=False,
+        ) + "\n"
+        for row in rows
+    ).encode("utf-8")
+
+
+async def export_csv(query):
+    header = True
+    async for rows in stream_rows(query):
+        # Formatting thousands of rows is CPU work, keep it off the event loop
+        yield await asyncio.to_thread(_csv_chunk, rows, header)
+        header = False
+    if header:
+        yield _csv_chunk([], True)
+
+
+async def export_ndjson(query):
+    async for rows in stream_rows(query):
+        yield await asyncio.to_thread(_ndjson_chunk, rows)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file for pyarrow: keeps the position, hands out the bytes."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("id", pa.int64()),
+        ("user_id", pa.int64()),
+        ("timestamp", pa.timestamp("us")),
+        ("currency_code", pa.string()),
+        ("denomination_value", pa.int64()),
+        ("name_en", pa.string()),
+        ("name_ar", pa.string()),
+        ("confidence", pa.float64()),
+        ("is_counterfeit", pa.bool_()),
+        ("image_path", pa.string()),
+    ])
+
+
+async def export_parquet(query):
+    """One Parquet row group per batch, streamed as soon as it is written."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd")
+
+    def write_batch(rows) -> bytes:
+        columns = list(zip(*rows))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema,
+        ))
+        return sink.take()
+
+    closed = False
+    try:
+        async for rows in stream_rows(query):
+            yield await asyncio.to_thread(write_batch, rows)
+        writer.close()
+        closed = True
+        # Footer
+        yield sink.take()
+    finally:
+        if not closed:
+            writer.close()
+
+
+EXPORTERS = {
+    "csv": export_csv,
+    "ndjson": export_ndjson,
+    "parquet": export_parquet,
+}
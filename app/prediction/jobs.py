@@ -0,0 +1,429 @@
+import asyncio
+import ipaddress
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import httpx
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+# Ensure models are imported (relationships resolve by name)
+import app.models  # noqa: F401
+from app.database import AsyncSessionLocal
+from app.models.prediction import Prediction
+from app.models.prediction_job import PredictionJob
+from app.models.user import User
+from app.utils.logger import create_log
+from app.utils.storage import storage, ImageNotFoundError
+from app.config import (
+    JOB_WORKERS,
+    JOB_POLL_INTERVAL_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_BASE_SECONDS,
+    JOB_LEASE_SECONDS,
+    JOB_WEBHOOK_TIMEOUT_SECONDS,
+    JOB_WEBHOOK_ALLOWED_HOSTS,
+)
+from app.prediction.executor import BULK
+from app.prediction.stats import apply_to_rollups
+from app.prediction.service import (
+    analyze_ingested,
+    build_prediction,
+    load_upload,
+    prediction_response,
+    remember_results,
+)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+MAX_RETRY_DELAY_SECONDS = 300
+
+
+class CallbackURLError(ValueError):
+    """callback_url is not an https URL of an allowed, public host."""
+
+
+async def check_callback_url(url: str):
+    """
+    Refuses webhooks that would make the server call itself or its network
+    (SSRF): the host must resolve to public addresses only, and be in
+    JOB_WEBHOOK_ALLOWED_HOSTS when it is set. Checked on enqueue and again
+    before sending, since DNS answers can change in between.
+    """
+    parts = urlsplit(url)
+    if parts.scheme != "https" or not parts.hostname:
+        raise CallbackURLError("callback_url must be an https URL")
+    host = parts.hostname.lower()
+    if JOB_WEBHOOK_ALLOWED_HOSTS and host not in JOB_WEBHOOK_ALLOWED_HOSTS:
+        raise CallbackURLError(f"callback_url host '{host}' is not allowed")
+
+    try:
+        port = parts.port or 443
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port)
+    except (OSError, ValueError):
+        raise CallbackURLError(f"callback_url host '{host}' cannot be resolved")
+    for *_, sockaddr in infos:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise CallbackURLError(f"callback_url host '{host}' is not a public address")
+
+
+async def enqueue_job(db: AsyncSession, user_id: int, image_path: str,
+                      callback_url: str | None = None) -> PredictionJob:
+    now = datetime.utcnow()
+    job = PredictionJob(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        status=QUEUED,
+        image_path=image_path,
+        callback_url=callback_url,
+        attempts=0,
+        run_after=now,
+        created_at=now,
+        updated_at=now,
+    )
+    db.add(job)
+    await db.commit()
+    job_worker.notify()
+    return job
+
+
+async def job_response(db: AsyncSession, job: PredictionJob) -> dict:
+    data = {
+        "job_id": job.id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+        "error": job.error,
+        "result": None,
+    }
+    if job.status == SUCCEEDED and job.prediction_id is not None:
+        prediction = await db.get(Prediction, job.prediction_id)
+        if prediction is not None:
+            data["result"] = prediction_response(
+                prediction, {"cached": False})
+    return data
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter."""
+    delay = min(MAX_RETRY_DELAY_SECONDS,
+                JOB_RETRY_BASE_SECONDS * (2 ** (attempts - 1)))
+    return random.uniform(delay / 2, delay)
+
+
+class Lease:
+    """
+    A claimed job's `locked_until`, renewed while the job runs (it can wait
+    long in the bulk queue). Results are only written while it is still the
+    job's lease: once it expired and another worker took the job over, the
+    late result is dropped instead of stored twice.
+    """
+
+    def __init__(self, job_id: str, until: datetime):
+        self.job_id = job_id
+        self.until = until
+        self.lost = False
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._renew())
+
+    async def _renew(self):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            async with self._lock:
+                until = datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)
+                async with AsyncSessionLocal() as db:
+                    renewed = await db.execute(self.guard(
+                        update(PredictionJob)).values(locked_until=until))
+                    await db.commit()
+                if renewed.rowcount != 1:
+                    self.lost = True
+                    return
+                self.until = until
+
+    def guard(self, statement):
+        """Limits an UPDATE of the job to while this lease holds it."""
+        return statement.where(
+            PredictionJob.id == self.job_id,
+            PredictionJob.status == RUNNING,
+            PredictionJob.locked_until == self.until,
+        )
+
+    async def stop(self):
+        """No renewal runs after this returns, `until` is final."""
+        if self._task is not None:
+            async with self._lock:
+                self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class JobWorker:
+    """
+    Pool of asyncio workers draining the `prediction_jobs` table.
+
+    Jobs are claimed with a lease (`locked_until`, see Lease). If a worker
+    or the whole process dies, the lease expires and the job is queued
+    again, so queued work survives restarts. Model errors (5xx) are retried
+    with backoff up to JOB_MAX_ATTEMPTS, bad input (4xx) fails the job
+    right away.
+    """
+
+    def __init__(self, workers: int, poll_interval: float):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: asyncio.Event | None = None
+        self._last_recovery = 0.0
+
+        # Metrics
+        self.processed = 0
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+        self.lost_leases = 0
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._run(), name=f"prediction-job-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wakes idle workers right away after an in-process enqueue."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                lease = await self._claim()
+            except Exception as e:
+                print(f"[JobWorker] Failed to claim job: {e}")
+                lease = None
+
+            if lease is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._process(lease)
+            except Exception as e:
+                # Lease expiry puts the job back in the queue
+                print(f"[JobWorker] Job {lease.job_id} crashed: {e}")
+
+    async def _claim(self) -> Lease | None:
+        async with AsyncSessionLocal() as db:
+            now = datetime.utcnow()
+
+            # Jobs whose worker died come back to the queue
+            if time.monotonic() - self._last_recovery > JOB_LEASE_SECONDS / 4:
+                self._last_recovery = time.monotonic()
+                await db.execute(
+                    update(PredictionJob)
+                    .where(PredictionJob.status == RUNNING,
+                           PredictionJob.locked_until < now)
+                    .values(status=QUEUED, locked_until=None, updated_at=now)
+                )
+
+            job_id = (await db.execute(
+                select(PredictionJob.id)
+                .where(PredictionJob.status == QUEUED,
+                       PredictionJob.run_after <= now)
+                .order_by(PredictionJob.run_after)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )).scalar_one_or_none()
+            if job_id is None:
+                await db.commit()
+                return None
+
+            # Guarded on status so two workers can never both win the job
+            until = now + timedelta(seconds=JOB_LEASE_SECONDS)
+            claimed = await db.execute(
+                update(PredictionJob)
+                .where(PredictionJob.id == job_id,
+                       PredictionJob.status == QUEUED)
+                .values(
+                    status=RUNNING,
+                    attempts=PredictionJob.attempts + 1,
+                    locked_until=until,
+                    updated_at=now,
+                )
+            )
+            await db.commit()
+            return Lease(job_id, until) if claimed.rowcount == 1 else None
+
+    async def _process(self, lease: Lease):
+        lease.start()
+        try:
+            await self._run_job(lease)
+        finally:
+            await lease.stop()
+
+    async def _run_job(self, lease: Lease):
+        async with AsyncSessionLocal() as db:
+            job = await db.get(PredictionJob, lease.job_id)
+            if job is None:
+                return
+            user = await db.get(User, job.user_id)
+            self.processed += 1
+
+            try:
+                upload = await load_upload(job.image_path)
+                analyzed = await analyze_ingested(
+                    upload, job.image_path, db, asyncio.Lock(),
+                    user_id=job.user_id, priority=BULK)
+            except Exception as e:
+                await self._fail(db, job, lease, e)
+                return
+
+            prediction = build_prediction(job.user_id, analyzed)
+            db.add(prediction)
+            await db.flush()
+            await apply_to_rollups(db, [prediction])
+
+            # ✅ Only while the job is still ours: a worker that took it over
+            # after our lease expired stores the result, this one is dropped
+            await lease.stop()
+            if not await self._finish(db, job, lease, status=SUCCEEDED,
+                                      prediction_id=prediction.id, error=None):
+                return
+            result = analyzed["result"]
+            await create_log(
+                db,
+                action="PREDICT",
+                message=f"User {user.full_name if user else job.user_id} predicted {result['name_en']} ({result['confidence']}%)",
+                user_id=job.user_id,
+                commit=False,
+            )
+            await db.commit()
+            self.succeeded += 1
+
+            await remember_results(db, [(prediction, analyzed)])
+            await self._send_webhook(db, job)
+
+    async def _finish(self, db: AsyncSession, job: PredictionJob, lease: Lease, **values) -> bool:
+        """
+        Writes the job's outcome if `lease` still holds it; otherwise rolls
+        back everything of this run (prediction, rollups) and returns False.
+        """
+        values.update(locked_until=None, updated_at=datetime.utcnow())
+        finished = await db.execute(
+            lease.guard(update(PredictionJob))
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if finished.rowcount != 1:
+            await db.rollback()
+            self.lost_leases += 1
+            print(f"[JobWorker] Lost the lease of job {lease.job_id}, result dropped")
+            return False
+        # What the row now holds (job_response / the webhook read it)
+        for name, value in values.items():
+            set_committed_value(job, name, value)
+        return True
+
+    async def _fail(self, db: AsyncSession, job: PredictionJob, lease: Lease, error: Exception):
+        if isinstance(error, HTTPException):
+            # Over quota: retried later like an upstream outage
+            transient = error.status_code >= 500 or error.status_code == 429
+            message = str(error.detail)
+        else:
+            # Missing upload file etc. will not fix itself
+            transient = not isinstance(
+                error, (ImageNotFoundError, FileNotFoundError, ValueError))
+            message = str(error)
+
+        await lease.stop()
+        if transient and job.attempts < JOB_MAX_ATTEMPTS:
+            run_after = datetime.utcnow() + timedelta(seconds=retry_delay(job.attempts))
+            if not await self._finish(db, job, lease, status=QUEUED, error=message,
+                                      run_after=run_after):
+                return
+            self.retried += 1
+        else:
+            if not await self._finish(db, job, lease, status=FAILED, error=message):
+                return
+            self.failed += 1
+        await db.commit()
+
+        if job.status == FAILED:
+            await self._send_webhook(db, job)
+
+    async def _send_webhook(self, db: AsyncSession, job: PredictionJob):
+        if not job.callback_url:
+            return
+        try:
+            await check_callback_url(job.callback_url)
+            payload = await job_response(db, job)
+            # A redirect could point anywhere, it is not followed
+            async with httpx.AsyncClient(
+                timeout=JOB_WEBHOOK_TIMEOUT_SECONDS, follow_redirects=False
+            ) as client:
+                await client.post(
+                    job.callback_url,
+                    content=_json_dumps(payload),
+                    headers={"Content-Type": "application/json"},
+                )
+        except Exception as e:
+            # Best effort, the client can still poll the job
+            print(f"[JobWorker] Webhook for job {job.id} failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "processed": self.processed,
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "failed": self.failed,
+            "lost_leases": self.lost_leases,
+        }
+
+
+def _json_dumps(data: dict) -> str:
+    return json.dumps(data, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v))
+
+
+# Shared worker pool for the whole app
+job_worker = JobWorker(workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL_SECONDS)
+
+
+async def main():
+    """Standalone worker process: python -m app.prediction.jobs"""
+    job_worker.start()
+    print(f"✅ Prediction job worker running ({job_worker.workers} workers)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await job_worker.stop()
+        await storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.config import (
+    QUALITY_GATE_ENABLED,
+    QUALITY_ANALYSIS_SIDE,
+    QUALITY_MIN_SIDE,
+    QUALITY_MAX_ASPECT_RATIO,
+    QUALITY_MIN_SHARPNESS,
+    QUALITY_MIN_BRIGHTNESS,
+    QUALITY_MAX_BRIGHTNESS,
+    QUALITY_MAX_CLIPPED,
+    QUALITY_MIN_CONTRAST,
+    QUALITY_MIN_DETAIL,
+)
+from app.utils.image_utils import DecodedImage
+
+# Neighbouring pixels differing by more than this count as an edge
+EDGE_STEP = 24
+
+
+class QualityRejectedError(ValueError):
+    """Photo is not usable; `reasons` say what to fix."""
+
+    def __init__(self, reasons: list[dict], measures: dict):
+        super().__init__(", ".join(reason["message"] for reason in reasons))
+        self.reasons = reasons
+        self.measures = measures
+
+    def detail(self) -> dict:
+        return {
+            "message": "Photo is not usable, please retake it",
+            "reasons": self.reasons,
+            "measures": self.measures,
+        }
+
+
+def measure(image: Image.Image, analysis_side: int) -> dict:
+    """
+    Sharpness, exposure and detail of a greyscale copy scaled to
+    `analysis_side`, so the numbers do not depend on the upload size.
+    """
+    image = image.convert("L")
+    # reduce() (integer box filter) does most of the shrinking, a lot
+    # cheaper than resampling the full image
+    factor = max(image.size) // analysis_side
+    if factor > 1:
+        image = image.reduce(factor)
+    scale = analysis_side / max(image.size)
+    if scale < 1:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.Resampling.BILINEAR)
+    grey = np.asarray(image)
+    pixels = grey.astype(np.float32)
+
+    # Variance of the 4-neighbour Laplacian: low when there are no sharp edges
+    laplacian = (pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1]
+                 + pixels[2:, 1:-1] - 4 * pixels[1:-1, 1:-1])
+    histogram = np.bincount(grey.ravel(), minlength=256)
+    total = grey.size
+    # Fine print: share of pixels with a strong step to their right / lower neighbour
+    steps = np.abs(np.diff(pixels, axis=1))[:-1, :] + np.abs(np.diff(pixels, axis=0))[:, :-1]
+
+    return {
+        "sharpness": float(laplacian.var()) if laplacian.size else 0.0,
+        "brightness": float(pixels.mean()),
+        "contrast": float(pixels.std()),
+        "dark_clipped": float(histogram[:16].sum() / total),
+        "bright_clipped": float(histogram[240:].sum() / total),
+        "detail": float((steps > EDGE_STEP).mean()) if steps.size else 0.0,
+    }
+
+
+class QualityGate:
+    """
+    Cheap CPU checks on the decoded upload, run just before the model call:
+    a photo that would only come back with a low confidence result gets a
+    422 with what to fix instead, in a few milliseconds.
+
+    Exposure problems hide everything else, so sharpness and banknote
+    likeness (contrast, print detail) are only judged on well exposed photos.
+    """
+
+    def __init__(self, enabled: bool, analysis_side: int, min_side: int,
+                 max_aspect_ratio: float, min_sharpness: float, min_brightness: float,
+                 max_brightness: float, max_clipped: float, min_contrast: float,
+                 min_detail: float):
+        self.enabled = enabled
+        self.analysis_side = analysis_side
+        self.min_side = min_side
+        self.max_aspect_ratio = max_aspect_ratio
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_clipped = max_clipped
+        self.min_contrast = min_contrast
+        self.min_detail = min_detail
+
+        # Metrics
+        self.checked = 0
+        self.rejected = 0
+        self.reasons: dict[str, int] = {}
+        self.total_seconds = 0.0
+
+    def reasons_for(self, original_size: tuple[int, int], measures: dict) -> list[dict]:
+        reasons = []
+
+        def reject(code: str, message: str):
+            reasons.append({"code": code, "message": message})
+
+        width, height = original_size
+        if min(width, height) < self.min_side:
+            reject("too_small", f"Photo is too small ({width}x{height}), the short side "
+                                f"needs at least {self.min_side} px")
+        aspect_ratio = max(width, height) / max(1, min(width, height))
+        if aspect_ratio > self.max_aspect_ratio:
+            reject("aspect_ratio", f"Photo is {aspect_ratio:.1f} times wider than high, "
+                                   f"frame the whole banknote")
+
+        exposed = True
+        if measures["brightness"] < self.min_brightness or measures["dark_clipped"] > self.max_clipped:
+            reject("too_dark", "Photo is too dark, add light or move closer to a window")
+            exposed = False
+        elif measures["brightness"] > self.max_brightness or measures["bright_clipped"] > self.max_clipped:
+            reject("overexposed", "Photo is overexposed, avoid direct light and flash glare")
+            exposed = False
+
+        if exposed:
+            if measures["contrast"] < self.min_contrast:
+                reject("not_a_banknote", "No banknote found, fill the frame with the note")
+            elif measures["sharpness"] < self.min_sharpness:
+                reject("blurry", "Photo is blurry, hold the camera still and let it focus")
+            elif measures["detail"] < self.min_detail:
+                reject("not_a_banknote", "No banknote print found, fill the frame with the note")
+        return reasons
+
+    def check(self, image: DecodedImage):
+        """Raises QualityRejectedError for an unusable photo (blocking, run in a thread)."""
+        if not self.enabled:
+            return
+        started = time.perf_counter()
+        measures = measure(image.image, self.analysis_side)
+        reasons = self.reasons_for(image.original_size, measures)
+        self.total_seconds += time.perf_counter() - started
+        self.checked += 1
+        if reasons:
+            self.rejected += 1
+            for reason in reasons:
+                self.reasons[reason["code"]] = self.reasons.get(reason["code"], 0) + 1
+            raise QualityRejectedError(
+                reasons, {name: round(value, 4) for name, value in measures.items()})
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "checked": self.checked,
+            "rejected": self.rejected,
+            # The gate only sees uploads headed for the model
+            "model_calls_saved": self.rejected,
+            "reasons": dict(self.reasons),
+            "avg_check_ms": self.total_seconds / self.checked * 1000 if self.checked else 0.0,
+        }
+
+
+# Shared gate for the whole app
+quality_gate = QualityGate(
+    enabled=QUALITY_GATE_ENABLED,
+    analysis_side=QUALITY_ANALYSIS_SIDE,
+    min_side=QUALITY_MIN_SIDE,
+    max_aspect_ratio=QUALITY_MAX_ASPECT_RATIO,
+    min_sharpness=QUALITY_MIN_SHARPNESS,
+    min_brightness=QUALITY_MIN_BRIGHTNESS,
+    max_brightness=QUALITY_MAX_BRIGHTNESS,
+    max_clipped=QUALITY_MAX_CLIPPED,
+    min_contrast=QUALITY_MIN_CONTRAST,
+    min_detail=QUALITY_MIN_DETAIL,
+)
@@ -0,0 +1,247 @@
+import math
+import time
+
+from app.config import (
+    MAX_BATCH_FILES,
+    USER_QUOTA_PER_MINUTE,
+    USER_QUOTA_PER_DAY,
+    GLOBAL_QUOTA_PER_MINUTE,
+    QUOTA_REDIS_URL,
+)
+
+MINUTE = 60
+DAY = 24 * 3600
+
+
+class QuotaExceededError(Exception):
+    def __init__(self, message: str, retry_after: int, headers: dict):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.headers = {"Retry-After": str(retry_after), **headers}
+
+
+class MemoryUsageStore:
+    """Counters of this worker only."""
+
+    name = "memory"
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._counters: dict[str, tuple[float, int]] = {}
+
+    async def get_many(self, keys: list[str]) -> list[int]:
+        now = time.time()
+        values = []
+        for key in keys:
+            entry = self._counters.get(key)
+            values.append(entry[1] if entry is not None and entry[0] > now else 0)
+        return values
+
+    async def increment(self, keys: list[tuple[str, int]], amount: int = 1):
+        """(key, ttl seconds) pairs, each counter is incremented by `amount`."""
+        now = time.time()
+        for key, ttl in keys:
+            expires_at, count = self._counters.get(key, (now + ttl, 0))
+            self._counters[key] = (expires_at, max(0, count + amount))
+        if len(self._counters) > self.max_keys:
+            self._counters = {k: v for k, v in self._counters.items() if v[0] > now}
+
+    def size(self) -> int:
+        return len(self._counters)
+
+
+class RedisUsageStore:
+    """Shared between workers, so the limits hold for the whole deployment."""
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError(
+                "QUOTA_REDIS_URL needs the redis package installed") from e
+        self._redis = redis.from_url(url)
+
+    async def get_many(self, keys: list[str]) -> list[int]:
+        return [max(0, int(value or 0)) for value in await self._redis.mget(keys)]
+
+    async def increment(self, keys: list[tuple[str, int]], amount: int = 1):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for key, ttl in keys:
+                pipe.incrby(key, amount)
+                pipe.expire(key, ttl)
+            await pipe.execute()
+
+    def size(self) -> int | None:
+        return None
+
+
+class UsageQuota:
+    """
+    Per-user (and optional global) limits on model calls over sliding
+    windows. Each window is approximated from two fixed buckets, the
+    previous one weighted by how much of it still overlaps the window:
+
+        used = previous * (1 - elapsed / window) + current
+
+    Checking and counting are two store round trips, so concurrent calls
+    can overshoot a limit by a few. A store failure lets the call through.
+    A call is counted when it is admitted (so concurrent calls see each
+    other) and refunded when it ends without a result.
+    """
+
+    def __init__(self, per_minute: int, per_day: int, global_per_minute: int, store,
+                 batch_size: int = 0):
+        # A batch is charged call by call, a smaller quota always cuts it short
+        for name, limit in (("USER_QUOTA_PER_MINUTE", per_minute),
+                            ("USER_QUOTA_PER_DAY", per_day),
+                            ("GLOBAL_QUOTA_PER_MINUTE", global_per_minute)):
+            if 0 < limit < batch_size:
+                raise ValueError(
+                    f"{name}={limit} is below MAX_BATCH_FILES={batch_size}")
+        self.store = store
+        # (name, window seconds, limit, per user)
+        self.limits = [
+            limit for limit in (
+                ("minute", MINUTE, per_minute, True),
+                ("day", DAY, per_day, True),
+                ("global", MINUTE, global_per_minute, False),
+            )
+            if limit[2] > 0
+        ]
+
+        # Metrics
+        self.granted = 0
+        self.refunded = 0
+        self.rejected: dict[str, int] = {name: 0 for name, *_ in self.limits}
+        self.errors = 0
+
+    @staticmethod
+    def _bucket_keys(name: str, owner, window: int, now: float) -> tuple[str, str]:
+        index = int(now // window)
+        return (f"quota:{name}:{owner}:{index - 1}", f"quota:{name}:{owner}:{index}")
+
+    async def _usage(self, user_id: int | None, limits: list, now: float) -> list[dict]:
+        keys = []
+        for name, window, _, per_user in limits:
+            keys.extend(self._bucket_keys(name, user_id if per_user else "all", window, now))
+        values = await self.store.get_many(keys)
+
+        usage = []
+        for i, (name, window, limit, per_user) in enumerate(limits):
+            previous, current = values[2 * i], values[2 * i + 1]
+            elapsed = now % window
+            usage.append({
+                "name": name,
+                "window": window,
+                "limit": limit,
+                "per_user": per_user,
+                "previous": previous,
+                "current": current,
+                "used": previous * (1 - elapsed / window) + current,
+                "reset": window - elapsed,
+            })
+        return usage
+
+    @staticmethod
+    def _retry_after(entry: dict) -> int:
+        """Seconds until one more call fits."""
+        excess = entry["used"] + 1 - entry["limit"]
+        if entry["current"] + 1 > entry["limit"] or entry["previous"] == 0:
+            # Even without the previous bucket it is full: wait for the next one
+            return max(1, math.ceil(entry["reset"]))
+        # The previous bucket's share shrinks linearly
+        return max(1, math.ceil(excess / entry["previous"] * entry["window"]))
+
+    @staticmethod
+    def _headers(entry: dict) -> dict:
+        return {
+            "X-RateLimit-Limit": str(entry["limit"]),
+            "X-RateLimit-Remaining": str(max(0, math.floor(entry["limit"] - entry["used"]))),
+            "X-RateLimit-Reset": str(math.ceil(entry["reset"])),
+        }
+
+    async def acquire(self, user_id: int | None) -> list[tuple[str, int]] | None:
+        """
+        Counts one model call, raises QuotaExceededError when over a limit.
+        Returns the charge to pass to refund() if the call gives no result.
+        """
+        if not self.limits:
+            return None
+        now = time.time()
+        try:
+            usage = await self._usage(user_id, self.limits, now)
+        except Exception as e:
+            print(f"[Quota] Usage lookup failed: {e}")
+            self.errors += 1
+            return None
+
+        for entry in usage:
+            if entry["used"] + 1 > entry["limit"]:
+                self.rejected[entry["name"]] += 1
+                if entry["per_user"]:
+                    message = f"Prediction quota of {entry['limit']} per {entry['name']} reached"
+                else:
+                    message = f"Prediction capacity of {entry['limit']} per minute reached"
+                raise QuotaExceededError(
+                    message, self._retry_after(entry), self._headers(entry))
+
+        charge = [
+            (self._bucket_keys(name, user_id if per_user else "all", window, now)[1], 2 * window)
+            for name, window, _, per_user in self.limits
+        ]
+        try:
+            await self.store.increment(charge)
+        except Exception as e:
+            print(f"[Quota] Usage update failed: {e}")
+            self.errors += 1
+            return None
+        self.granted += 1
+        return charge
+
+    async def refund(self, charge: list[tuple[str, int]] | None):
+        """Gives back a call counted by acquire() that was rejected or failed."""
+        if not charge:
+            return
+        try:
+            await self.store.increment(charge, amount=-1)
+        except Exception as e:
+            print(f"[Quota] Usage refund failed: {e}")
+            self.errors += 1
+            return
+        self.refunded += 1
+
+    async def headers(self, user_id: int | None) -> dict:
+        """X-RateLimit-* of the user's tightest limit (empty without per-user limits)."""
+        limits = [limit for limit in self.limits if limit[3]]
+        if not limits:
+            return {}
+        try:
+            usage = await self._usage(user_id, limits, time.time())
+        except Exception as e:
+            print(f"[Quota] Usage lookup failed: {e}")
+            self.errors += 1
+            return {}
+        return self._headers(min(usage, key=lambda entry: entry["limit"] - entry["used"]))
+
+    def stats(self) -> dict:
+        return {
+            "store": self.store.name,
+            "size": self.store.size(),
+            "limits": {name: limit for name, _, limit, _ in self.limits},
+            "granted": self.granted,
+            "refunded": self.refunded,
+            "rejected": dict(self.rejected),
+            "errors": self.errors,
+        }
+
+
+# Shared quota for the whole app
+usage_quota = UsageQuota(
+    per_minute=USER_QUOTA_PER_MINUTE,
+    per_day=USER_QUOTA_PER_DAY,
+    global_per_minute=GLOBAL_QUOTA_PER_MINUTE,
+    store=RedisUsageStore(QUOTA_REDIS_URL) if QUOTA_REDIS_URL else MemoryUsageStore(),
+    batch_size=MAX_BATCH_FILES,
+)
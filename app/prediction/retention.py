@@ -0,0 +1,232 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete
+
+# Ensure models are imported (relationships resolve by name)
+import app.models  # noqa: F401
+from app.config import (
+    PREDICTION_RETENTION_DAYS,
+    LOG_RETENTION_DAYS,
+    STORAGE_RETENTION_DAYS,
+    RETENTION_INTERVAL_HOURS,
+    DELETE_BATCH_ROWS,
+    DELETE_BATCH_PAUSE_MS,
+    THUMBNAIL_SIZES,
+    THUMBNAIL_FORMATS,
+)
+from app.database import AsyncSessionLocal
+from app.models.prediction import Prediction
+from app.models.system_log import SystemLog
+from app.prediction.stats import apply_to_rollups
+from app.prediction.thumbnails import derivative_key
+from app.utils.storage import storage, purge_expired_images
+
+# What apply_to_rollups needs, plus the image to delete
+DELETED_COLUMNS = (
+    Prediction.user_id,
+    Prediction.timestamp,
+    Prediction.currency_code,
+    Prediction.denomination_value,
+    Prediction.is_counterfeit,
+    Prediction.confidence,
+    Prediction.image_path,
+)
+
+
+def image_keys(image_path: str) -> list[str]:
+    """The upload and every derivative it may have (deleting a missing one is a no-op)."""
+    return [image_path] + [
+        derivative_key(image_path, variant, fmt)
+        for variant in THUMBNAIL_SIZES
+        for fmt in THUMBNAIL_FORMATS
+    ]
+
+
+async def delete_predictions(condition, wait_for_images: bool = False,
+                             skip_locked: bool = False,
+                             batch_rows: int = DELETE_BATCH_ROWS) -> dict:
+    """
+    Deletes the predictions matching `condition` in batches of `batch_rows`,
+    one short transaction each, then their images and derivatives.
+
+    DELETE ... RETURNING hands back only the rows this transaction really
+    deleted, so the rollups are adjusted exactly once even when several
+    deleters (retention on two instances, a clear history) overlap.
+    With `skip_locked` (PostgreSQL) rows locked by live traffic are left
+    for the next run instead of waited for.
+
+    Images are deleted in the background unless `wait_for_images`, which
+    also makes "bytes_freed" complete.
+    """
+    rows = images = freed = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            batch = (
+                select(Prediction.id)
+                .where(condition)
+                .order_by(Prediction.id)
+                .limit(batch_rows)
+            )
+            if skip_locked and db.bind.dialect.name == "postgresql":
+                batch = batch.with_for_update(skip_locked=True)
+            deleted = (await db.execute(
+                delete(Prediction)
+                .where(Prediction.id.in_(batch))
+                .returning(*DELETED_COLUMNS)
+            )).all()
+            if deleted:
+                await apply_to_rollups(db, deleted, sign=-1)
+            await db.commit()
+
+        if not deleted:
+            break
+        rows += len(deleted)
+        keys = [key for row in deleted for key in image_keys(row.image_path)]
+        images += len(keys)
+        if wait_for_images:
+            freed += await storage.delete_many(keys)
+        else:
+            storage.delete_in_background(keys)
+
+        if len(deleted) < batch_rows:
+            break
+        # Let queued requests have the connection and locks in between
+        await asyncio.sleep(DELETE_BATCH_PAUSE_MS / 1000)
+
+    return {"rows": rows, "images": images, "bytes_freed": freed}
+
+
+async def delete_logs(cutoff: datetime, batch_rows: int = DELETE_BATCH_ROWS) -> int:
+    """Deletes system logs older than `cutoff`, `batch_rows` per transaction."""
+    rows = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                delete(SystemLog).where(SystemLog.id.in_(
+                    select(SystemLog.id)
+                    .where(SystemLog.timestamp < cutoff)
+                    .order_by(SystemLog.id)
+                    .limit(batch_rows)
+                ))
+            )
+            await db.commit()
+        rows += result.rowcount
+        if result.rowcount < batch_rows:
+            return rows
+        await asyncio.sleep(DELETE_BATCH_PAUSE_MS / 1000)
+
+
+class RetentionJob:
+    """
+    Every `interval` hours deletes predictions (with their images) and
+    system logs past their retention, then stored images past
+    STORAGE_RETENTION_DAYS. Everything goes in small batches, so it runs
+    next to live traffic, and it is safe to run on several instances at
+    once (see delete_predictions).
+    """
+
+    def __init__(self, prediction_days: int, log_days: int, image_days: int,
+                 interval_hours: float):
+        self.prediction_days = prediction_days
+        self.log_days = log_days
+        self.image_days = image_days
+        self.interval_hours = interval_hours
+        self._task: asyncio.Task | None = None
+
+        # Metrics
+        self.runs = 0
+        self.failures = 0
+        self.last_run_at: datetime | None = None
+        self.last_duration = 0.0
+        self.last_report: dict = {}
+
+    @property
+    def enabled(self) -> bool:
+        return any(days > 0 for days in (self.prediction_days, self.log_days, self.image_days))
+
+    def start(self):
+        if self.enabled:
+            self._task = asyncio.create_task(self._run(), name="retention-job")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.failures += 1
+                print(f"[Retention] Run failed: {e}")
+            await asyncio.sleep(self.interval_hours * 3600)
+
+    async def run_once(self) -> dict:
+        started = datetime.utcnow()
+        report = {}
+
+        if self.prediction_days > 0:
+            cutoff = started - timedelta(days=self.prediction_days)
+            report["predictions"] = await delete_predictions(
+                Prediction.timestamp < cutoff, wait_for_images=True, skip_locked=True)
+            print(f"[Retention] Deleted {report['predictions']['rows']} predictions and "
+                  f"{report['predictions']['bytes_freed'] / 1e6:.1f} MB of images "
+                  f"older than {self.prediction_days} days")
+
+        if self.log_days > 0:
+            cutoff = started - timedelta(days=self.log_days)
+            report["system_logs"] = {"rows": await delete_logs(cutoff)}
+            print(f"[Retention] Deleted {report['system_logs']['rows']} system logs "
+                  f"older than {self.log_days} days")
+
+        if self.image_days > 0:
+            removed, freed = await purge_expired_images(self.image_days)
+            report["images"] = {"images": removed, "bytes_freed": freed}
+
+        self.runs += 1
+        self.last_run_at = started
+        self.last_duration = (datetime.utcnow() - started).total_seconds()
+        self.last_report = report
+        return report
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "prediction_days": self.prediction_days,
+            "log_days": self.log_days,
+            "image_days": self.image_days,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_duration": self.last_duration,
+            "last_report": self.last_report,
+        }
+
+
+# Shared job for the whole app
+retention_job = RetentionJob(
+    prediction_days=PREDICTION_RETENTION_DAYS,
+    log_days=LOG_RETENTION_DAYS,
+    image_days=STORAGE_RETENTION_DAYS,
+    interval_hours=RETENTION_INTERVAL_HOURS,
+)
+
+
+async def _run_cli():
+    try:
+        print(await retention_job.run_once())
+    finally:
+        await storage.close()
+
+
+if __name__ == "__main__":
+    # python -m app.prediction.retention (one run with the configured ages)
+    if not retention_job.enabled:
+        print("Retention is disabled, set PREDICTION_RETENTION_DAYS, LOG_RETENTION_DAYS "
+              "or STORAGE_RETENTION_DAYS")
+        sys.exit(1)
+    asyncio.run(_run_cli())
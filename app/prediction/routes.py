@@ -1,28 +1,64 @@
-import uuid
-import os
-from datetime import datetime
+import asyncio
+import base64
+import json
+from datetime import date, datetime
 
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import (
+    APIRouter, UploadFile, File, Form, Query, HTTPException, Depends, Request, Response,
+    WebSocket, status,
+)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func, tuple_
 
-from app.database import get_db
+from app.database import get_db, get_read_db, AsyncSessionLocal
 from app.models.user import User
 from app.models.prediction import Prediction
-from app.auth.utils import get_current_user
+from app.models.prediction_job import PredictionJob
+from app.auth.utils import get_current_user, get_current_user_readonly, get_websocket_user, is_admin
 from app.utils.logger import create_log
+from app.utils.storage import storage, ImageNotFoundError
+from app.utils.metrics import span
+from app.config import (
+    MAX_BATCH_FILES,
+    HISTORY_PAGE_SIZE,
+    HISTORY_MAX_PAGE_SIZE,
+    THUMBNAIL_SIZES,
+    THUMBNAIL_FORMATS,
 
-# Import AI model and utilities
-# from ai.evaluate import load_model, predict_image
-from ai.gimini_client import analyze_currency
+)
+from app.prediction.service import (
+    analyze_upload,
+    build_prediction,
+    prediction_item,
+    prediction_response,
+    remember_results,
+    save_upload,
+    wait_until_stored,
+)
+from app.prediction.thumbnails import (
+    FORMAT_EXTENSIONS,
+    derivative_generator,
+    derivative_key,
+    verify as verify_signature,
+)
+from app.prediction.export import EXPORTERS, MEDIA_TYPES, export_query
+from app.prediction.retention import delete_predictions
+from app.prediction.jobs import (
+    CallbackURLError, check_callback_url, enqueue_job, job_response, FINISHED,
+)
+from app.prediction.stats import apply_to_rollups, get_stats
+from app.prediction.stream import scan_sessions
+from app.prediction.executor import BULK
+from app.prediction.quota import usage_quota
+from app.prediction.schemas import PredictionItem, PredictionOut
+from app.prediction.versions import history_versions
 
-router = APIRouter(prefix="/predict", tags=["Prediction"])
-
-UPLOAD_DIR = "app/static/uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+MAX_JOB_WAIT_SECONDS = 30
+JOB_STATUS_POLL_SECONDS = 0.5
 
-# Load model ONCE
-# model, device = load_model()
+router = APIRouter(prefix="/predict", tags=["Prediction"])
 
 
 # ------------------------------------
@@ -30,68 +66,49 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 # ------------------------------------
 @router.post("/")
 async def predict_currency(
+    response: Response,
     file: UploadFile = File(...),
+    mode: str = Query("sync", pattern="^(sync|async)$"),
+    callback_url: str | None = Form(None),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    try:
-        # ✅ Save uploaded file
-        file_ext = os.path.splitext(file.filename)[1]
-        file_name = f"{uuid.uuid4()}{file_ext}"
-        file_path = os.path.join(UPLOAD_DIR, file_name)
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
-
-         # ✅ Run AI prediction
-        try:
-            # Run model
-            with open(file_path, "rb") as img_file:
-                image_bytes = img_file.read()
-            result = analyze_currency(image_bytes)
-            # result = extract_json_from_gemini(response.text)
+    if mode == "async":
+        return await enqueue_prediction(
+            response, file, callback_url, db, current_user)
 
-        except Exception as e:
-            raise HTTPException(
-                status_code=500, detail=f"AI prediction failed: {e}")
+    try:
+        analyzed = await analyze_upload(file, db, asyncio.Lock(), user_id=current_user.id)
+        result = analyzed["result"]
+        # ✅ The image is stored before the row that points to it
+        await wait_until_stored(analyzed)
 
         # ✅ Create prediction record
-        new_prediction = Prediction(
-            user_id=current_user.id,
-            currency_code=result["currency_code"],
-            confidence=result["confidence"],
-            name_en=result["name_en"],
-            name_ar=result["name_ar"],
-            denomination_value=result["denomination_value"],
-            is_counterfeit=result["is_counterfeit"],
-            image_path=f"/static/uploads/{file_name}",
-            timestamp=datetime.utcnow(),
-        )
+        new_prediction = build_prediction(current_user.id, analyzed)
 
         db.add(new_prediction)
-        await db.commit()
-        await db.refresh(new_prediction)
+        with span("db.commit"):
+            await apply_to_rollups(db, [new_prediction])
+            await db.commit()
+            await db.refresh(new_prediction)
+
+        with span("cache.store"):
+            await remember_results(db, [(new_prediction, analyzed)])
 
         # ✅ Log the action
-        await create_log(
-            db,
-            action="PREDICT",
-            message=f"User {current_user.full_name} predicted {result["name_en"]} ({result["confidence"]}%)",
-            user_id=current_user.id
-        )
+        with span("log"):
+            await create_log(
+                db,
+                action="PREDICT",
+                message=f"User {current_user.full_name} predicted {result['name_en']} ({result['confidence']}%)",
+                user_id=current_user.id
+            )
+
+        # ✅ Remaining quota
+        response.headers.update(await usage_quota.headers(current_user.id))
 
         # ✅ Return response
-        return {
-            "id": new_prediction.id,
-            "status": "success",
-            "currency_code": result["currency_code"],
-            "name_en": result["name_en"],
-            "name_ar": result["name_ar"],
-            "confidence": result["confidence"],
-            "denomination_value": result["denomination_value"],
-            "is_counterfeit": result["is_counterfeit"],
-            "image_url": f"/static/uploads/{file_name}"
-
-        }
+        return prediction_response(new_prediction, analyzed)
 
     except HTTPException:
         raise
@@ -100,43 +117,360 @@ async def predict_currency(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def enqueue_prediction(response: Response, file: UploadFile, callback_url: str | None,
+                             db: AsyncSession, current_user: User) -> dict:
+    """Async mode: store the upload, queue a job and answer right away."""
+    if callback_url:
+        try:
+            await check_callback_url(callback_url)
+        except CallbackURLError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # The worker reads the image back from storage, it must be there first
+    _, image_path, _ = await save_upload(file, wait=True)
+    job = await enqueue_job(db, current_user.id, image_path, callback_url)
+
+    response.status_code = 202
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/predict/jobs/{job.id}",
+        "events_url": f"/predict/jobs/{job.id}/events",
+    }
+
+
+# ------------------------------------
+# Batch Predict Endpoint
+# ------------------------------------
+@router.post("/batch")
+async def predict_currency_batch(
+    response: Response,
+    files: list[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many files, at most {MAX_BATCH_FILES} per batch")
+
+    # ✅ Analyze all notes concurrently (bounded by the inference executor)
+    db_lock = asyncio.Lock()
+    outcomes = await asyncio.gather(
+        *(analyze_upload(f, db, db_lock, user_id=current_user.id, priority=BULK)
+          for f in files),
+        return_exceptions=True,
+    )
+    # ✅ Uploads whose image could not be stored fail like any other item
+    for index, analyzed in enumerate(outcomes):
+        if isinstance(analyzed, dict):
+            try:
+                await wait_until_stored(analyzed)
+            except HTTPException as e:
+                outcomes[index] = e
+
+    try:
+        # ✅ All prediction rows and one log entry in a single transaction
+        saved = []
+        for analyzed in outcomes:
+            if isinstance(analyzed, dict):
+                prediction = build_prediction(current_user.id, analyzed)
+                db.add(prediction)
+                saved.append((prediction, analyzed))
+
+        await apply_to_rollups(db, [p for p, _ in saved])
+        await create_log(
+            db,
+            action="PREDICT_BATCH",
+            message=f"User {current_user.full_name} predicted a batch of {len(files)} notes ({len(saved)} succeeded)",
+            user_id=current_user.id,
+            commit=False,
+        )
+        await db.commit()
+
+        await remember_results(db, saved)
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # ✅ Per-item results, in upload order
+    items = []
+    saved_iter = iter(saved)
+    for index, (file, analyzed) in enumerate(zip(files, outcomes)):
+        if isinstance(analyzed, dict):
+            prediction, _ = next(saved_iter)
+            item = prediction_response(prediction, analyzed)
+        elif isinstance(analyzed, HTTPException):
+            item = {"status": "error", "status_code": analyzed.status_code,
+                    "detail": analyzed.detail}
+        else:
+            item = {"status": "error", "status_code": 500,
+                    "detail": str(analyzed)}
+        item["index"] = index
+        item["filename"] = file.filename
+        items.append(item)
+
+    response.headers.update(await usage_quota.headers(current_user.id))
+    return {
+        "count": len(files),
+        "succeeded": len(saved),
+        "failed": len(files) - len(saved),
+        "results": items,
+    }
+
+
+# ------------------------------------
+# Camera Scanning (WebSocket)
+# ------------------------------------
+@router.websocket("/stream")
+async def stream_predictions(websocket: WebSocket):
+    """
+    Send camera frames as binary messages, get results back as JSON until
+    one is stable (see app.prediction.stream.ScanSession). Authenticated
+    with the usual bearer token, in the Authorization header or `?token=`.
+    """
+    try:
+        current_user = await get_websocket_user(websocket)
+    except HTTPException:
+        # Before accept(): the handshake is refused with a 403
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    await scan_sessions.serve(websocket, current_user)
+
+
+# ------------------------------------
+# Async Prediction Jobs
+# ------------------------------------
+async def get_user_job(db: AsyncSession, job_id: str, user_id: int) -> PredictionJob:
+    job = await db.get(PredictionJob, job_id, populate_existing=True)
+    if job is None or job.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}")
+async def get_prediction_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=MAX_JOB_WAIT_SECONDS),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user_readonly),
+):
+    """Job status. With `wait` > 0 this long-polls until the job finishes."""
+    job = await get_user_job(db, job_id, current_user.id)
+    deadline = asyncio.get_running_loop().time() + wait
+    while job.status not in FINISHED and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(JOB_STATUS_POLL_SECONDS)
+        await db.commit()  # end the read transaction to see new commits
+        job = await get_user_job(db, job_id, current_user.id)
+    return await job_response(db, job)
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_prediction_job(
+    job_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user_readonly),
+):
+    """Server-sent events: one `status` event per change until the job finishes."""
+    await get_user_job(db, job_id, current_user.id)
+    user_id = current_user.id
+
+    async def events():
+        last = None
+        deadline = asyncio.get_running_loop().time() + MAX_JOB_WAIT_SECONDS * 10
+        while asyncio.get_running_loop().time() < deadline:
+            async with AsyncSessionLocal() as session:
+                job = await get_user_job(session, job_id, user_id)
+                data = jsonable_encoder(await job_response(session, job))
+            state = (data["status"], data["attempts"])
+            if state != last:
+                last = state
+                yield f"event: status\ndata: {json.dumps(data)}\n\n"
+            if data["status"] in FINISHED:
+                return
+            await asyncio.sleep(JOB_STATUS_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
 # ------------------------------------
 # Get Prediction History
 # ------------------------------------
-@router.get("/history")
+HISTORY_COLUMNS = (
+    Prediction.id,
+    Prediction.user_id,
+    Prediction.currency_code,
+    Prediction.name_en,
+    Prediction.name_ar,
+    Prediction.confidence,
+    Prediction.denomination_value,
+    Prediction.is_counterfeit,
+    Prediction.image_path,
+    Prediction.has_derivatives,
+    Prediction.timestamp,
+)
+
+
+def encode_cursor(timestamp: datetime, prediction_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat(), prediction_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, prediction_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(timestamp), int(prediction_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/history", response_model=list[PredictionItem])
 async def get_user_predictions(
+    request: Request,
+    response: Response,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: str | None = Query(None),
+    currency_code: str | None = Query(None),
+    denomination_value: int | None = Query(None),
+    is_counterfeit: bool | None = Query(None),
+    date_from: datetime | None = Query(None),
+    date_to: datetime | None = Query(None),
+    include_total: bool = Query(False),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user_readonly),
+):
+    """
+    Newest first, keyset paginated on (timestamp, id) so every page costs
+    the same no matter how long the history is. The next page cursor is
+    returned in the X-Next-Cursor header (and a Link rel="next").
+
+    Responses carry an ETag (and Last-Modified) of the user's history
+    version: polling with If-None-Match gets a 304 until a prediction is
+    added, deleted or gets its thumbnails.
+    """
+    # ✅ Unchanged since the client's copy: 304 without reading predictions
+    not_modified = await history_versions.check(request, response, db, current_user.id)
+    if not_modified is not None:
+        return not_modified
+
+    filters = [Prediction.user_id == current_user.id]
+    if currency_code:
+        filters.append(Prediction.currency_code == currency_code.upper())
+    if denomination_value is not None:
+        filters.append(Prediction.denomination_value == denomination_value)
+    if is_counterfeit is not None:
+        filters.append(Prediction.is_counterfeit == is_counterfeit)
+    if date_from is not None:
+        filters.append(Prediction.timestamp >= date_from)
+    if date_to is not None:
+        filters.append(Prediction.timestamp < date_to)
+
+    query = select(*HISTORY_COLUMNS).where(*filters)
+    if cursor:
+        after_ts, after_id = decode_cursor(cursor)
+        query = query.where(
+            tuple_(Prediction.timestamp, Prediction.id) < tuple_(after_ts, after_id))
+    query = query.order_by(
+        Prediction.timestamp.desc(), Prediction.id.desc()).limit(limit + 1)
+
+    rows = (await db.execute(query)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor(last.timestamp, last.id)
+        response.headers["X-Next-Cursor"] = next_cursor
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+
+    if include_total:
+        total = (await db.execute(
+            select(func.count()).select_from(Prediction).where(*filters)
+        )).scalar_one()
+        response.headers["X-Total-Count"] = str(total)
+
+    return [prediction_item(p) for p in rows]
+
+
+# ------------------------------------
+# Prediction Statistics
+# ------------------------------------
+@router.get("/stats")
+async def get_prediction_stats(
+    scope: str = Query("user", pattern="^(user|global)$"),
+    date_from: date | None = Query(None),
+    date_to: date | None = Query(None),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: User = Depends(get_current_user_readonly),
+):
+    """Counts per currency, denomination and day, read from the daily rollups."""
+    user_id = current_user.id if scope == "user" else None
+    return await get_stats(db, user_id, date_from, date_to)
+
+
+# ------------------------------------
+# Bulk Export
+# ------------------------------------
+@router.get("/export")
+async def export_predictions(
+    format: str = Query("csv", pattern="^(csv|ndjson|parquet)$"),
+    scope: str = Query("user", pattern="^(user|all)$"),
+    date_from: datetime | None = Query(None),
+    date_to: datetime | None = Query(None),
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_readonly),
 ):
-    query = await db.execute(
-        select(Prediction).where(Prediction.user_id == current_user.id)
+    """
+    Streams every matching prediction (oldest first) as CSV, NDJSON or
+    Parquet. Rows are read through a server-side cursor, memory stays flat
+    whatever the row count. scope=all (every user) is for ADMIN_EMAILS.
+    """
+    if scope == "all":
+        # ✅ Admin from the user row: with AUTH_TRUST_CLAIMS current_user is
+        # built from the token, otherwise it is already in the session
+        user = await db.get(User, current_user.id)
+        if user is None or not is_admin(user):
+            raise HTTPException(status_code=403, detail="Exporting all users requires an admin")
+    if format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(
+                status_code=501, detail="Parquet export needs pyarrow installed on the server")
+
+    query = export_query(
+        current_user.id if scope == "user" else None, date_from, date_to)
+
+    await create_log(
+        db,
+        action="EXPORT",
+        message=f"User {current_user.full_name} exported predictions (scope={scope}, format={format})",
+        user_id=current_user.id
     )
-    predictions = query.scalars().all()
 
-    return [
-        {
-            "id": p.id,
-            "currency_code": p.currency_code,
-            "name_en": p.name_en,
-            "name_ar": p.name_ar,
-            "confidence": p.confidence,
-            "denomination_value": p.denomination_value,
-            "is_counterfeit": p.is_counterfeit,
-            "image_url": p.image_path,
-            "timestamp": p.timestamp,
-        }
-        for p in predictions
-    ]
+    filename = f"predictions-{scope}-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(
+        EXPORTERS[format](query),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 # ------------------------------------
 # Get Single Prediction
 # ------------------------------------
-@router.get("/{prediction_id}")
+@router.get("/{prediction_id}", response_model=PredictionOut)
 async def get_single_prediction(
     prediction_id: int,
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_readonly),
 ):
     query = await db.execute(
         select(Prediction).filter(
@@ -147,7 +481,80 @@ async def get_single_prediction(
     prediction = query.scalar_one_or_none()
     if not prediction:
         raise HTTPException(status_code=404, detail="Prediction not found")
-    return prediction
+
+    # ✅ Same validators as the history, a prediction only changes with it
+    # (checked once the row is known to exist: If-None-Match: * matches
+    # any existing resource, never a missing one)
+    not_modified = await history_versions.check(request, response, db, current_user.id)
+    if not_modified is not None:
+        return not_modified
+    return {
+        **prediction_item(prediction),
+        "user_id": prediction.user_id,
+        "image_path": prediction.image_path,
+        "has_derivatives": prediction.has_derivatives,
+    }
+
+
+@router.get("/{prediction_id}/image")
+async def get_prediction_image(
+    prediction_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user_readonly),
+):
+    """Redirects to the stored image (presigned URL with S3 storage)."""
+    image_path = (await db.execute(
+        select(Prediction.image_path).filter(
+            Prediction.id == prediction_id,
+            Prediction.user_id == current_user.id
+        )
+    )).scalar_one_or_none()
+    if image_path is None:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+    return RedirectResponse(storage.url(image_path), status_code=307)
+
+
+@router.get("/{prediction_id}/image/{name}")
+async def get_prediction_derivative(
+    prediction_id: int,
+    name: str,
+    uid: int = Query(...),
+    exp: int = Query(...),
+    sig: str = Query(...),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Thumbnail / preview of a prediction, generated on first request for
+    rows that do not have them yet, then redirected to the stored file.
+    Authorized by the signature in the URL so it works in <img> tags; it
+    names the owner and an expiry (see thumbnails.sign).
+    """
+    variant, _, ext = name.partition(".")
+    fmt = next((f for f, e in FORMAT_EXTENSIONS.items() if e == ext), None)
+    if variant not in THUMBNAIL_SIZES or fmt not in THUMBNAIL_FORMATS:
+        raise HTTPException(status_code=404, detail="Unknown image variant")
+    if not verify_signature(prediction_id, uid, exp, sig):
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+
+    row = (await db.execute(
+        select(Prediction.image_path, Prediction.has_derivatives)
+        .where(Prediction.id == prediction_id, Prediction.user_id == uid)
+    )).one_or_none()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Prediction not found")
+
+    if not row.has_derivatives:
+        try:
+            await derivative_generator.ensure(prediction_id, row.image_path)
+        except ImageNotFoundError:
+            raise HTTPException(status_code=404, detail="Image not found")
+        derivative_generator.on_demand += 1
+
+    return RedirectResponse(
+        storage.url(derivative_key(row.image_path, variant, fmt)),
+        status_code=307,
+        headers={"Cache-Control": "private, max-age=300"},
+    )
 
 
 # ------------------------------------
@@ -158,17 +565,22 @@ async def clear_prediction_history(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    await db.execute(
-        Prediction.__table__.delete().where(Prediction.user_id == current_user.id)
-    )
-    await db.commit()
+    # Only what exists now, predictions made meanwhile are kept
+    last_id = (await db.execute(
+        select(func.max(Prediction.id)).where(Prediction.user_id == current_user.id)
+    )).scalar()
+    # ✅ Deleted in short batches (rollups adjusted per batch), images in the background
+    deleted = {"rows": 0}
+    if last_id is not None:
+        deleted = await delete_predictions(
+            (Prediction.user_id == current_user.id) & (Prediction.id <= last_id))
 
     # Log action
     await create_log(
         db,
         action="CLEAR_HISTORY",
-        message=f"User {current_user.full_name} cleared prediction history",
+        message=f"User {current_user.full_name} cleared prediction history ({deleted['rows']} predictions)",
         user_id=current_user.id
     )
 
-    return {"message": "Prediction history cleared successfully"}
+    return {"message": "Prediction history cleared successfully", "deleted": deleted["rows"]}
@@ -0,0 +1,28 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class PredictionItem(BaseModel):
+    """One entry of GET /predict/history."""
+    id: int
+    currency_code: str
+    name_en: str
+    name_ar: str
+    confidence: float
+    denomination_value: Optional[int] = None
+    is_counterfeit: bool
+    image_url: str
+    # lists should render these, not the full size upload
+    thumbnail_url: Optional[str] = None
+    # {"thumb": {"webp": url, "jpeg": url}, "preview": {...}}
+    derivatives: dict[str, dict[str, str]]
+    timestamp: Optional[datetime] = None
+
+
+class PredictionOut(PredictionItem):
+    """GET /predict/{prediction_id}."""
+    user_id: int
+    image_path: str
+    has_derivatives: bool
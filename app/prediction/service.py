@@ -0,0 +1,274 @@
+import asyncio
+from datetime import datetime
+
+from fastapi import UploadFile, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.prediction import Prediction
+from app.config import (
+    INFERENCE_RETRY_AFTER_SECONDS,
+    MAX_UPLOAD_BYTES,
+    IMAGE_MAX_SIDE,
+    IMAGE_JPEG_QUALITY,
+    STORAGE_ASYNC_WRITES,
+)
+from app.prediction.executor import (
+    INTERACTIVE,
+    inference_executor,
+    InferenceBusyError,
+    InferenceTimeoutError,
+)
+from app.prediction.cache import prediction_cache, make_cache_key
+from app.prediction.quality import quality_gate, QualityRejectedError
+from app.prediction.quota import usage_quota, QuotaExceededError
+from app.prediction.thumbnails import derivative_generator, derivative_urls
+from app.utils.image_utils import (
+    DecodedImage,
+    IngestedUpload,
+    ingest_upload,
+    ingested_from_bytes,
+    decode_image,
+    dhash_bytes,
+    to_signed64,
+    InvalidImageError,
+    UploadTooLargeError,
+)
+from app.utils.storage import storage
+from app.utils.metrics import span
+
+# Import AI model and utilities
+from ai.backends import get_backend
+from ai.resilience import (
+    GeminiDeadlineError,
+    GeminiInvalidResponseError,
+    GeminiRateLimitedError,
+    GeminiUnavailableError,
+)
+
+# ------------------------------------
+# Upload handling
+# ------------------------------------
+async def save_upload(file: UploadFile, wait: bool = False
+                      ) -> tuple[IngestedUpload, str, asyncio.Task | None]:
+    """
+    Reads and validates an upload and stores it in the image storage.
+    Returns it with its storage key (stored as Prediction.image_path) and
+    the background write, if any. The write runs in the background unless
+    `wait` is set (or STORAGE_ASYNC_WRITES is off), so it overlaps the
+    model call; wait_until_stored() before committing a row that uses it.
+    """
+    # ✅ Read the upload (hashed, validated and buffered in one pass)
+    try:
+        with span("upload.read"):
+            upload = await ingest_upload(file, MAX_UPLOAD_BYTES)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    key = storage.new_key(file.filename)
+    if wait or not STORAGE_ASYNC_WRITES:
+        try:
+            await storage.save(key, upload.buffer.getvalue())
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Image storage unavailable: {e}")
+        return upload, key, None
+    return upload, key, storage.save_in_background(key, upload.buffer.getvalue())
+
+
+async def wait_until_stored(analyzed: dict):
+    """
+    Waits for the background write of an analyzed upload, 503 when it
+    failed: a prediction row must never point to a missing image.
+    """
+    write = analyzed.get("write")
+    if write is not None and not await write:
+        raise HTTPException(status_code=503, detail="Image storage unavailable")
+
+
+async def load_upload(image_path: str) -> IngestedUpload:
+    """Reads back an upload saved by save_upload (used by the job worker)."""
+    return ingested_from_bytes(await storage.load(image_path))
+
+
+# ------------------------------------
+# Shared prediction steps
+# ------------------------------------
+async def analyze_upload(file: UploadFile, db: AsyncSession, db_lock: asyncio.Lock,
+                         user_id: int | None = None, priority: str = INTERACTIVE) -> dict:
+    """
+    Saves one upload and gets its result from the cache or the model.
+    Nothing is written to the predictions table here.
+    `db_lock` serializes use of `db` when several uploads run concurrently.
+    A model call is charged to `user_id`'s quota and scheduled with `priority`.
+    """
+    upload, image_path, write = await save_upload(file)
+    analyzed = await analyze_ingested(
+        upload, image_path, db, db_lock, user_id=user_id, priority=priority)
+    analyzed["write"] = write
+    return analyzed
+
+
+async def analyze_ingested(upload: IngestedUpload, image_path: str | None, db: AsyncSession,
+                           db_lock: asyncio.Lock, decoded: DecodedImage | None = None,
+                           check_quality: bool = True, user_id: int | None = None,
+                           priority: str = INTERACTIVE) -> dict:
+    """
+    `decoded` skips decoding when the caller already has the image, and
+    `check_quality=False` skips the quality gate for images it already
+    passed (camera frames).
+    """
+    # ✅ Same image already analyzed? skip the model entirely
+    cache_key = make_cache_key(upload.sha256)
+    async with db_lock:
+        with span("cache.lookup"):
+            result = await prediction_cache.get(db, cache_key)
+    cached = result is not None
+
+    # ✅ Perceptual hash, stored on the row. Near-duplicates are not
+    # answered from earlier predictions: a dHash can't tell a good
+    # counterfeit from the genuine note it copies, only the model can
+    image = decoded
+    try:
+        with span("image.decode"):
+            if image is not None:
+                phash = image.phash
+            elif cached:
+                phash = await asyncio.to_thread(dhash_bytes, upload.buffer)
+            else:
+                image = await asyncio.to_thread(
+                    decode_image, upload.buffer, IMAGE_MAX_SIDE)
+                phash = image.phash
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # ✅ Blurry, dark, tiny or no banknote at all? 422 instead of a model call
+    if result is None and check_quality and quality_gate.enabled:
+        try:
+            with span("quality.check"):
+                await asyncio.to_thread(quality_gate.check, image)
+        except QualityRejectedError as e:
+            raise HTTPException(status_code=422, detail=e.detail())
+
+    # ✅ Run AI prediction
+    try:
+        # Run model
+        if result is None:
+            # ✅ Only model calls count against the user's quota, and only
+            # the ones that produce a result (rejected / failed calls are refunded)
+            charge = await usage_quota.acquire(user_id)
+            try:
+                with span("image.encode"):
+                    model_bytes = await asyncio.to_thread(
+                        image.to_jpeg, IMAGE_JPEG_QUALITY)
+                # Queue wait + model (Gemini attempts and parsing are timed inside)
+                with span("inference", backend=get_backend().name):
+                    result = await inference_executor.run(
+                        get_backend().analyze, model_bytes, user_id=user_id, priority=priority)
+            except BaseException:
+                await usage_quota.refund(charge)
+                raise
+        # result = extract_json_from_gemini(response.text)
+
+    except QuotaExceededError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers=e.headers)
+    except InferenceBusyError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Prediction service is busy, please retry shortly ({e})",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER_SECONDS)},
+        )
+    except (GeminiUnavailableError, GeminiRateLimitedError) as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"AI service unavailable: {e}",
+            headers={"Retry-After": str(INFERENCE_RETRY_AFTER_SECONDS)},
+        )
+    except GeminiInvalidResponseError as e:
+        raise HTTPException(
+            status_code=502, detail=f"AI service returned an invalid result: {e}")
+    except (InferenceTimeoutError, GeminiDeadlineError) as e:
+        raise HTTPException(
+            status_code=504, detail=f"AI prediction timed out: {e}")
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"AI prediction failed: {e}")
+
+    return {
+        "result": result,
+        "upload": upload,
+        "cached": cached,
+        "cache_key": cache_key,
+        "phash": phash,
+        "image_path": image_path,
+    }
+
+
+def build_prediction(user_id: int, analyzed: dict) -> Prediction:
+    result = analyzed["result"]
+    return Prediction(
+        user_id=user_id,
+        currency_code=result["currency_code"],
+        confidence=result["confidence"],
+        name_en=result["name_en"],
+        name_ar=result["name_ar"],
+        denomination_value=result["denomination_value"],
+        is_counterfeit=result["is_counterfeit"],
+        image_path=analyzed["image_path"],
+        phash=to_signed64(analyzed["phash"]),
+        has_derivatives=False,
+        timestamp=datetime.utcnow(),
+    )
+
+
+def prediction_response(prediction: Prediction, analyzed: dict) -> dict:
+    derivatives = derivative_urls(
+        prediction.id, prediction.user_id, prediction.image_path, prediction.has_derivatives)
+    return {
+        "id": prediction.id,
+        "status": "success",
+        "currency_code": prediction.currency_code,
+        "name_en": prediction.name_en,
+        "name_ar": prediction.name_ar,
+        "confidence": prediction.confidence,
+        "denomination_value": prediction.denomination_value,
+        "is_counterfeit": prediction.is_counterfeit,
+        "image_url": storage.url(prediction.image_path),
+        "thumbnail_url": derivatives["thumb"]["webp"] if "thumb" in derivatives else None,
+        "derivatives": derivatives,
+        "cached": analyzed["cached"],
+    }
+
+
+def prediction_item(p) -> dict:
+    """History entry of a Prediction (or a row with the same columns)."""
+    derivatives = derivative_urls(p.id, p.user_id, p.image_path, p.has_derivatives)
+    return {
+        "id": p.id,
+        "currency_code": p.currency_code,
+        "name_en": p.name_en,
+        "name_ar": p.name_ar,
+        "confidence": p.confidence,
+        "denomination_value": p.denomination_value,
+        "is_counterfeit": p.is_counterfeit,
+        "image_url": storage.url(p.image_path),
+        "thumbnail_url": derivatives["thumb"]["webp"] if "thumb" in derivatives else None,
+        "derivatives": derivatives,
+        "timestamp": p.timestamp,
+    }
+
+
+async def remember_results(db: AsyncSession, items: list[tuple[Prediction, dict]]):
+    """
+    After the predictions are committed: feeds freshly computed results to
+    the cache, and queues the thumbnails of every
+    saved prediction.
+    """
+    for prediction, analyzed in items:
+        derivative_generator.schedule(
+            prediction.id, prediction.image_path, analyzed["upload"].buffer.getvalue())
+
+    fresh = [(p, a) for p, a in items if not a["cached"]]
+    if fresh:
+        await prediction_cache.set_many(
+            db, [(a["cache_key"], a["result"]) for _, a in fresh])
@@ -0,0 +1,248 @@
+import asyncio
+import sys
+from collections import defaultdict
+from datetime import date, datetime
+
+from sqlalchemy import select, delete, insert, func, case, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Ensure models are imported (relationships resolve by name)
+import app.models  # noqa: F401
+from app.database import AsyncSessionLocal
+from app.models.prediction import Prediction
+from app.models.prediction_stats import UserDailyStats, GlobalDailyStats
+from app.prediction.versions import bump_history_versions
+
+ROLLUP_KEYS = ("day", "currency_code", "denomination_value")
+
+
+def _upsert(db: AsyncSession, model, rows: list[dict], keys: tuple[str, ...]):
+    """INSERT ... ON CONFLICT DO UPDATE adding the counters to existing rows."""
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise RuntimeError(f"Rollups do not support the '{dialect}' dialect")
+
+    table = model.__table__
+    stmt = dialect_insert(table).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={
+            "count": table.c.count + stmt.excluded.count,
+            "counterfeit_count": table.c.counterfeit_count + stmt.excluded.counterfeit_count,
+            "confidence_sum": table.c.confidence_sum + stmt.excluded.confidence_sum,
+        },
+    )
+
+
+def _group(predictions) -> dict[tuple, list]:
+    groups = defaultdict(lambda: [0, 0, 0.0])
+    for p in predictions:
+        key = (
+            p.user_id,
+            (p.timestamp or datetime.utcnow()).date(),
+            p.currency_code,
+            p.denomination_value or 0,
+        )
+        counters = groups[key]
+        counters[0] += 1
+        counters[1] += 1 if p.is_counterfeit else 0
+        counters[2] += p.confidence
+    return groups
+
+
+async def apply_to_rollups(db: AsyncSession, predictions, sign: int = 1):
+    """
+    Adds (sign=1) or removes (sign=-1) predictions from the per-user and
+    global daily rollups, and bumps the users' history versions. Call it in
+    the same transaction as the insert or delete of the predictions so the
+    rollups never drift and no stale history is answered with a 304.
+    """
+    groups = _group(predictions)
+    if not groups:
+        return
+
+    user_rows = []
+    global_totals = defaultdict(lambda: [0, 0, 0.0])
+    # Sorted so concurrent writers lock rollup rows in the same order
+    for (user_id, day, currency_code, denomination), (count, fake, conf) in sorted(groups.items()):
+        user_rows.append({
+            "user_id": user_id, "day": day, "currency_code": currency_code,
+            "denomination_value": denomination, "count": sign * count,
+            "counterfeit_count": sign * fake, "confidence_sum": sign * conf,
+        })
+        totals = global_totals[(day, currency_code, denomination)]
+        totals[0] += count
+        totals[1] += fake
+        totals[2] += conf
+
+    global_rows = [
+        {"day": day, "currency_code": currency_code, "denomination_value": denomination,
+         "count": sign * count, "counterfeit_count": sign * fake, "confidence_sum": sign * conf}
+        for (day, currency_code, denomination), (count, fake, conf) in sorted(global_totals.items())
+    ]
+
+    await db.execute(_upsert(db, UserDailyStats, user_rows, ("user_id",) + ROLLUP_KEYS))
+    await db.execute(_upsert(db, GlobalDailyStats, global_rows, ROLLUP_KEYS))
+    if sign < 0:
+        user_days = {(user_id, day) for user_id, day, *_ in groups}
+        await _drop_empty_rows(db, user_days, {day for _, day in user_days})
+    await bump_history_versions(db, (user_id for user_id, *_ in groups))
+
+
+async def remove_user_from_rollups(db: AsyncSession, user_id: int):
+    """
+    All predictions of a user are going away (clear history, delete
+    profile): subtract the user's rollups from the global ones and drop
+    them. O(days), the predictions themselves are not read.
+    """
+    rows = (await db.execute(
+        select(UserDailyStats).where(UserDailyStats.user_id == user_id)
+    )).scalars().all()
+    if not rows:
+        return
+
+    global_rows = [
+        {"day": r.day, "currency_code": r.currency_code,
+         "denomination_value": r.denomination_value, "count": -r.count,
+         "counterfeit_count": -r.counterfeit_count, "confidence_sum": -r.confidence_sum}
+        for r in rows
+    ]
+    await db.execute(_upsert(db, GlobalDailyStats, global_rows, ROLLUP_KEYS))
+    await db.execute(delete(UserDailyStats).where(UserDailyStats.user_id == user_id))
+    await _drop_empty_rows(db, set(), {r.day for r in rows})
+
+
+async def _drop_empty_rows(db: AsyncSession, user_days: set[tuple], days: set[date]):
+    """
+    Deletes the rows that reached zero among the (user_id, day) and day keys
+    just decremented, not a scan of the whole tables on every delete.
+    """
+    if user_days:
+        await db.execute(delete(UserDailyStats).where(
+            tuple_(UserDailyStats.user_id, UserDailyStats.day).in_(sorted(user_days)),
+            UserDailyStats.count <= 0,
+        ))
+    if days:
+        await db.execute(delete(GlobalDailyStats).where(
+            GlobalDailyStats.day.in_(sorted(days)),
+            GlobalDailyStats.count <= 0,
+        ))
+
+
+async def get_stats(db: AsyncSession, user_id: int | None,
+                    date_from: date | None = None, date_to: date | None = None) -> dict:
+    """Totals, per currency, per denomination and per day from the rollups."""
+    model = GlobalDailyStats if user_id is None else UserDailyStats
+    filters = []
+    if user_id is not None:
+        filters.append(UserDailyStats.user_id == user_id)
+    if date_from is not None:
+        filters.append(model.day >= date_from)
+    if date_to is not None:
+        filters.append(model.day <= date_to)
+
+    counters = (
+        func.coalesce(func.sum(model.count), 0).label("count"),
+        func.coalesce(func.sum(model.counterfeit_count), 0).label("counterfeit_count"),
+        func.coalesce(func.sum(model.confidence_sum), 0.0).label("confidence_sum"),
+    )
+
+    def summary(row, **extra) -> dict:
+        count = row.count or 0
+        return {
+            **extra,
+            "count": count,
+            "counterfeit_count": row.counterfeit_count or 0,
+            "counterfeit_rate": (row.counterfeit_count or 0) / count if count else 0.0,
+            "avg_confidence": (row.confidence_sum or 0.0) / count if count else 0.0,
+        }
+
+    totals = (await db.execute(select(*counters).where(*filters))).one()
+    by_currency = (await db.execute(
+        select(model.currency_code, *counters).where(*filters)
+        .group_by(model.currency_code).order_by(model.currency_code)
+    )).all()
+    by_denomination = (await db.execute(
+        select(model.currency_code, model.denomination_value, *counters).where(*filters)
+        .group_by(model.currency_code, model.denomination_value)
+        .order_by(model.currency_code, model.denomination_value)
+    )).all()
+    daily = (await db.execute(
+        select(model.day, *counters).where(*filters)
+        .group_by(model.day).order_by(model.day)
+    )).all()
+
+    return {
+        "scope": "global" if user_id is None else "user",
+        "totals": summary(totals),
+        "by_currency": [summary(r, currency_code=r.currency_code) for r in by_currency],
+        "by_denomination": [
+            summary(r, currency_code=r.currency_code,
+                    denomination_value=r.denomination_value or None)
+            for r in by_denomination
+        ],
+        "daily": [summary(r, day=r.day) for r in daily],
+    }
+
+
+async def rebuild_rollups():
+    """
+    Recomputes both rollup tables from the predictions table in one
+    transaction. Predictions written while it runs may be missed, run it
+    during a quiet period.
+    """
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(UserDailyStats))
+        await db.execute(delete(GlobalDailyStats))
+
+        await db.execute(insert(UserDailyStats).from_select(
+            ["user_id", "day", "currency_code", "denomination_value",
+             "count", "counterfeit_count", "confidence_sum"],
+            select(
+                Prediction.user_id,
+                func.date(Prediction.timestamp),
+                Prediction.currency_code,
+                func.coalesce(Prediction.denomination_value, 0),
+                func.count(),
+                func.sum(case((Prediction.is_counterfeit, 1), else_=0)),
+                func.sum(Prediction.confidence),
+            ).group_by(
+                Prediction.user_id,
+                func.date(Prediction.timestamp),
+                Prediction.currency_code,
+                func.coalesce(Prediction.denomination_value, 0),
+            ),
+        ))
+        await db.execute(insert(GlobalDailyStats).from_select(
+            ["day", "currency_code", "denomination_value",
+             "count", "counterfeit_count", "confidence_sum"],
+            select(
+                UserDailyStats.day,
+                UserDailyStats.currency_code,
+                UserDailyStats.denomination_value,
+                func.sum(UserDailyStats.count),
+                func.sum(UserDailyStats.counterfeit_count),
+                func.sum(UserDailyStats.confidence_sum),
+            ).group_by(
+                UserDailyStats.day,
+                UserDailyStats.currency_code,
+                UserDailyStats.denomination_value,
+            ),
+        ))
+        await db.commit()
+
+        user_rows = (await db.execute(select(func.count()).select_from(UserDailyStats))).scalar_one()
+        global_rows = (await db.execute(select(func.count()).select_from(GlobalDailyStats))).scalar_one()
+        print(f"✅ Rollups rebuilt ({user_rows} user rows, {global_rows} global rows)")
+
+
+if __name__ == "__main__":
+    # python -m app.prediction.stats rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        print("usage: python -m app.prediction.stats rebuild")
+        sys.exit(1)
+    asyncio.run(rebuild_rollups())
@@ -0,0 +1,362 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from io import BytesIO
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect, status
+
+from app.config import (
+    IMAGE_MAX_SIDE,
+    MAX_UPLOAD_BYTES,
+    STREAM_WINDOW_MS,
+    STREAM_MAX_FPS,
+    STREAM_DEDUP_DISTANCE,
+    STREAM_STABLE_RESULTS,
+    STREAM_ACCEPT_CONFIDENCE,
+    STREAM_MAX_SECONDS,
+    STREAM_MAX_SESSIONS,
+)
+from app.database import AsyncSessionLocal
+from app.models.user import User
+from app.prediction.quality import quality_gate, measure
+from app.prediction.service import (
+    analyze_ingested,
+    build_prediction,
+    prediction_response,
+    remember_results,
+)
+from app.prediction.stats import apply_to_rollups
+from app.utils.image_utils import (
+    IMAGE_SIGNATURES,
+    DecodedImage,
+    InvalidImageError,
+    decode_image,
+    hamming_distance,
+    ingested_from_bytes,
+)
+from app.utils.logger import create_log
+from app.utils.metrics import span
+from app.utils.storage import storage
+
+
+class Frame:
+    """A camera frame that passed the quality checks."""
+
+    __slots__ = ("seq", "data", "image", "phash", "sharpness")
+
+    def __init__(self, seq: int, data: bytes, image: DecodedImage, sharpness: float):
+        self.seq = seq
+        self.data = data
+        self.image = image
+        self.phash = image.phash
+        self.sharpness = sharpness
+
+
+def score_frame(seq: int, data: bytes) -> tuple[Frame | None, list[dict]]:
+    """Decode + quality measures of one frame (blocking, run in a thread)."""
+    image = decode_image(BytesIO(data), IMAGE_MAX_SIDE)
+    measures = measure(image.image, quality_gate.analysis_side)
+    reasons = quality_gate.reasons_for(image.original_size, measures)
+    if reasons:
+        return None, reasons
+    # Frame() computes the dHash, also off the event loop
+    return Frame(seq, data, image, measures["sharpness"]), []
+
+
+def result_key(result: dict) -> tuple:
+    return result["currency_code"], result["denomination_value"], result["is_counterfeit"]
+
+
+class ScanSession:
+    """
+    One camera scan over a WebSocket. Binary messages are JPEG/PNG frames;
+    the text message {"type": "stop"} ends the scan. Server messages are
+    JSON with a `type`:
+
+    - ready: settings of the session
+    - hint: no usable frame in the last window, with the quality reasons
+    - result: answer for a window (`reused` when a near-identical frame
+      was analyzed before, `agreement` = distinct frames in a row with this
+      answer; reused answers do not add to it)
+    - final: the stable answer, stored as a Prediction; the socket closes
+    - error / timeout: then the socket closes (errors of one window do not)
+
+    Frames are received in one task and judged as they come: beyond
+    `max_fps` they are dropped without decoding, unusable ones are counted
+    for the next hint, the sharpest usable one is kept. A second task
+    closes a window every `window` seconds and analyzes its best frame.
+    """
+
+    def __init__(self, websocket: WebSocket, user: User, sessions: "ScanSessions"):
+        self.websocket = websocket
+        self.user = user
+        self.sessions = sessions
+        self.window = STREAM_WINDOW_MS / 1000
+        self.min_interval = 1 / STREAM_MAX_FPS if STREAM_MAX_FPS > 0 else 0.0
+        self._send_lock = asyncio.Lock()
+
+        self.seq = 0
+        self.last_scored = 0.0
+        self.best: Frame | None = None
+        self.rejections: Counter = Counter()
+        self.last_reasons: dict[str, dict] = {}
+        self.disconnected = False
+        # (phash, frame, analyzed) of every frame sent through the pipeline
+        self.analyzed: list[tuple[int, Frame, dict]] = []
+        self.last_key = None
+        self.agreement = 0
+
+    async def send(self, message: dict):
+        async with self._send_lock:
+            await self.websocket.send_json(message)
+
+    async def run(self):
+        await self.send({
+            "type": "ready",
+            "window_ms": STREAM_WINDOW_MS,
+            "max_fps": STREAM_MAX_FPS,
+            "stable_results": STREAM_STABLE_RESULTS,
+            "max_seconds": STREAM_MAX_SECONDS,
+        })
+        receiver = asyncio.create_task(self.receive_frames())
+        analyzer = asyncio.create_task(self.analyze_windows())
+        done, pending = await asyncio.wait(
+            {receiver, analyzer}, timeout=STREAM_MAX_SECONDS,
+            return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        close_code = status.WS_1000_NORMAL_CLOSURE
+        if not done:
+            self.sessions.timeouts += 1
+            await self.try_send({"type": "timeout", "detail": "No stable answer in time"})
+        for task in done:
+            error = task.exception()
+            if isinstance(error, WebSocketDisconnect) or self.disconnected:
+                return
+            if error is not None:
+                print(f"[Stream] Scan of user {self.user.id} failed: {error!r}")
+                await self.try_send({"type": "error", "detail": f"Scan failed: {error}"})
+                close_code = status.WS_1011_INTERNAL_ERROR
+        try:
+            await self.websocket.close(code=close_code)
+        except RuntimeError:
+            pass  # client already gone
+
+    async def try_send(self, message: dict):
+        try:
+            await self.send(message)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+
+    # ------------------------------------
+    # Frames
+    # ------------------------------------
+    async def receive_frames(self):
+        """Returns when the client stops the scan or disconnects."""
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                self.disconnected = True
+                return
+            if message.get("bytes") is not None:
+                await self.on_frame(message["bytes"])
+            elif message.get("text") is not None and self.is_stop(message["text"]):
+                return
+
+    @staticmethod
+    def is_stop(text: str) -> bool:
+        try:
+            return json.loads(text).get("type") == "stop"
+        except (ValueError, AttributeError):
+            return False
+
+    async def on_frame(self, data: bytes):
+        self.seq += 1
+        self.sessions.frames_received += 1
+        if len(data) > MAX_UPLOAD_BYTES or not data.startswith(IMAGE_SIGNATURES):
+            self.sessions.frames_invalid += 1
+            await self.send({"type": "error", "seq": self.seq,
+                             "detail": "Frame is not a supported image or too large"})
+            return
+
+        # Frame sampling: frames queued while the last one was scored are
+        # dropped here without decoding
+        now = time.monotonic()
+        if now - self.last_scored < self.min_interval:
+            self.sessions.frames_sampled_out += 1
+            return
+        self.last_scored = now
+
+        try:
+            with span("stream.score"):
+                frame, reasons = await asyncio.to_thread(score_frame, self.seq, data)
+        except InvalidImageError:
+            self.sessions.frames_invalid += 1
+            return
+        if frame is None:
+            self.sessions.frames_rejected += 1
+            self.rejections.update(reason["code"] for reason in reasons)
+            self.last_reasons.update((reason["code"], reason) for reason in reasons)
+            return
+        if self.best is None or frame.sharpness > self.best.sharpness:
+            self.best = frame
+
+    # ------------------------------------
+    # Windows
+    # ------------------------------------
+    async def analyze_windows(self):
+        """Returns once a stable answer was stored."""
+        while True:
+            await asyncio.sleep(self.window)
+            frame, self.best = self.best, None
+            rejections, self.rejections = self.rejections, Counter()
+            if frame is None:
+                if rejections:
+                    await self.send({"type": "hint", "reasons": [
+                        self.last_reasons.get(code, {"code": code})
+                        for code, _ in rejections.most_common(2)]})
+                continue
+            if await self.on_window(frame):
+                return
+
+    async def on_window(self, frame: Frame) -> bool:
+        """Answer for the best frame of a window; True once the final one was stored."""
+        entry = self.find_analyzed(frame)
+        reused = entry is not None
+        if reused:
+            self.sessions.frames_duplicate += 1
+        else:
+            entry = await self.analyze(frame)
+            if entry is None:
+                return False
+
+        _, accepted, analyzed = entry
+        result = analyzed["result"]
+        # Only answers for distinct frames agree with each other: a still
+        # camera sending the same picture again is no new evidence
+        if not reused:
+            key = result_key(result)
+            self.agreement = self.agreement + 1 if key == self.last_key else 1
+            self.last_key = key
+        await self.send({"type": "result", "seq": accepted.seq, "reused": reused,
+                         "agreement": self.agreement, "result": result})
+
+        if self.agreement >= STREAM_STABLE_RESULTS or result["confidence"] >= STREAM_ACCEPT_CONFIDENCE:
+            await self.finish(accepted, analyzed)
+            return True
+        return False
+
+    def find_analyzed(self, frame: Frame):
+        """Earlier frame the model saw that looks the same as this one."""
+        for entry in self.analyzed:
+            if hamming_distance(entry[0], frame.phash) <= STREAM_DEDUP_DISTANCE:
+                return entry
+        return None
+
+    async def analyze(self, frame: Frame):
+        """Cache or model; None (after telling the client) on errors."""
+        self.sessions.frames_analyzed += 1
+        try:
+            async with AsyncSessionLocal() as db:
+                analyzed = await analyze_ingested(
+                    ingested_from_bytes(frame.data), None, db, asyncio.Lock(),
+                    decoded=frame.image, check_quality=False, user_id=self.user.id)
+        except HTTPException as e:
+            await self.send({"type": "error", "seq": frame.seq,
+                             "status_code": e.status_code, "detail": e.detail})
+            return None
+        entry = (frame.phash, frame, analyzed)
+        self.analyzed.append(entry)
+        return entry
+
+    async def finish(self, frame: Frame, analyzed: dict):
+        """Stores the accepted frame and its result as a Prediction."""
+        # Stored before the row, nothing to overlap with here
+        key = storage.new_key("scan.jpg")
+        try:
+            await storage.save(key, frame.data)
+        except Exception as e:
+            await self.send({"type": "error", "seq": frame.seq, "status_code": 503,
+                             "detail": f"Image storage unavailable: {e}"})
+            return
+        analyzed["image_path"] = key
+
+        async with AsyncSessionLocal() as db:
+            prediction = build_prediction(self.user.id, analyzed)
+            db.add(prediction)
+            await apply_to_rollups(db, [prediction])
+            await db.commit()
+            await db.refresh(prediction)
+            await remember_results(db, [(prediction, analyzed)])
+            result = analyzed["result"]
+            await create_log(
+                db,
+                action="PREDICT_STREAM",
+                message=f"User {self.user.full_name} scanned {result['name_en']} ({result['confidence']}%) in {self.seq} frames",
+                user_id=self.user.id,
+            )
+        self.sessions.finals += 1
+        await self.send({
+            "type": "final",
+            "frames": self.seq,
+            "model_frames": len(self.analyzed),
+            "prediction": prediction_response(prediction, analyzed),
+        })
+
+
+class ScanSessions:
+    """Open scanning sessions of this worker, with the frame counters."""
+
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max_sessions
+        self.active = 0
+
+        # Metrics
+        self.started = 0
+        self.rejected = 0
+        self.finals = 0
+        self.timeouts = 0
+        self.frames_received = 0
+        self.frames_invalid = 0
+        self.frames_sampled_out = 0
+        self.frames_rejected = 0
+        self.frames_duplicate = 0
+        self.frames_analyzed = 0
+
+    async def serve(self, websocket: WebSocket, user: User):
+        """Runs a scan on an accepted WebSocket (closed with 1013 when over capacity)."""
+        if self.active >= self.max_sessions:
+            self.rejected += 1
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            return
+        self.active += 1
+        self.started += 1
+        try:
+            await ScanSession(websocket, user, self).run()
+        finally:
+            self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "max_sessions": self.max_sessions,
+            "started": self.started,
+            "rejected": self.rejected,
+            "finals": self.finals,
+            "timeouts": self.timeouts,
+            "frames": {
+                "received": self.frames_received,
+                "invalid": self.frames_invalid,
+                "sampled_out": self.frames_sampled_out,
+                "rejected_quality": self.frames_rejected,
+                "duplicate": self.frames_duplicate,
+                "analyzed": self.frames_analyzed,
+            },
+        }
+
+
+# Shared session registry for the whole app
+scan_sessions = ScanSessions(STREAM_MAX_SESSIONS)
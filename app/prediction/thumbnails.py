@@ -0,0 +1,206 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import time
+from io import BytesIO
+
+from PIL import Image
+from sqlalchemy import update
+
+from app.config import (
+    SECRET_KEY,
+    DERIVATIVE_URL_TTL_SECONDS,
+    THUMBNAIL_SIZES,
+    THUMBNAIL_FORMATS,
+    THUMBNAIL_QUALITY,
+    THUMBNAIL_CONCURRENCY,
+    THUMBNAIL_MAX_PENDING,
+)
+from app.database import AsyncSessionLocal
+from app.models.prediction import Prediction
+from app.prediction.versions import bump_history_versions
+from app.utils.storage import storage, LEGACY_PREFIX
+
+FORMAT_EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+
+
+def derivative_key(image_path: str, variant: str, fmt: str) -> str:
+    """ab/cd/<uuid>.jpg -> ab/cd/<uuid>_thumb.webp"""
+    if image_path.startswith(LEGACY_PREFIX):
+        image_path = image_path[len(LEGACY_PREFIX):]
+    base = os.path.splitext(image_path)[0]
+    return f"{base}_{variant}.{FORMAT_EXTENSIONS[fmt]}"
+
+
+def render_derivatives(data: bytes) -> dict[tuple[str, str], bytes]:
+    """
+    Decodes the original once (JPEG draft at the largest needed size) and
+    encodes every size in every format, largest first so each size is
+    downscaled from the previous one.
+    """
+    img = Image.open(BytesIO(data))
+    largest = max(THUMBNAIL_SIZES.values())
+    scale = min(1.0, largest / max(img.size))
+    img.draft("RGB", (int(img.width * scale), int(img.height * scale)))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    rendered = {}
+    for variant, size in sorted(THUMBNAIL_SIZES.items(), key=lambda item: -item[1]):
+        img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for fmt in THUMBNAIL_FORMATS:
+            out = BytesIO()
+            if fmt == "webp":
+                img.save(out, format="WEBP", quality=THUMBNAIL_QUALITY, method=4)
+            else:
+                img.save(out, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+            rendered[(variant, fmt)] = out.getvalue()
+    return rendered
+
+
+def sign(prediction_id: int, user_id: int, expires: int) -> str:
+    """
+    Capability for the unauthenticated on-demand URL (<img> sends no token),
+    bound to the owner (a reused prediction id is not theirs) and expiring
+    at `expires` (unix time, 0 = never).
+    """
+    message = f"derivative:{prediction_id}:{user_id}:{expires}"
+    digest = hmac.new(SECRET_KEY.encode(), message.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip("=")
+
+
+def verify(prediction_id: int, user_id: int, expires: int, signature: str) -> bool:
+    if expires and expires < time.time():
+        return False
+    return hmac.compare_digest(sign(prediction_id, user_id, expires), signature)
+
+
+def url_expiry() -> int:
+    """
+    Expiry of the URLs signed now, rounded up to a half-lifetime step so a
+    history page keeps the same URLs (and ETag, see HistoryVersions) within
+    a step. A URL is valid for between half and all of its lifetime.
+    """
+    if not DERIVATIVE_URL_TTL_SECONDS:
+        return 0
+    step = max(1, DERIVATIVE_URL_TTL_SECONDS // 2)
+    return (int(time.time()) // step + 2) * step
+
+
+def derivative_urls(prediction_id: int, user_id: int, image_path: str, ready: bool) -> dict:
+    """
+    {"thumb": {"webp": url, "jpeg": url}, "preview": {...}}. Storage URLs
+    once generated, otherwise the on-demand endpoint that makes them.
+    """
+    expires = url_expiry()
+    signature = sign(prediction_id, user_id, expires)
+    urls = {}
+    for variant in THUMBNAIL_SIZES:
+        urls[variant] = {}
+        for fmt in THUMBNAIL_FORMATS:
+            if ready:
+                url = storage.url(derivative_key(image_path, variant, fmt))
+            else:
+                url = (f"/predict/{prediction_id}/image/{variant}.{FORMAT_EXTENSIONS[fmt]}"
+                       f"?uid={user_id}&exp={expires}&sig={signature}")
+            urls[variant][fmt] = url
+    return urls
+
+
+class DerivativeGenerator:
+    """
+    Makes the derivatives of new predictions in the background, at most
+    `concurrency` at a time so it never competes much with predictions.
+    When more than `max_pending` are waiting new ones are skipped, they
+    are generated on demand later instead.
+    """
+
+    def __init__(self, concurrency: int, max_pending: int):
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: set[asyncio.Task] = set()
+        # prediction id -> running generation (on-demand requests join it)
+        self._inflight: dict[int, asyncio.Task] = {}
+
+        # Metrics
+        self.generated = 0
+        self.on_demand = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes_written = 0
+
+    def schedule(self, prediction_id: int, image_path: str, data: bytes | None = None):
+        if len(self._tasks) >= self.max_pending:
+            self.skipped += 1
+            return
+        task = asyncio.create_task(self._run_logged(prediction_id, image_path, data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_logged(self, prediction_id: int, image_path: str, data: bytes | None):
+        try:
+            await self.ensure(prediction_id, image_path, data)
+        except Exception as e:
+            print(f"[Thumbnails] Prediction {prediction_id} failed: {e}")
+
+    async def ensure(self, prediction_id: int, image_path: str, data: bytes | None = None):
+        """Generates (once) the derivatives of a prediction and marks the row."""
+        task = self._inflight.get(prediction_id)
+        if task is None:
+            task = asyncio.create_task(self._generate(prediction_id, image_path, data))
+            self._inflight[prediction_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(prediction_id, None))
+        await asyncio.shield(task)
+
+    async def _generate(self, prediction_id: int, image_path: str, data: bytes | None):
+        async with self._semaphore:
+            try:
+                if data is None:
+                    data = await storage.load(image_path)
+                rendered = await asyncio.to_thread(render_derivatives, data)
+                await asyncio.gather(*(
+                    storage.save(derivative_key(image_path, variant, fmt), content)
+                    for (variant, fmt), content in rendered.items()
+                ))
+            except Exception:
+                self.failed += 1
+                raise
+
+        async with AsyncSessionLocal() as db:
+            user_id = (await db.execute(
+                update(Prediction)
+                .where(Prediction.id == prediction_id)
+                .values(has_derivatives=True)
+                .returning(Prediction.user_id)
+            )).scalar()
+            # The history now lists the storage URLs of the derivatives
+            if user_id is not None:
+                await bump_history_versions(db, [user_id])
+            await db.commit()
+        self.generated += 1
+        self.bytes_written += sum(len(content) for content in rendered.values())
+
+    async def stop(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "sizes": THUMBNAIL_SIZES,
+            "formats": list(THUMBNAIL_FORMATS),
+            "pending": len(self._tasks),
+            "generated": self.generated,
+            "on_demand": self.on_demand,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "bytes_written": self.bytes_written,
+        }
+
+
+# Shared generator for the whole app
+derivative_generator = DerivativeGenerator(
+    concurrency=THUMBNAIL_CONCURRENCY,
+    max_pending=THUMBNAIL_MAX_PENDING,
+)
@@ -0,0 +1,114 @@
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import DERIVATIVE_URL_TTL_SECONDS
+from app.models.user import User
+from app.utils.storage import storage
+
+# Part of every ETag: bump when the JSON of the read endpoints changes shape
+REPRESENTATION = 1
+
+
+async def bump_history_versions(db: AsyncSession, user_ids):
+    """
+    Marks the users' predictions as changed. Call it in the transaction
+    that inserts, deletes or updates them (apply_to_rollups does).
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    await db.execute(
+        update(User)
+        .where(User.id.in_(user_ids))
+        .values(history_version=User.history_version + 1,
+                history_changed_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _opaque(tag: str) -> str:
+    """ETag without the weak prefix (If-None-Match uses weak comparison)."""
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+class HistoryVersions:
+    """
+    Conditional GETs of the prediction read endpoints. The validators come
+    from the user's history version (one primary key lookup on `users`),
+    so an unchanged history answers 304 without reading `predictions`.
+
+    Image URLs in the body expire (presigned storage URLs, signed
+    on-demand derivative URLs), so the ETag also changes every half of the
+    shortest URL lifetime and no Last-Modified is sent: a revalidated copy
+    never holds URLs older than that.
+    """
+
+    def __init__(self):
+        # Metrics
+        self.checked = 0
+        self.not_modified = 0
+
+    async def validators(self, db: AsyncSession, user_id: int) -> dict:
+        row = (await db.execute(
+            select(User.history_version, User.history_changed_at).where(User.id == user_id)
+        )).one_or_none()
+        version, changed_at = row if row is not None else (0, None)
+
+        tag = f"{REPRESENTATION}.{user_id}.{version}"
+        url_ttls = [ttl for ttl in (storage.url_ttl, DERIVATIVE_URL_TTL_SECONDS) if ttl]
+        if url_ttls:
+            tag += f".{int(time.time() // max(1, min(url_ttls) // 2))}"
+        headers = {"ETag": f'W/"{tag}"', "Cache-Control": "private, no-cache"}
+        if changed_at is not None and not url_ttls:
+            headers["Last-Modified"] = format_datetime(
+                changed_at.replace(tzinfo=timezone.utc), usegmt=True)
+        return headers
+
+    @staticmethod
+    def is_fresh(request: Request, headers: dict) -> bool:
+        """The client's copy is current (If-None-Match wins over If-Modified-Since)."""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            if if_none_match.strip() == "*":
+                return True
+            return _opaque(headers["ETag"]) in {_opaque(tag) for tag in if_none_match.split(",")}
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and "Last-Modified" in headers:
+            try:
+                return (parsedate_to_datetime(if_modified_since)
+                        >= parsedate_to_datetime(headers["Last-Modified"]))
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    async def check(self, request: Request, response: Response, db: AsyncSession,
+                    user_id: int) -> Response | None:
+        """
+        Sets the validators on `response`; returns the 304 to send instead
+        when the client's copy is current.
+        """
+        headers = await self.validators(db, user_id)
+        self.checked += 1
+        if self.is_fresh(request, headers):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "checked": self.checked,
+            "not_modified": self.not_modified,
+            "not_modified_ratio": self.not_modified / self.checked if self.checked else 0.0,
+        }
+
+
+# Shared validators for the whole app
+history_versions = HistoryVersions()
@@ -0,0 +1,171 @@
+import hashlib
+from io import BytesIO
+
+from fastapi import UploadFile
+from PIL import Image
+
+HASH_SIZE = 8  # 8x8 difference hash = 64 bits
+CHUNK_SIZE = 64 * 1024
+
+# Magic numbers of the formats we accept
+IMAGE_SIGNATURES = (
+    b"\xff\xd8\xff",          # JPEG
+    b"\x89PNG\r\n\x1a\n",     # PNG
+    b"RIFF",                  # WEBP (RIFF....WEBP)
+    b"GIF87a",
+    b"GIF89a",
+    b"BM",                    # BMP
+)
+
+
+class InvalidImageError(ValueError):
+    """Upload is not an image we can decode."""
+
+
+class UploadTooLargeError(ValueError):
+    """Upload is bigger than MAX_UPLOAD_BYTES."""
+
+
+class IngestedUpload:
+    """Upload read once: in-memory buffer plus its sha256 and size."""
+
+    def __init__(self, buffer: BytesIO, sha256: str, size: int):
+        self.buffer = buffer
+        self.sha256 = sha256
+        self.size = size
+
+
+async def ingest_upload(upload: UploadFile, max_bytes: int) -> IngestedUpload:
+    """
+    Reads the upload in chunks and, in the same pass, hashes it, checks the
+    size limit and image signature and keeps one in-memory copy (used for
+    the model and handed to the image storage).
+    """
+    hasher = hashlib.sha256()
+    buffer = BytesIO()
+    size = 0
+    while chunk := await upload.read(CHUNK_SIZE):
+        if size == 0 and not chunk.startswith(IMAGE_SIGNATURES):
+            raise InvalidImageError("Unsupported image format")
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLargeError(
+                f"Image is larger than {max_bytes // (1024 * 1024)} MB")
+        hasher.update(chunk)
+        buffer.write(chunk)
+    if size == 0:
+        raise InvalidImageError("Empty upload")
+
+    buffer.seek(0)
+    return IngestedUpload(buffer, hasher.hexdigest(), size)
+
+
+def ingested_from_bytes(data: bytes) -> IngestedUpload:
+    """Wraps an already stored upload back into an IngestedUpload."""
+    return IngestedUpload(BytesIO(data), hashlib.sha256(data).hexdigest(), len(data))
+
+
+class DecodedImage:
+    """
+    Image decoded once (downscaled to `max_side`) and reused for the
+    perceptual hash and the bytes sent to the model.
+    """
+
+    def __init__(self, image: Image.Image, source: BytesIO, passthrough: bool,
+                 original_size: tuple[int, int]):
+        self.image = image
+        self.source = source
+        # (width, height) of the upload before downscaling
+        self.original_size = original_size
+        # Source is already a small enough JPEG, send it as-is
+        self.passthrough = passthrough
+        self._phash = None
+
+    @property
+    def phash(self) -> int:
+        if self._phash is None:
+            self._phash = dhash(self.image)
+        return self._phash
+
+    def to_jpeg(self, quality: int) -> bytes:
+        if self.passthrough:
+            return self.source.getvalue()
+        out = BytesIO()
+        self.image.save(out, format="JPEG", quality=quality)
+        return out.getvalue()
+
+
+def decode_image(source: BytesIO, max_side: int) -> DecodedImage:
+    """
+    Decodes an upload for the model. Large JPEGs are decoded with draft()
+    at a reduced DCT scale, then thumbnail() brings the longest side down
+    to `max_side`.
+    """
+    source.seek(0)
+    try:
+        img = Image.open(source)
+        original_format = img.format
+        original_size = img.size
+        passthrough = (
+            original_format == "JPEG"
+            and max(img.size) <= max_side
+            and img.mode == "RGB"
+        )
+        if not passthrough:
+            # draft() keeps both sides >= the requested size, so ask for the
+            # size the image will have after thumbnail(), not a square
+            scale = min(1.0, max_side / max(img.size))
+            img.draft("RGB", (int(img.width * scale), int(img.height * scale)))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+    except Exception as e:
+        raise InvalidImageError(f"Invalid image file: {e}") from e
+    return DecodedImage(img, source, passthrough, original_size)
+
+
+def dhash(img: Image.Image, hash_size: int = HASH_SIZE) -> int:
+    """
+    Difference hash of an image: shrink to (hash_size + 1) x hash_size
+    greyscale and set one bit per pixel that is brighter than its right
+    neighbour. Photos of the same note with slightly different framing or
+    lighting end up a few bits apart.
+    """
+    small = img.convert("L").resize(
+        (hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    width = hash_size + 1
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * width
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def dhash_bytes(source: bytes | BytesIO) -> int:
+    """dHash straight from encoded bytes, using JPEG draft mode when possible."""
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    source.seek(0)
+    try:
+        img = Image.open(source)
+        # Ask the JPEG decoder for a 1/8 scale image, the hash only needs 9x8 pixels
+        img.draft("L", (64, 64))
+        return dhash(img)
+    except Exception as e:
+        raise InvalidImageError(f"Invalid image file: {e}") from e
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def to_signed64(value: int) -> int:
+    """Unsigned 64 bit hash -> signed value that fits a BIGINT column."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def from_signed64(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
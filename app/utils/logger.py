@@ -1,23 +1,236 @@
+import asyncio
+import json
+import os
+import sys
+from abc import ABC, abstractmethod
 from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import (
+    LOG_SINK,
+    LOG_FILE_PATH,
+    LOG_QUEUE_SIZE,
+    LOG_FLUSH_INTERVAL_MS,
+    LOG_FLUSH_BATCH_SIZE,
+)
+from app.database import AsyncSessionLocal
 from app.models.system_log import SystemLog
 
 
-async def create_log(db: AsyncSession, action: str, message: str, user_id: int | None = None):
+class BufferedLogSink(ABC):
+    """
+    Bounded in-memory queue of log entries drained by one background task.
+
+    Entries are written in batches every `flush_interval` seconds or
+    `batch_size` entries, whichever comes first. When the queue is full new
+    entries are dropped (and counted) instead of slowing down requests.
+    stop() drains everything still queued.
+    """
+
+    name = "buffered"
+
+    def __init__(self, queue_size: int, flush_interval: float, batch_size: int):
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+        # Metrics
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run(), name=f"log-sink-{self.name}")
+
+    async def stop(self):
+        if not self.running:
+            return
+        # Sentinel: the writer flushes what is left and exits
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    def emit(self, entry: dict) -> bool:
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            entry = await self._queue.get()
+            if entry is None:
+                return
+            batch = [entry]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+            # Let the batch fill up until it is full or the interval is over
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    await asyncio.sleep(min(remaining, 0.05))
+                    continue
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: list[dict]):
+        try:
+            await self.write_batch(batch)
+            self.flushed += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"[SystemLog] Failed to write {len(batch)} log entries: {e}")
+
+    @abstractmethod
+    async def write_batch(self, batch: list[dict]):
+        """Writes one batch of entries; raising counts them as failed."""
+
+    def stats(self) -> dict:
+        return {
+            "sink": self.name,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+
+class DatabaseLogSink(BufferedLogSink):
+    """Bulk INSERT into system_logs, one transaction per batch."""
+
+    name = "db"
+
+    async def write_batch(self, batch: list[dict]):
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(insert(SystemLog), batch)
+                await db.commit()
+                return
+            except IntegrityError:
+                await db.rollback()
+
+            # One bad row (e.g. its user was deleted meanwhile) must not
+            # lose the whole batch: retry row by row
+            for entry in batch:
+                try:
+                    await db.execute(insert(SystemLog), [entry])
+                    await db.commit()
+                except IntegrityError:
+                    await db.rollback()
+                    self.failed += 1
+                    self.flushed -= 1
+
+
+class FileLogSink(BufferedLogSink):
+    """Appends JSON lines to a local file."""
+
+    name = "file"
+
+    def __init__(self, path: str, *args):
+        super().__init__(*args)
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _append(self, lines: str):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    async def write_batch(self, batch: list[dict]):
+        await asyncio.to_thread(self._append, _json_lines(batch))
+
+
+class StdoutLogSink(BufferedLogSink):
+    """JSON lines on stdout, for platforms that collect container logs."""
+
+    name = "stdout"
+
+    async def write_batch(self, batch: list[dict]):
+        sys.stdout.write(_json_lines(batch))
+        sys.stdout.flush()
+
+
+def _json_lines(batch: list[dict]) -> str:
+    return "".join(
+        json.dumps({**entry, "timestamp": entry["timestamp"].isoformat()},
+                   ensure_ascii=False) + "\n"
+        for entry in batch
+    )
+
+
+def build_log_sink() -> BufferedLogSink | None:
+    args = (LOG_QUEUE_SIZE, LOG_FLUSH_INTERVAL_MS / 1000, LOG_FLUSH_BATCH_SIZE)
+    if LOG_SINK == "db":
+        return DatabaseLogSink(*args)
+    if LOG_SINK == "file":
+        return FileLogSink(LOG_FILE_PATH, *args)
+    if LOG_SINK == "stdout":
+        return StdoutLogSink(*args)
+    if LOG_SINK == "direct":
+        return None
+    raise ValueError(f"Unknown LOG_SINK '{LOG_SINK}'")
+
+
+# Shared sink, started/stopped with the app (None = direct DB writes)
+log_sink = build_log_sink()
+
+
+async def create_log(db: AsyncSession, action: str, message: str, user_id: int | None = None,
+                     commit: bool = True):
     """
     Stores a log entry in the database.
     Can be called from any route (e.g., login, prediction).
+    With commit=False the entry is only added to the session, so it is
+    saved by the caller's own commit (same transaction).
+    Otherwise the entry goes to the buffered log sink when it is running,
+    so the request does not pay for its own INSERT and commit.
     """
+    entry = {
+        "user_id": user_id,
+        "action": action,
+        "message": message,
+        "timestamp": datetime.utcnow(),
+    }
+
+    if log_sink is not None and log_sink.running:
+        if commit or log_sink.name != "db":
+            log_sink.emit(entry)
+            return
+
     try:
-        log_entry = SystemLog(
-            user_id=user_id,
-            action=action,
-            message=message,
-            timestamp=datetime.utcnow()
-        )
+        log_entry = SystemLog(**entry)
         db.add(log_entry)
+        if not commit:
+            return
         await db.commit()
-        await db.refresh(log_entry)
     except Exception as e:
         # Optional: print or log to file if DB logging fails
         print(f"[SystemLog] Failed to save log: {e}")
@@ -0,0 +1,366 @@
+import asyncio
+import bisect
+import re
+import threading
+import time
+from contextlib import nullcontext
+
+from app.config import (
+    METRICS_ENABLED,
+    EVENT_LOOP_LAG_INTERVAL_MS,
+    OTEL_ENABLED,
+    OTEL_SERVICE_NAME,
+)
+
+PREFIX = "currency_"
+# Seconds; covers a cache hit (ms) up to a slow Gemini call with retries
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter; label values are passed positionally."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self):
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram (Prometheus semantics). Observations are
+    counted in their own bucket and summed up when rendered.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket..., +Inf count, sum, count]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        if not METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        for labels, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                label_text = _format_labels(self.labelnames, labels, 'le="%s"' % le)
+                yield f"{self.name}_bucket{label_text} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}"
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _flatten(values: dict, prefix: str = ""):
+    """{"primary": {"checked_out": 2}} -> ("primary_checked_out", 2)."""
+    for key, value in values.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{name}_")
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+        elif isinstance(value, str):
+            # States ("closed", "open") as an info-style gauge
+            yield name, value
+
+
+class MetricsRegistry:
+    """
+    Histograms and counters recorded by the app, plus the stats() dicts
+    the components already keep (caches, pools, executors...), exported as
+    gauges when scraped.
+    """
+
+    def __init__(self):
+        self._metrics: list[Counter | Histogram] = []
+        self._stats: dict[str, callable] = {}
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(PREFIX + name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(PREFIX + name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, component: str, stats):
+        """`stats()` is called on every scrape, its numbers become gauges."""
+        self._stats[component] = stats
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for component, stats in self._stats.items():
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"[Metrics] Stats of {component} failed: {e}")
+                continue
+            for key, value in _flatten(values):
+                name = _metric_name(f"{PREFIX}{component}_{key}")
+                lines.append(f"# TYPE {name} gauge")
+                if isinstance(value, str):
+                    lines.append(f'{name}{{state="{_escape(value)}"}} 1')
+                else:
+                    lines.append(f"{name} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared registry for the whole app
+registry = MetricsRegistry()
+
+http_request_seconds = registry.histogram(
+    "http_request_seconds", "HTTP request latency (until the last body byte)",
+    ("method", "route", "status"))
+span_seconds = registry.histogram(
+    "span_seconds", "Time spent in an instrumented step", ("span",))
+span_errors = registry.counter(
+    "span_errors_total", "Instrumented steps that raised, by exception class", ("span", "error"))
+db_query_seconds = registry.histogram(
+    "db_query_seconds", "Database statement latency", ("engine", "statement"))
+inference_queue_seconds = registry.histogram(
+    "inference_queue_seconds", "Wait for a free inference slot")
+inference_model_seconds = registry.histogram(
+    "inference_model_seconds", "Model call time in the inference threads")
+gemini_seconds = registry.histogram(
+    "gemini_seconds", "Gemini call attempts and response parsing", ("phase", "outcome"))
+gemini_errors = registry.counter(
+    "gemini_errors_total", "Gemini errors by exception class", ("phase", "error"))
+gemini_tokens = registry.histogram(
+    "gemini_tokens", "Tokens per Gemini call", ("kind",),
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384))
+event_loop_lag_seconds = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+
+http_requests_in_flight = 0
+registry.register_stats("http", lambda: {"requests_in_flight": http_requests_in_flight})
+
+
+def observe_gemini(phase: str, seconds: float, error: str | None):
+    """GeminiClient.observer: runs in the inference threads."""
+    gemini_seconds.observe(seconds, phase, error or "ok")
+    if error is not None:
+        gemini_errors.inc(phase, error)
+
+
+def observe_gemini_usage(prompt: int, output: int, thoughts: int):
+    """GeminiClient.usage_observer."""
+    gemini_tokens.observe(prompt, "prompt")
+    gemini_tokens.observe(output, "output")
+    if thoughts:
+        gemini_tokens.observe(thoughts, "thoughts")
+
+
+# ------------------------------------
+# Tracing
+# ------------------------------------
+def _build_tracer():
+    if not OTEL_ENABLED:
+        return None
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        raise RuntimeError(
+            "OTEL_ENABLED needs opentelemetry-sdk and "
+            "opentelemetry-exporter-otlp-proto-http installed") from e
+    # FastAPI makes the request spans itself once a provider is set, the
+    # span() steps below nest under them
+    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    # Spans are exported from a background thread, in batches
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    return trace.get_tracer("app")
+
+
+tracer = _build_tracer()
+INSTRUMENTED = METRICS_ENABLED or tracer is not None
+_NOOP = nullcontext()
+
+
+def span(name: str, **attributes):
+    """
+    Times a step: span_seconds{span=name} and, with tracing on, an
+    OpenTelemetry span (child of FastAPI's request span). Works across awaits.
+
+        with span("image.decode"):
+            ...
+
+    With metrics and tracing off it returns a shared no-op context manager.
+    """
+    if not INSTRUMENTED:
+        return _NOOP
+    return _Span(name, attributes)
+
+
+class _Span:
+    __slots__ = ("name", "attributes", "started", "otel_span")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.otel_span = None
+
+    def __enter__(self):
+        if tracer is not None:
+            self.otel_span = tracer.start_as_current_span(self.name, attributes=self.attributes)
+            self.otel_span.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        span_seconds.observe(time.perf_counter() - self.started, self.name)
+        if exc_type is not None:
+            span_errors.inc(self.name, exc_type.__name__)
+        if self.otel_span is not None:
+            return self.otel_span.__exit__(exc_type, exc, tb)
+        return False
+
+
+def shutdown_tracing():
+    """Exports the spans still buffered."""
+    if tracer is not None:
+        from opentelemetry import trace
+        trace.get_tracer_provider().shutdown()
+
+
+# ------------------------------------
+# HTTP middleware
+# ------------------------------------
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (streaming responses pass through untouched):
+    request latency by route template and status.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        global http_requests_in_flight
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight -= 1
+            # Route template ("/predict/{prediction_id}"), set in the scope by the router
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            http_request_seconds.observe(
+                time.perf_counter() - started, scope["method"], route, str(status))
+
+
+# ------------------------------------
+# Event loop lag
+# ------------------------------------
+class EventLoopLagMonitor:
+    """
+    Sleeps `interval` seconds in a loop and records how much later than
+    asked it woke up: the time callbacks waited behind blocking code.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+        # Metrics
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="event-loop-lag")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            event_loop_lag_seconds.observe(lag)
+
+    def stats(self) -> dict:
+        return {"last_seconds": self.last_lag, "max_seconds": self.max_lag}
+
+
+# Shared monitor for the whole app
+event_loop_monitor = EventLoopLagMonitor(EVENT_LOOP_LAG_INTERVAL_MS / 1000)
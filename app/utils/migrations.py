@@ -0,0 +1,43 @@
+"""
+Helpers for the Alembic migrations (alembic/versions).
+
+Before migrations existed the app built its schema with create_all, which
+adds missing tables but never columns or indexes, so a deployed database
+can be at any point in between. The migrations only create what is not
+there yet, and `alembic upgrade head` brings any such database to head
+without a manual `alembic stamp`.
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+def _inspector() -> sa.Inspector:
+    return sa.inspect(op.get_bind())
+
+
+def has_table(table: str) -> bool:
+    return _inspector().has_table(table)
+
+
+def has_column(table: str, column: str) -> bool:
+    return any(c["name"] == column for c in _inspector().get_columns(table))
+
+
+def has_index(table: str, index: str) -> bool:
+    return any(i["name"] == index for i in _inspector().get_indexes(table))
+
+
+def create_table(table: str, *columns, **kwargs):
+    if not has_table(table):
+        op.create_table(table, *columns, **kwargs)
+
+
+def add_column(table: str, column: sa.Column):
+    if not has_column(table, column.name):
+        with op.batch_alter_table(table) as batch:
+            batch.add_column(column)
+
+
+def create_index(index: str, table: str, columns: list[str]):
+    if not has_index(table, index):
+        op.create_index(index, table, columns)
@@ -0,0 +1,405 @@
+import asyncio
+import mimetypes
+import os
+import sys
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import AsyncExitStack
+from datetime import datetime, timedelta, timezone
+
+from app.config import (
+    STORAGE_BACKEND,
+    STORAGE_LOCAL_ROOT,
+    STORAGE_PUBLIC_BASE_URL,
+    STORAGE_RETENTION_DAYS,
+    S3_BUCKET,
+    S3_PREFIX,
+    S3_ENDPOINT_URL,
+    S3_REGION,
+    S3_PRESIGN_TTL_SECONDS,
+)
+from app.utils.metrics import span
+
+# Rows written before the storage layer stored this prefix + file name
+LEGACY_PREFIX = "/static/uploads/"
+
+
+class ImageNotFoundError(Exception):
+    """No stored image under this key."""
+
+
+class ImageStorage(ABC):
+    """
+    Where uploaded images live. Keys are relative paths such as
+    "3f/a2/3fa2...c1.jpg" (stored in Prediction.image_path).
+
+    Subclasses implement save / load / delete / url / delete_older_than.
+    save_in_background() and delete_in_background() run as tasks so the
+    caller does not wait for the IO; flush() waits for the pending ones
+    (shutdown).
+    """
+
+    name = "base"
+    # Seconds url() results stay valid (None = for good)
+    url_ttl: int | None = None
+
+    def __init__(self):
+        self._pending: set[asyncio.Task] = set()
+
+        # Metrics
+        self.writes = 0
+        self.write_failures = 0
+        self.bytes_written = 0
+        self.write_time_total = 0.0
+        self.deleted = 0
+        self.bytes_deleted = 0
+        self.purged = 0
+        self.bytes_purged = 0
+
+    @staticmethod
+    def new_key(filename: str | None) -> str:
+        """Random key, sharded on its first 2 + 2 hex chars."""
+        name = uuid.uuid4().hex
+        ext = os.path.splitext(filename or "")[1].lower()[:10]
+        return f"{name[:2]}/{name[2:4]}/{name}{ext}"
+
+    @staticmethod
+    def content_type(key: str) -> str:
+        return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        await self.flush()
+
+    async def save(self, key: str, data: bytes):
+        started_at = time.perf_counter()
+        try:
+            with span("storage.save", backend=self.name):
+                await self._save(key, data)
+        except Exception:
+            self.write_failures += 1
+            raise
+        self.writes += 1
+        self.bytes_written += len(data)
+        self.write_time_total += time.perf_counter() - started_at
+
+    def save_in_background(self, key: str, data: bytes) -> asyncio.Task:
+        """The task's result is whether the write succeeded (it never raises)."""
+        task = asyncio.create_task(self._save_logged(key, data))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+    async def _save_logged(self, key: str, data: bytes) -> bool:
+        try:
+            await self.save(key, data)
+        except Exception as e:
+            print(f"[Storage] Failed to store {key}: {e}")
+            return False
+        return True
+
+    async def delete_many(self, keys: list[str], concurrency: int = 32) -> int:
+        """
+        Deletes the keys (missing ones are ignored) and returns the bytes
+        freed, as far as the backend reports sizes.
+        """
+        freed = 0
+        for start in range(0, len(keys), concurrency):
+            freed += sum(await asyncio.gather(
+                *(self.delete(key) for key in keys[start:start + concurrency])))
+        self.deleted += len(keys)
+        self.bytes_deleted += freed
+        return freed
+
+    def delete_in_background(self, keys: list[str]):
+        task = asyncio.create_task(self._delete_logged(keys))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _delete_logged(self, keys: list[str]):
+        try:
+            await self.delete_many(keys)
+        except Exception as e:
+            print(f"[Storage] Failed to delete {len(keys)} images: {e}")
+
+    async def flush(self):
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    @abstractmethod
+    async def _save(self, key: str, data: bytes):
+        """Stores the bytes under key (save() adds the metrics)."""
+
+    @abstractmethod
+    async def load(self, key: str) -> bytes:
+        """Raises ImageNotFoundError when nothing is stored under key."""
+
+    @abstractmethod
+    async def delete(self, key: str) -> int:
+        """Returns the bytes freed (0 when missing or unknown)."""
+
+    @abstractmethod
+    def url(self, key: str) -> str:
+        """Where a client can fetch the image."""
+
+    @abstractmethod
+    async def delete_older_than(self, cutoff: datetime) -> tuple[int, int]:
+        """Returns (images removed, bytes freed)."""
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "pending_writes": len(self._pending),
+            "writes": self.writes,
+            "write_failures": self.write_failures,
+            "bytes_written": self.bytes_written,
+            "write_time_avg": self.write_time_total / self.writes if self.writes else 0.0,
+            "deleted": self.deleted,
+            "bytes_deleted": self.bytes_deleted,
+            "purged": self.purged,
+            "bytes_purged": self.bytes_purged,
+        }
+
+
+class LocalStorage(ImageStorage):
+    """
+    Files under `root`, two levels of shard directories so no directory
+    grows past a few thousand entries. Blocking file IO runs in threads.
+    Only works for a single instance (or a shared volume).
+    """
+
+    name = "local"
+
+    def __init__(self, root: str, public_base_url: str):
+        super().__init__()
+        self.root = root
+        self.public_base_url = public_base_url.rstrip("/")
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        if key.startswith(LEGACY_PREFIX):
+            key = key[len(LEGACY_PREFIX):]
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ImageNotFoundError(key)
+        return path
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Readers never see a half written file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read(self, path: str) -> bytes:
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ImageNotFoundError(path) from None
+
+    def _remove(self, path: str) -> int:
+        try:
+            size = os.stat(path).st_size
+            os.remove(path)
+        except FileNotFoundError:
+            return 0
+        return size
+
+    def _purge(self, cutoff: float) -> tuple[int, int]:
+        removed = freed = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                        freed += stat.st_size
+                except FileNotFoundError:
+                    pass
+        return removed, freed
+
+    async def _save(self, key: str, data: bytes):
+        await asyncio.to_thread(self._write, self._path(key), data)
+
+    async def load(self, key: str) -> bytes:
+        return await asyncio.to_thread(self._read, self._path(key))
+
+    async def delete(self, key: str) -> int:
+        return await asyncio.to_thread(self._remove, self._path(key))
+
+    def url(self, key: str) -> str:
+        if key.startswith(LEGACY_PREFIX):
+            key = key[len(LEGACY_PREFIX):]
+        return f"{self.public_base_url}/{key}"
+
+    async def delete_older_than(self, cutoff: datetime) -> tuple[int, int]:
+        removed, freed = await asyncio.to_thread(self._purge, cutoff.timestamp())
+        self.purged += removed
+        self.bytes_purged += freed
+        return removed, freed
+
+
+class S3Storage(ImageStorage):
+    """
+    S3-compatible object store (AWS, MinIO, R2...) through aioboto3. Images
+    are never proxied by the app: url() is a presigned GET URL, or a plain
+    URL under `public_base_url` when the bucket is served by a CDN.
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str, endpoint_url: str | None, region: str,
+                 presign_ttl: int, public_base_url: str):
+        super().__init__()
+        try:
+            import aioboto3
+            import botocore.session
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs aioboto3 installed") from e
+        if not bucket:
+            raise ValueError("STORAGE_BACKEND=s3 needs S3_BUCKET")
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.presign_ttl = presign_ttl
+        self.public_base_url = public_base_url.rstrip("/")
+        self.url_ttl = None if self.public_base_url else presign_ttl
+        self._session = aioboto3.Session()
+        self._stack: AsyncExitStack | None = None
+        self._client = None
+        # Presigning is local HMAC work, a sync botocore client does it
+        # without an await (responses can build URLs synchronously)
+        self._signer = botocore.session.get_session().create_client(
+            "s3", endpoint_url=endpoint_url, region_name=region)
+
+    async def start(self):
+        # One client (and connection pool) for the app's lifetime
+        self._stack = AsyncExitStack()
+        self._client = await self._stack.enter_async_context(
+            self._session.client("s3", endpoint_url=self.endpoint_url,
+                                 region_name=self.region))
+
+    async def close(self):
+        await super().close()
+        if self._stack is not None:
+            await self._stack.aclose()
+            self._stack = None
+            self._client = None
+
+    async def _get_client(self):
+        if self._client is None:
+            await self.start()
+        return self._client
+
+    def _object_key(self, key: str) -> str:
+        if key.startswith(LEGACY_PREFIX):
+            key = key[len(LEGACY_PREFIX):]
+        return f"{self.prefix}{key}"
+
+    async def _save(self, key: str, data: bytes):
+        client = await self._get_client()
+        await client.put_object(
+            Bucket=self.bucket, Key=self._object_key(key), Body=data,
+            ContentType=self.content_type(key))
+
+    async def load(self, key: str) -> bytes:
+        client = await self._get_client()
+        try:
+            response = await client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except client.exceptions.NoSuchKey:
+            raise ImageNotFoundError(key) from None
+        async with response["Body"] as body:
+            return await body.read()
+
+    async def delete(self, key: str) -> int:
+        client = await self._get_client()
+        await client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        # S3 does not report the size of what it deleted
+        return 0
+
+    async def delete_many(self, keys: list[str], concurrency: int = 32) -> int:
+        client = await self._get_client()
+        # delete_objects takes at most 1000 keys
+        for start in range(0, len(keys), 1000):
+            await client.delete_objects(Bucket=self.bucket, Delete={
+                "Objects": [{"Key": self._object_key(key)} for key in keys[start:start + 1000]],
+                "Quiet": True,
+            })
+        self.deleted += len(keys)
+        return 0
+
+    def url(self, key: str) -> str:
+        if self.public_base_url:
+            return f"{self.public_base_url}/{self._object_key(key)}"
+        return self._signer.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._object_key(key)},
+            ExpiresIn=self.presign_ttl,
+        )
+
+    async def delete_older_than(self, cutoff: datetime) -> tuple[int, int]:
+        """Prefer a bucket lifecycle rule; this is for stores without one."""
+        client = await self._get_client()
+        cutoff = cutoff.replace(tzinfo=timezone.utc)
+        removed = freed = 0
+        paginator = client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            old = [o for o in page.get("Contents", []) if o["LastModified"] < cutoff]
+            # delete_objects takes at most 1000 keys, a page has at most 1000
+            if old:
+                await client.delete_objects(Bucket=self.bucket, Delete={
+                    "Objects": [{"Key": o["Key"]} for o in old], "Quiet": True})
+                removed += len(old)
+                freed += sum(o["Size"] for o in old)
+        self.purged += removed
+        self.bytes_purged += freed
+        return removed, freed
+
+
+def build_storage() -> ImageStorage:
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(STORAGE_LOCAL_ROOT, STORAGE_PUBLIC_BASE_URL or "/static/uploads")
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION,
+                         S3_PRESIGN_TTL_SECONDS, STORAGE_PUBLIC_BASE_URL)
+    raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}'")
+
+
+# Shared storage for the whole app
+storage = build_storage()
+
+
+async def purge_expired_images(retention_days: int = STORAGE_RETENTION_DAYS) -> tuple[int, int]:
+    """Deletes every stored image older than `retention_days`, linked to a prediction or not."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    removed, freed = await storage.delete_older_than(cutoff)
+    print(f"[Storage] Removed {removed} images ({freed / 1e6:.1f} MB) older than {retention_days} days")
+    return removed, freed
+
+
+async def _purge_cli(days: int):
+    try:
+        await purge_expired_images(days)
+    finally:
+        await storage.close()
+
+
+if __name__ == "__main__":
+    # python -m app.utils.storage purge [days]
+    if not sys.argv[1:] or sys.argv[1] != "purge":
+        print("usage: python -m app.utils.storage purge [days]")
+        sys.exit(1)
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else STORAGE_RETENTION_DAYS
+    if days <= 0:
+        print("Retention is disabled (STORAGE_RETENTION_DAYS=0), pass the days explicitly")
+        sys.exit(1)
+    asyncio.run(_purge_cli(days))
@@ -0,0 +1,155 @@
+"""
+Peak memory of GET /predict/export over a large history.
+
+    python benchmarks/bench_export.py [--rows 1000000 --formats csv,ndjson,parquet]
+
+Fills a temporary SQLite database with `--rows` predictions for one user,
+then exports them in each format through the ASGI app, each in a fresh
+process so its peak RSS is its own. Reported next to the peak RSS of the
+same process before the export (app imported, database seeded), so the
+difference is what the export itself costs.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CREDENTIALS = {"email": "bench@example.com", "password": "benchmark"}
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seed(db_path: str, rows: int):
+    """Bulk inserts straight through sqlite3, the ORM would take minutes."""
+    conn = sqlite3.connect(db_path)
+    user_id = conn.execute("SELECT id FROM users WHERE email = ?",
+                           (CREDENTIALS["email"],)).fetchone()[0]
+    start = datetime(2024, 1, 1)
+
+    def generate():
+        for i in range(rows):
+            yield (user_id, "SDG", 0.5 + (i % 50) / 100, "100 Pounds", "100 جنيه", 100,
+                   i % 7 == 0, f"{i % 256:02x}/{i % 199:02x}/{i:032x}.jpg",
+                   (start + timedelta(seconds=i * 30)).isoformat(" "), False)
+
+    conn.executemany(
+        "INSERT INTO predictions (user_id, currency_code, confidence, name_en, name_ar, "
+        "denomination_value, is_counterfeit, image_path, timestamp, has_derivatives) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", generate())
+    conn.commit()
+    conn.close()
+
+
+async def prepare(rows: int):
+    import httpx
+    from app.main import app, startup_event
+
+    await startup_event()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/auth/register", json={"full_name": "bench", **CREDENTIALS})
+    seed(os.environ["BENCH_DB_PATH"], rows)
+
+
+async def export(fmt: str):
+    import httpx
+    from app.main import app, startup_event
+
+    await startup_event()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        token = (await client.post("/auth/login", json=CREDENTIALS)).json()["access_token"]
+    baseline = peak_rss_mb()
+
+    # httpx's ASGITransport buffers whole bodies, so the app is called
+    # directly and the chunks are counted and dropped as they arrive
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "server": ("bench", 80), "client": ("127.0.0.1", 1),
+        "path": "/predict/export", "raw_path": b"/predict/export", "root_path": "",
+        "query_string": f"format={fmt}".encode(),
+        "headers": [(b"host", b"bench"), (b"authorization", f"Bearer {token}".encode())],
+    }
+    received = 0
+    status = None
+    requested = False
+    done = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Starlette listens for a disconnect while streaming
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal received, status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            received += len(message.get("body", b""))
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    done.set()
+    elapsed = time.perf_counter() - started
+    if status != 200:
+        raise SystemExit(f"export returned {status}")
+
+    print(f"{fmt} {received} {elapsed:.3f} {baseline:.1f} {peak_rss_mb():.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--formats", default="csv,ndjson,parquet")
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench_export.db")
+    env = {
+        **os.environ,
+        "BENCH_DB_PATH": db_path,
+        "DATABASE_URL": f"sqlite+aiosqlite:///{db_path}",
+        "DB_CREATE_ALL": "true",
+        "LOG_SINK": "direct",
+        "PREDICTION_CACHE_PERSISTENT": "false",
+    }
+
+    started = time.perf_counter()
+    subprocess.run([sys.executable, __file__, "--child", "prepare", str(args.rows)],
+                   env=env, check=True)
+    print(f"seeded {args.rows} rows in {time.perf_counter() - started:.1f} s\n")
+
+    print(f"{'format':<8} {'MB':>9} {'seconds':>8} {'rows/s':>10} "
+          f"{'baseline MB':>12} {'peak MB':>8} {'export MB':>10}")
+    for fmt in args.formats.split(","):
+        output = subprocess.run([sys.executable, __file__, "--child", "export", fmt],
+                                env=env, check=True, capture_output=True, text=True).stdout
+        _, received, elapsed, baseline, peak = output.strip().splitlines()[-1].split()
+        received, elapsed = int(received), float(elapsed)
+        baseline, peak = float(baseline), float(peak)
+        print(f"{fmt:<8} {received / 1e6:>9.1f} {elapsed:>8.1f} {args.rows / elapsed:>10.0f} "
+              f"{baseline:>12.0f} {peak:>8.0f} {peak - baseline:>10.0f}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        if sys.argv[2] == "prepare":
+            asyncio.run(prepare(int(sys.argv[3])))
+        else:
+            asyncio.run(export(sys.argv[3]))
+    else:
+        main()
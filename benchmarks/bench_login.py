@@ -0,0 +1,123 @@
+"""
+Login throughput next to prediction traffic, bcrypt inline vs. in a pool.
+
+    python benchmarks/bench_login.py [--seconds 10 --logins 8 --predictors 8]
+
+`--logins` clients log in back to back while `--predictors` clients post
+images to /predict/ (model replaced by a 50 ms fake, every image unique
+so nothing is cached). Everything runs in one event loop through the ASGI
+app, the same way one uvicorn worker would. Rate limits are disabled so
+the raw hashing cost is measured.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_login.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{DB_PATH}")
+os.environ.setdefault("DB_CREATE_ALL", "true")
+os.environ.setdefault("LOGIN_RATE_LIMIT_PER_IP", "0")
+os.environ.setdefault("LOGIN_RATE_LIMIT_PER_EMAIL", "0")
+os.environ.setdefault("PREDICTION_CACHE_PERSISTENT", "false")
+
+import httpx  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import ai.backends  # noqa: E402
+import app.auth.routes as auth_routes  # noqa: E402
+from app.auth.hashing import PasswordHasher  # noqa: E402
+from app.config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE  # noqa: E402
+from app.main import app, startup_event  # noqa: E402
+
+CREDENTIALS = {"email": "bench@example.com", "password": "benchmark"}
+
+
+class FakeBackend(ai.backends.InferenceBackend):
+    name = "bench"
+
+    def analyze(self, image_bytes: bytes) -> dict:
+        time.sleep(0.05)
+        return {"currency_code": "SDG", "confidence": 0.9, "name_en": "100 Pounds",
+                "name_ar": "100 جنيه", "denomination_value": 100, "is_counterfeit": False}
+
+
+def make_image(seed: int) -> bytes:
+    img = Image.effect_noise((320, 160), 60 + seed % 50).convert("RGB")
+    img.putpixel((seed % 320, (seed // 320) % 160), (seed % 256, 0, 0))
+    out = BytesIO()
+    img.save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+async def login_loop(client, stop_at, counts):
+    while time.perf_counter() < stop_at:
+        response = await client.post("/auth/login", json=CREDENTIALS)
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+
+async def predict_loop(client, headers, stop_at, latencies, seed):
+    n = 0
+    while time.perf_counter() < stop_at:
+        image = make_image(seed * 100_000 + n)
+        n += 1
+        started = time.perf_counter()
+        response = await client.post(
+            "/predict/", files={"file": ("note.jpg", image, "image/jpeg")}, headers=headers)
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - started)
+
+
+async def run_mode(client, headers, args, hasher) -> dict:
+    auth_routes.password_hasher = hasher
+    stop_at = time.perf_counter() + args.seconds
+    login_counts, latencies = {}, []
+    await asyncio.gather(
+        *(login_loop(client, stop_at, login_counts) for _ in range(args.logins)),
+        *(predict_loop(client, headers, stop_at, latencies, i) for i in range(args.predictors)),
+    )
+    hasher.shutdown()
+    latencies.sort()
+    return {
+        "logins/s": login_counts.get(200, 0) / args.seconds,
+        "predictions/s": len(latencies) / args.seconds,
+        "predict p50 ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "predict p95 ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--logins", type=int, default=8)
+    parser.add_argument("--predictors", type=int, default=8)
+    args = parser.parse_args()
+
+    ai.backends._backend = FakeBackend()
+    await startup_event()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/auth/register", json={"full_name": "bench", **CREDENTIALS})
+        token = (await client.post("/auth/login", json=CREDENTIALS)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        modes = (
+            ("inline", PasswordHasher("thread", 0, PASSWORD_HASH_MAX_QUEUE)),
+            ("pool", PasswordHasher("thread", PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)),
+        )
+        print(f"{'mode':<8} {'logins/s':>9} {'predictions/s':>14} {'p50 ms':>8} {'p95 ms':>8}")
+        for name, hasher in modes:
+            r = await run_mode(client, headers, args, hasher)
+            print(f"{name:<8} {r['logins/s']:>9.1f} {r['predictions/s']:>14.1f} "
+                  f"{r['predict p50 ms']:>8.0f} {r['predict p95 ms']:>8.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
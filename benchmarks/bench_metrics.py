@@ -0,0 +1,71 @@
+"""
+Cost of the instrumentation, metrics off vs. on.
+
+    python benchmarks/bench_metrics.py [--requests 5000 --spans 200000]
+
+Each mode runs in a fresh process (METRICS_ENABLED is read at import):
+a loop of span() enter/exit, then `--requests` GET / through the ASGI
+app, the cheapest route there is, so the middleware cost is at its most
+visible. The Prometheus render time with everything recorded is shown too.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def child(requests: int, spans: int):
+    import httpx
+    from app.main import app
+    from app.utils.metrics import registry, span
+
+    started = time.perf_counter()
+    for _ in range(spans):
+        with span("bench"):
+            pass
+    span_ns = (time.perf_counter() - started) / spans * 1e9
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(100):
+            await client.get("/")
+        started = time.perf_counter()
+        for _ in range(requests):
+            await client.get("/")
+        request_us = (time.perf_counter() - started) / requests * 1e6
+
+    started = time.perf_counter()
+    registry.render()
+    render_ms = (time.perf_counter() - started) * 1000
+    print(f"{span_ns} {request_us} {render_ms}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--spans", type=int, default=200_000)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench_metrics.db")
+    print(f"{'metrics':<8} {'span() ns':>10} {'GET / us':>9} {'render ms':>10}")
+    for enabled in ("false", "true"):
+        env = {**os.environ, "METRICS_ENABLED": enabled, "OTEL_ENABLED": "false",
+               "DATABASE_URL": f"sqlite+aiosqlite:///{db_path}"}
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", str(args.requests), str(args.spans)],
+            env=env, check=True, capture_output=True, text=True).stdout
+        span_ns, request_us, render_ms = map(float, output.strip().splitlines()[-1].split())
+        print(f"{'on' if enabled == 'true' else 'off':<8} {span_ns:>10.0f} {request_us:>9.0f} "
+              f"{render_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        asyncio.run(child(int(sys.argv[2]), int(sys.argv[3])))
+    else:
+        main()
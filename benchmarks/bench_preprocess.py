@@ -0,0 +1,106 @@
+"""
+Per-request memory and CPU of the upload -> model bytes path.
+
+    python benchmarks/bench_preprocess.py [--width 4032 --height 3024 --runs 10]
+
+"before" replays the old predict_currency flow (read whole upload, write
+file, read it back, decode, re-encode at full size, base64).
+"after" is ingest_upload + storage write + decode_image + to_jpeg as used
+by the route.
+Peak memory is the tracemalloc peak of Python allocations, CPU is
+process time per request.
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+from starlette.datastructures import UploadFile  # noqa: E402
+
+from app.utils.image_utils import ingest_upload, decode_image  # noqa: E402
+
+
+def make_photo(width: int, height: int) -> bytes:
+    # Gradient + noise compresses like a real camera photo, a flat image would not
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 12)
+    img = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    out = BytesIO()
+    img.save(out, format="JPEG", quality=92)
+    return out.getvalue()
+
+
+def make_upload(data: bytes) -> UploadFile:
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spool.write(data)
+    spool.seek(0)
+    return UploadFile(file=spool, filename="note.jpg")
+
+
+async def before(data: bytes, path: str) -> int:
+    upload = make_upload(data)
+    with open(path, "wb") as buffer:
+        buffer.write(await upload.read())
+    with open(path, "rb") as img_file:
+        image_bytes = img_file.read()
+    img = Image.open(BytesIO(image_bytes)).convert("RGB")
+    buffered = BytesIO()
+    img.save(buffered, format="JPEG")
+    encoded = base64.b64encode(buffered.getvalue()).decode("utf-8")
+    return len(encoded)
+
+
+async def after(data: bytes, path: str, max_side: int) -> int:
+    upload = make_upload(data)
+    ingested = await ingest_upload(upload, len(data) + 1)
+    # Same disk write as the local image storage does
+    with open(path, "wb") as out:
+        out.write(ingested.buffer.getbuffer())
+    image = decode_image(ingested.buffer, max_side)
+    _ = image.phash
+    return len(image.to_jpeg(90))
+
+
+def measure(name, coro_factory, runs):
+    cpu = []
+    peaks = []
+    for _ in range(runs):
+        tracemalloc.start()
+        start = time.process_time()
+        payload = asyncio.run(coro_factory())
+        cpu.append(time.process_time() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    cpu.sort()
+    print(f"{name:>7}: cpu median {cpu[len(cpu) // 2] * 1000:7.1f} ms | "
+          f"peak python memory {max(peaks) / 1024 / 1024:6.1f} MB | "
+          f"model payload {payload / 1024:7.1f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--max-side", type=int, default=1600)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    data = make_photo(args.width, args.height)
+    print(f"input: {args.width}x{args.height} JPEG, {len(data) / 1024 / 1024:.1f} MB")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "upload.jpg")
+        measure("before", lambda: before(data, path), args.runs)
+        measure("after", lambda: after(data, path, args.max_side), args.runs)
+
+
+if __name__ == "__main__":
+    main()
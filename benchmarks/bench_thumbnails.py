@@ -0,0 +1,48 @@
+"""
+History page bandwidth with full size uploads vs. derivatives.
+
+    python benchmarks/bench_thumbnails.py [--width 4032 --height 3024 --page 50]
+
+Renders the configured derivatives (THUMBNAIL_SIZES x THUMBNAIL_FORMATS)
+of one camera-like photo and reports the bytes a history page of `--page`
+rows downloads with image_url vs. each derivative, plus render time.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_preprocess import make_photo  # noqa: E402
+from app.prediction.thumbnails import render_derivatives  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--page", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    photo = make_photo(args.width, args.height)
+    timings = []
+    for _ in range(args.runs):
+        start = time.process_time()
+        rendered = render_derivatives(photo)
+        timings.append(time.process_time() - start)
+
+    original_page = len(photo) * args.page
+    print(f"input: {args.width}x{args.height} JPEG, {len(photo) / 1e6:.1f} MB, "
+          f"all derivatives rendered in {min(timings) * 1000:.0f} ms cpu")
+    print(f"{'image':<16} {'bytes':>10} {'page of ' + str(args.page):>14} {'vs original':>12}")
+    print(f"{'original':<16} {len(photo):>10} {original_page / 1e6:>11.1f} MB {1:>11.0f}x")
+    for (variant, fmt), content in rendered.items():
+        page = len(content) * args.page
+        print(f"{variant + ' ' + fmt:<16} {len(content):>10} {page / 1e6:>11.2f} MB "
+              f"{original_page / page:>11.0f}x")
+
+
+if __name__ == "__main__":
+    main()
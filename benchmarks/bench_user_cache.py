@@ -0,0 +1,85 @@
+"""
+Database queries per authenticated request, with and without the user cache.
+
+    python benchmarks/bench_user_cache.py [--requests 200]
+
+Runs GET /predict/history and GET /predict/stats against a throwaway
+SQLite database in three modes:
+"no cache" (USER_CACHE_TTL_SECONDS=0, the old behaviour), "cache" (user
+cache on) and "claims" (cache on + AUTH_TRUST_CLAIMS for read-only routes).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_user_cache.db")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{DB_PATH}")
+os.environ.setdefault("DB_CREATE_ALL", "true")
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+import app.auth.utils as auth_utils  # noqa: E402
+from app.auth.cache import user_cache  # noqa: E402
+from app.database import engine  # noqa: E402
+from app.main import app  # noqa: E402
+
+PATHS = ("/predict/history", "/predict/stats")
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def run(client: TestClient, headers: dict, requests: int, counter: QueryCounter) -> dict:
+    results = {}
+    for path in PATHS:
+        counter.count = 0
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = client.get(path, headers=headers)
+            response.raise_for_status()
+        elapsed = time.perf_counter() - start
+        results[path] = (counter.count / requests, elapsed / requests * 1000)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    counter = QueryCounter()
+    event.listen(engine.sync_engine, "before_cursor_execute", counter)
+
+    with TestClient(app) as client:
+        credentials = {"email": "bench@example.com", "password": "benchmark"}
+        client.post("/auth/register", json={"full_name": "bench", **credentials})
+        token = client.post("/auth/login", json=credentials).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        modes = (
+            ("no cache", 0, False),
+            ("cache", 60, False),
+            ("claims", 60, True),
+        )
+        print(f"{'mode':<10} {'path':<18} {'queries/req':>12} {'ms/req':>8}")
+        for name, ttl, trust_claims in modes:
+            user_cache.ttl = ttl
+            auth_utils.AUTH_TRUST_CLAIMS = trust_claims
+            # Warm-up request fills the cache
+            client.get(PATHS[0], headers=headers)
+            for path, (queries, ms) in run(client, headers, args.requests, counter).items():
+                print(f"{name:<10} {path:<18} {queries:>12.2f} {ms:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Local stand-in for the Gemini REST API, with configurable latency and errors.
+
+    python benchmarks/fake_gemini.py [--port 8089 --profile typical --set error_503=0.1]
+
+Point the app at it with GEMINI_API_ENDPOINT=http://127.0.0.1:8089 (the
+SDK then talks REST to this host). generateContent answers with a banknote
+result as JSON text, like the real model does for our prompt.
+
+Latency is log-normal, given by its median and p99. Each request may
+instead fail with a 429 / 500 / 503, hang past any client timeout
+("timeout") or return text that is not JSON ("bad_json"), with the
+configured probabilities. Random draws come from `--seed`, so a run is
+reproducible for the same sequence of requests. GET /stats returns the
+outcome counts.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+PROFILES = {
+    # Upper bound of the app: the model costs almost nothing
+    "fast": {"median_ms": 50, "p99_ms": 150},
+    # Roughly what gemini-2.5-flash does for one banknote photo
+    "typical": {"median_ms": 1200, "p99_ms": 4000, "error_429": 0.005, "error_503": 0.005},
+    "degraded": {"median_ms": 3000, "p99_ms": 12000, "error_429": 0.05, "error_500": 0.03,
+                 "error_503": 0.05, "timeout": 0.01},
+    "flaky": {"median_ms": 800, "p99_ms": 3000, "error_503": 0.2, "bad_json": 0.02},
+}
+OUTCOMES = ("error_429", "error_500", "error_503", "timeout", "bad_json")
+ERRORS = {
+    "error_429": (429, "RESOURCE_EXHAUSTED", "Quota exceeded"),
+    "error_500": (500, "INTERNAL", "Internal error"),
+    "error_503": (503, "UNAVAILABLE", "The model is overloaded"),
+}
+NOTES = (
+    ("SDG", 100, "100 Sudanese Pounds", "مئة جنيه سوداني"),
+    ("SDG", 200, "200 Sudanese Pounds", "مئتا جنيه سوداني"),
+    ("SDG", 500, "500 Sudanese Pounds", "خمسمائة جنيه سوداني"),
+    ("SDG", 1000, "1000 Sudanese Pounds", "ألف جنيه سوداني"),
+    ("USD", 100, "100 US Dollars", "مئة دولار أمريكي"),
+)
+
+
+def build_profile(name: str, overrides: dict | None = None) -> dict:
+    profile = {"median_ms": 1000, "p99_ms": 3000, **{outcome: 0.0 for outcome in OUTCOMES}}
+    profile.update(PROFILES[name])
+    profile.update(overrides or {})
+    return profile
+
+
+def parse_overrides(text: str) -> dict:
+    """"error_503=0.1,median_ms=200" -> {"error_503": 0.1, "median_ms": 200.0}"""
+    overrides = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        key, value = item.split("=", 1)
+        if key not in ("median_ms", "p99_ms") + OUTCOMES:
+            raise ValueError(f"Unknown fake Gemini setting '{key}'")
+        overrides[key] = float(value)
+    return overrides
+
+
+class FakeGemini:
+    def __init__(self, profile: dict, seed: int):
+        self.profile = profile
+        self.random = random.Random(seed)
+        # log-normal: p99 = median * exp(2.326 sigma)
+        self.mu = math.log(profile["median_ms"] / 1000)
+        self.sigma = max(0.0, math.log(profile["p99_ms"] / profile["median_ms"]) / 2.326)
+        self.counts = {"ok": 0, **{outcome: 0 for outcome in OUTCOMES}}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def draw(self) -> tuple[str, float]:
+        roll = self.random.random()
+        outcome = "ok"
+        for name in OUTCOMES:
+            roll -= self.profile[name]
+            if roll < 0:
+                outcome = name
+                break
+        return outcome, self.random.lognormvariate(self.mu, self.sigma)
+
+    def result_text(self) -> str:
+        currency_code, value, name_en, name_ar = self.random.choice(NOTES)
+        return json.dumps({
+            "currency_code": currency_code,
+            "confidence": round(self.random.uniform(0.7, 0.99), 2),
+            "name_en": name_en,
+            "name_ar": name_ar,
+            "denomination_value": value,
+            "is_counterfeit": self.random.random() < 0.05,
+        }, ensure_ascii=False)
+
+    async def generate_content(self, request: Request):
+        await request.body()
+        outcome, latency = self.draw()
+        self.counts[outcome] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if outcome == "timeout":
+                # Longer than any sane client timeout
+                await asyncio.sleep(300)
+            await asyncio.sleep(latency)
+        finally:
+            self.in_flight -= 1
+
+        if outcome in ERRORS:
+            code, status, message = ERRORS[outcome]
+            return JSONResponse(
+                {"error": {"code": code, "message": message, "status": status}}, status_code=code)
+        text = "Sorry, I cannot help with that." if outcome == "bad_json" else self.result_text()
+        return JSONResponse({
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            "usageMetadata": {
+                "promptTokenCount": 1290,
+                "candidatesTokenCount": len(text) // 4,
+                "totalTokenCount": 1290 + len(text) // 4,
+            },
+        })
+
+    async def stats(self, request: Request):
+        return JSONResponse({
+            "profile": self.profile,
+            "counts": self.counts,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+        })
+
+
+def build_app(profile: dict, seed: int) -> Starlette:
+    fake = FakeGemini(profile, seed)
+    return Starlette(routes=[
+        # /v1beta/models/gemini-2.5-flash:generateContent
+        Route("/{version}/models/{model}:generateContent", fake.generate_content, methods=["POST"]),
+        Route("/stats", fake.stats),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="typical")
+    parser.add_argument("--set", default="", help="overrides, e.g. error_503=0.1,median_ms=200")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    profile = build_profile(args.profile, parse_overrides(args.set))
+    print(f"Fake Gemini on http://{args.host}:{args.port} profile={args.profile} {profile}")
+    uvicorn.run(build_app(profile, args.seed), host=args.host, port=args.port,
+                log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+"""
+End-to-end load test: the real app (uvicorn) against a fake Gemini.
+
+    python benchmarks/loadtest.py run [--profile typical --concurrency 16 --duration 60]
+    python benchmarks/loadtest.py compare BASELINE.json CURRENT.json [--threshold 10]
+
+`run` migrates a fresh database (SQLite in a temp dir, or --database
+postgresql+asyncpg://... for a local Postgres), starts
+benchmarks/fake_gemini.py with the chosen latency/error profile and
+`uvicorn app.main:app` pointed at it, then `--concurrency` virtual users
+each register, log in and loop over a weighted mix of operations
+(--mix predict=60,history=25,login=10,clear=5) for `--duration` seconds.
+
+Reported per operation: count, errors by status, throughput and
+p50/p95/p99 latency; for the server process its RSS (start, peak, end);
+plus the fake Gemini's outcome counts and the app's /health/details. Everything
+is written as JSON (default benchmarks/results/, tagged with the git
+commit) so two runs can be compared with `compare`, which exits 1 when
+a p95 or throughput regressed by more than --threshold percent.
+
+Images are generated up front from --seed (all distinct, so the cache
+does not answer them); --duplicate-ratio of the
+predictions resend an image already sent, to exercise the cache. Login
+rate limits are off and the Gemini client-side quota is raised unless
+overridden with --app-env KEY=VALUE.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx  # noqa: E402
+from PIL import Image, ImageDraw  # noqa: E402
+
+from fake_gemini import PROFILES, build_profile, parse_overrides  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+OPERATIONS = ("predict", "history", "login", "clear", "stats", "register")
+DEFAULT_APP_ENV = {
+    "LOGIN_RATE_LIMIT_PER_IP": "0",
+    "LOGIN_RATE_LIMIT_PER_EMAIL": "0",
+    "GEMINI_RATE_PER_SECOND": "1000",
+    "GEMINI_RATE_BURST": "1000",
+    "INFERENCE_MODE": "gemini",
+    "USER_QUOTA_PER_MINUTE": "0",
+    "USER_QUOTA_PER_DAY": "0",
+    # Reads the component stats of /health/details at the end of the run
+    "ADMIN_EMAILS": "load-admin@example.com",
+}
+
+
+# ------------------------------------
+# Processes
+# ------------------------------------
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up in {timeout:.0f}s")
+
+
+def stop(process: subprocess.Popen):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def rss_mb(pid: int, field: str = "VmRSS") -> float | None:
+    """VmRSS (current) or VmHWM (peak) from /proc, None off Linux."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def git_commit() -> dict:
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return {"commit": git("rev-parse", "HEAD") or None,
+            "subject": git("log", "-1", "--format=%s") or None,
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+# ------------------------------------
+# Workload
+# ------------------------------------
+def make_images(count: int, seed: int, width: int, height: int) -> list[bytes]:
+    """Distinct photos: random blocks of colour (different perceptual hashes) plus grain."""
+    rng = random.Random(seed)
+    grain = Image.effect_noise((width, height), 24).convert("RGB")
+    images = []
+    for _ in range(count):
+        img = Image.new("RGB", (width, height), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            x0, y0 = rng.randrange(width), rng.randrange(height)
+            x1, y1 = x0 + rng.randrange(width // 8, width // 2), y0 + rng.randrange(height // 8, height // 2)
+            draw.rectangle((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)))
+        img = Image.blend(img, grain, 0.15)
+        out = BytesIO()
+        img.save(out, format="JPEG", quality=88)
+        images.append(out.getvalue())
+    return images
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, weight = item.split("=", 1)
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}', one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight)
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.statuses: dict[str, dict[str, int]] = {}
+
+    def record(self, operation: str, seconds: float, status: str):
+        self.latencies.setdefault(operation, []).append(seconds)
+        counts = self.statuses.setdefault(operation, {})
+        counts[status] = counts.get(status, 0) + 1
+
+
+class VirtualUser:
+    def __init__(self, index: int, run_id: str, client: httpx.AsyncClient, recorder: Recorder,
+                 images: list[bytes], args):
+        self.client = client
+        self.recorder = recorder
+        self.images = images
+        self.args = args
+        self.random = random.Random(args.seed * 1000 + index)
+        self.email = f"load-{run_id}-{index}@example.com"
+        self.password = "loadtest-password"
+        self.full_name = f"load-{run_id}-{index}"
+        self.headers = {}
+        self.sent: list[int] = []
+        self.next_image = index
+
+    async def call(self, operation: str, method: str, url: str, **kwargs) -> httpx.Response | None:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        self.recorder.record(operation, time.perf_counter() - started, status)
+        return response
+
+    async def register(self):
+        await self.call("register", "POST", "/auth/register", json={
+            "full_name": self.full_name, "email": self.email, "password": self.password})
+        await self.login()
+
+    async def login(self):
+        response = await self.call("login", "POST", "/auth/login", json={
+            "email": self.email, "password": self.password})
+        if response is not None and response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def predict(self):
+        if self.sent and self.random.random() < self.args.duplicate_ratio:
+            index = self.random.choice(self.sent)
+        else:
+            # Virtual users walk the pool in disjoint strides
+            index = self.next_image % len(self.images)
+            self.next_image += self.args.concurrency
+            self.sent.append(index)
+        await self.call("predict", "POST", "/predict/", headers=self.headers,
+                        files={"file": ("note.jpg", self.images[index], "image/jpeg")})
+
+    async def history(self):
+        await self.call("history", "GET", "/predict/history", headers=self.headers,
+                        params={"limit": 20})
+
+    async def stats(self):
+        await self.call("stats", "GET", "/predict/stats", headers=self.headers)
+
+    async def clear(self):
+        await self.call("clear", "DELETE", "/predict/clear", headers=self.headers)
+
+    async def register_new(self):
+        # A brand new account each time (the user keeps its own for the rest)
+        suffix = uuid.uuid4().hex[:8]
+        await self.call("register", "POST", "/auth/register", json={
+            "full_name": f"{self.full_name}-{suffix}",
+            "email": f"{suffix}-{self.email}", "password": self.password})
+
+    async def run(self, mix: dict[str, float], stop_at: float):
+        actions = {"predict": self.predict, "history": self.history, "login": self.login,
+                   "clear": self.clear, "stats": self.stats, "register": self.register_new}
+        names, weights = list(mix), list(mix.values())
+        while time.perf_counter() < stop_at:
+            await actions[self.random.choices(names, weights)[0]]()
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(q * len(sorted_values) + 0.5 - 1e-9))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(recorder: Recorder, duration: float) -> dict:
+    operations = {}
+    for operation, latencies in sorted(recorder.latencies.items()):
+        latencies = sorted(latencies)
+        statuses = recorder.statuses[operation]
+        errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+        operations[operation] = {
+            "count": len(latencies),
+            "errors": errors,
+            "statuses": dict(sorted(statuses.items())),
+            "throughput_rps": len(latencies) / duration,
+            "mean_ms": sum(latencies) / len(latencies) * 1000,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "max_ms": latencies[-1] * 1000,
+        }
+    return operations
+
+
+async def drive(base_url: str, server_pid: int, images: list[bytes], args) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    setup, recorder = Recorder(), Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        users = [VirtualUser(i, run_id, client, setup, images, args) for i in range(args.concurrency)]
+        started = time.perf_counter()
+        await asyncio.gather(*(user.register() for user in users))
+        setup_seconds = time.perf_counter() - started
+        for user in users:
+            user.recorder = recorder
+
+        rss = {"start_mb": rss_mb(server_pid), "samples_mb": []}
+
+        async def sample_rss():
+            while True:
+                await asyncio.sleep(0.5)
+                rss["samples_mb"].append(rss_mb(server_pid))
+
+        sampler = asyncio.create_task(sample_rss())
+        started = time.perf_counter()
+        stop_at = started + args.duration
+        await asyncio.gather(*(user.run(parse_mix(args.mix), stop_at) for user in users))
+        duration = time.perf_counter() - started
+        sampler.cancel()
+
+        admin = VirtualUser(-1, run_id, client, setup, images, args)
+        admin.email, admin.full_name = "load-admin@example.com", f"load-admin-{run_id}"
+        await admin.register()
+        health = (await client.get("/health/details", headers=admin.headers)).json()
+
+    samples = [value for value in rss.pop("samples_mb") if value is not None]
+    total = sum(len(values) for values in recorder.latencies.values())
+    errors = sum(count for statuses in recorder.statuses.values()
+                 for status, count in statuses.items() if not status.startswith("2"))
+    return {
+        "setup": {"seconds": setup_seconds, "operations": summarize(setup, setup_seconds)},
+        "summary": {"duration_s": duration, "requests": total, "errors": errors,
+                    "throughput_rps": total / duration},
+        "operations": summarize(recorder, duration),
+        "server": {
+            "rss_start_mb": rss["start_mb"],
+            "rss_peak_mb": rss_mb(server_pid, "VmHWM"),
+            "rss_max_sampled_mb": max(samples) if samples else None,
+            "rss_end_mb": samples[-1] if samples else None,
+        },
+        "health": {key: health.get(key) for key in ("inference", "gemini", "prediction_cache",
+                                                      "database", "event_loop")},
+    }
+
+
+def run(args):
+    profile = build_profile(args.profile, parse_overrides(args.gemini_set))
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    database_url = (f"sqlite+aiosqlite:///{os.path.join(workdir, 'loadtest.db')}"
+                    if args.database == "sqlite" else args.database)
+    gemini_port, app_port = free_port(), free_port()
+
+    env = {
+        **os.environ,
+        **DEFAULT_APP_ENV,
+        "DATABASE_URL": database_url,
+        "GEMINI_API_ENDPOINT": f"http://127.0.0.1:{gemini_port}",
+        "STORAGE_LOCAL_ROOT": os.path.join(workdir, "uploads"),
+        "PYTHONPATH": ROOT,
+    }
+    for item in args.app_env:
+        key, value = item.split("=", 1)
+        env[key] = value
+
+    print(f"Generating {args.images} images...")
+    images = make_images(args.images, args.seed, args.width, args.height)
+
+    print(f"Migrating {args.database}...")
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=ROOT, env=env,
+                   check=True, capture_output=True)
+
+    gemini = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "fake_gemini.py"),
+         "--port", str(gemini_port), "--profile", args.profile, "--set", args.gemini_set,
+         "--seed", str(args.seed)],
+        stdout=subprocess.DEVNULL)
+    server_log = open(os.path.join(workdir, "server.log"), "w")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(app_port), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT, env=env, stdout=server_log, stderr=subprocess.STDOUT)
+    try:
+        wait_until_up(f"http://127.0.0.1:{gemini_port}/stats", gemini)
+        wait_until_up(f"http://127.0.0.1:{app_port}/", server)
+        print(f"Running {args.concurrency} users for {args.duration:.0f}s "
+              f"(profile {args.profile}, mix {args.mix})...")
+        result = asyncio.run(drive(f"http://127.0.0.1:{app_port}", server.pid, images, args))
+        result["fake_gemini"] = httpx.get(f"http://127.0.0.1:{gemini_port}/stats").json()
+    finally:
+        stop(server)
+        stop(gemini)
+        server_log.close()
+
+    result = {
+        "meta": {
+            **git_commit(),
+            "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "database": "sqlite" if args.database == "sqlite" else database_url.split("://")[0],
+            "gemini_profile": {"name": args.profile, **profile},
+            "args": {key: value for key, value in vars(args).items() if key != "func"},
+            "server_log": server_log.name,
+        },
+        **result,
+    }
+    print_report(result)
+
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"loadtest-{datetime.utcnow():%Y%m%d-%H%M%S}-"
+                     f"{(result['meta']['commit'] or 'nogit')[:7]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved {out}")
+
+
+def print_report(result: dict):
+    summary, server = result["summary"], result["server"]
+    print(f"\n{summary['requests']} requests in {summary['duration_s']:.1f}s, "
+          f"{summary['throughput_rps']:.1f} req/s, {summary['errors']} errors")
+    print(f"{'operation':<10} {'count':>7} {'errors':>7} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, op in result["operations"].items():
+        print(f"{name:<10} {op['count']:>7} {op['errors']:>7} {op['throughput_rps']:>8.1f} "
+              f"{op['p50_ms']:>8.0f} {op['p95_ms']:>8.0f} {op['p99_ms']:>8.0f}")
+    if server["rss_peak_mb"] is not None:
+        print(f"server RSS: start {server['rss_start_mb']:.0f} MB, peak {server['rss_peak_mb']:.0f} MB, "
+              f"end {server['rss_end_mb'] or 0:.0f} MB")
+    print(f"fake Gemini: {result['fake_gemini']['counts']}")
+
+
+# ------------------------------------
+# Compare
+# ------------------------------------
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    for label, result in (("baseline", baseline), ("current", current)):
+        meta = result["meta"]
+        print(f"{label:<9} {(meta['commit'] or 'nogit')[:10]}{' (dirty)' if meta['dirty'] else ''} "
+              f"{meta['started_at']} {meta['database']} profile={meta['gemini_profile']['name']} "
+              f"users={meta['args']['concurrency']}")
+    if baseline["meta"]["args"]["mix"] != current["meta"]["args"]["mix"] or \
+            baseline["meta"]["gemini_profile"] != current["meta"]["gemini_profile"]:
+        print("warning: the runs used a different mix or Gemini profile")
+
+    regressions = []
+    print(f"\n{'operation':<10} {'metric':<15} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name in sorted(set(baseline["operations"]) | set(current["operations"])):
+        old, new = baseline["operations"].get(name), current["operations"].get(name)
+        if old is None or new is None:
+            print(f"{name:<10} only in {'current' if old is None else 'baseline'}")
+            continue
+        for metric, worse_when_higher in (("throughput_rps", False), ("p50_ms", True),
+                                          ("p95_ms", True), ("p99_ms", True)):
+            change = (new[metric] - old[metric]) / old[metric] * 100 if old[metric] else 0.0
+            regressed = metric in ("throughput_rps", "p95_ms") and (
+                change > args.threshold if worse_when_higher else change < -args.threshold)
+            if regressed:
+                regressions.append(f"{name} {metric}")
+            print(f"{name:<10} {metric:<15} {old[metric]:>10.1f} {new[metric]:>10.1f} "
+                  f"{change:>+7.1f}%{'  <-- regression' if regressed else ''}")
+        if new["errors"] > old["errors"]:
+            print(f"{name:<10} {'errors':<15} {old['errors']:>10} {new['errors']:>10}")
+
+    old_rss, new_rss = baseline["server"]["rss_peak_mb"], current["server"]["rss_peak_mb"]
+    if old_rss and new_rss:
+        print(f"{'server':<10} {'rss_peak_mb':<15} {old_rss:>10.1f} {new_rss:>10.1f} "
+              f"{(new_rss - old_rss) / old_rss * 100:>+7.1f}%")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="boot the app and the fake Gemini, drive load")
+    run_parser.add_argument("--database", default="sqlite",
+                            help="'sqlite' (fresh temp file) or a database URL")
+    run_parser.add_argument("--profile", choices=sorted(PROFILES), default="fast",
+                            help="fake Gemini latency/error profile")
+    run_parser.add_argument("--gemini-set", default="",
+                            help="profile overrides, e.g. error_503=0.1,median_ms=200")
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--duration", type=float, default=30)
+    run_parser.add_argument("--mix", default="predict=60,history=25,login=10,clear=5")
+    run_parser.add_argument("--images", type=int, default=400)
+    run_parser.add_argument("--width", type=int, default=1280)
+    run_parser.add_argument("--height", type=int, default=720)
+    run_parser.add_argument("--duplicate-ratio", type=float, default=0.1)
+    run_parser.add_argument("--timeout", type=float, default=60, help="client timeout per request")
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                            help="extra environment for the app (repeatable)")
+    run_parser.add_argument("--out", help="result file (default benchmarks/results/...)")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=10,
+                                help="percent change of p95 / throughput counted as a regression")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Test setup: a throwaway SQLite database and image folder, and the fake
+Gemini server of benchmarks/fake_gemini.py on a free port. The app reads
+its settings at import time, so all of it happens before app is imported.
+"""
+import io
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pytest
+import uvicorn
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_gemini import build_app, build_profile  # noqa: E402
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_fake_gemini() -> str:
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        build_app(build_profile("fast", {"median_ms": 5, "p99_ms": 20}), seed=1),
+        host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("Fake Gemini server did not start")
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+WORKDIR = tempfile.mkdtemp(prefix="currency-api-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite+aiosqlite:///{WORKDIR}/test.db",
+    "DATABASE_REPLICA_URL": "",
+    "DB_CREATE_ALL": "false",
+    "STORAGE_BACKEND": "local",
+    "STORAGE_LOCAL_ROOT": os.path.join(WORKDIR, "uploads"),
+    "STORAGE_ASYNC_WRITES": "false",
+    "GEMINI_API_ENDPOINT": _start_fake_gemini(),
+    "GEMINI_RATE_PER_SECOND": "1000",
+    "GEMINI_RATE_BURST": "1000",
+    "INFERENCE_MODE": "gemini",
+    "JOB_WORKER_IN_PROCESS": "false",
+    "LOGIN_RATE_LIMIT_PER_IP": "0",
+    "LOGIN_RATE_LIMIT_PER_EMAIL": "0",
+    "USER_CACHE_TTL_SECONDS": "0",
+    "USER_QUOTA_PER_MINUTE": "0",
+    "USER_QUOTA_PER_DAY": "0",
+    "METRICS_ENABLED": "false",
+    "ADMIN_EMAILS": "admin@example.com",
+})
+
+from app.auth.cache import MemoryUserStore, user_cache  # noqa: E402
+from app.database import Base, engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.prediction.cache import prediction_cache  # noqa: E402
+from app.prediction.thumbnails import derivative_generator  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def _reset_database():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+
+@pytest.fixture(scope="session")
+def app_client():
+    """
+    One app for the whole run: shutdown closes the executor thread pools
+    for good, like in production.
+    """
+    from fastapi.testclient import TestClient
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def client(app_client):
+    """
+    The app with empty tables and in-process caches. Database work of a
+    test goes through `client.portal.call`, on the app's event loop.
+    """
+    app_client.portal.call(derivative_generator.stop)
+    app_client.portal.call(_reset_database)
+    prediction_cache._memory.clear()
+    user_cache.store = MemoryUserStore(100)
+    yield app_client
+    # Thumbnails of this test's predictions
+    app_client.portal.call(derivative_generator.stop)
+
+
+def register(client, name: str) -> dict:
+    """Creates a user and returns its Authorization header."""
+    email = f"{name}@example.com"
+    response = client.post(
+        "/auth/register", json={"full_name": name, "email": email, "password": "secret1"})
+    assert response.status_code == 200, response.text
+    token = client.post(
+        "/auth/login", json={"email": email, "password": "secret1"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def banknote_jpeg(seed: int, size: tuple[int, int] = (800, 400)) -> bytes:
+    """Busy, well exposed picture that passes the quality gate."""
+    pixels = (np.random.default_rng(seed).random((40, 80, 3)) * 255).astype("uint8")
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).resize(size).save(buffer, "JPEG")
+    return buffer.getvalue()
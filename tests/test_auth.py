@@ -0,0 +1,80 @@
+import pytest
+from passlib.hash import bcrypt
+from sqlalchemy import select, update
+from starlette.requests import Request
+
+import app.auth.routes as auth_routes
+from app.auth.hashing import password_hasher
+from app.auth.ratelimit import ClientAddress, LoginRateLimiter
+from app.config import BCRYPT_ROUNDS
+from app.database import AsyncSessionLocal
+from app.models import User
+from conftest import register
+
+
+def request(peer: str, forwarded: str | None = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "client": (peer, 1234), "headers": headers})
+
+
+def test_forwarded_for_is_ignored_from_untrusted_peers():
+    assert ClientAddress([]).of(request("203.0.113.9", "1.2.3.4")) == "203.0.113.9"
+    assert ClientAddress(["10.0.0.0/8"]).of(request("203.0.113.9", "1.2.3.4")) == "203.0.113.9"
+
+
+def test_client_is_the_rightmost_untrusted_forwarded_address():
+    proxies = ClientAddress(["10.0.0.0/8"])
+    # The client forged the first entry, our two proxies appended the rest
+    assert proxies.of(request("10.0.0.1", "6.6.6.6, 198.51.100.7, 10.0.0.2")) == "198.51.100.7"
+    assert ClientAddress(["*"]).of(request("172.16.5.5", "6.6.6.6, 198.51.100.7")) == "198.51.100.7"
+    assert ClientAddress(["*"]).of(request("172.16.5.5")) == "172.16.5.5"
+
+
+@pytest.fixture
+def limited(monkeypatch):
+    limiter = LoginRateLimiter(per_ip=2, per_email=3, window=60)
+    monkeypatch.setattr(auth_routes, "login_rate_limiter", limiter)
+    monkeypatch.setattr(auth_routes, "client_address", ClientAddress(["*"]))
+    return limiter
+
+
+def login(client, email: str, ip: str):
+    return client.post("/auth/login", json={"email": email, "password": "wrong-password"},
+                       headers={"X-Forwarded-For": ip})
+
+
+def test_login_limits_apply_per_client_behind_the_proxy(client, limited):
+    for _ in range(2):
+        assert login(client, "a@example.com", "198.51.100.1").status_code == 401
+    response = login(client, "a@example.com", "198.51.100.1")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+    # Another client behind the same proxy is not locked out
+    assert login(client, "a@example.com", "198.51.100.2").status_code == 401
+    # Per email, whatever the address
+    assert login(client, "a@example.com", "198.51.100.3").status_code == 429
+    assert limited.stats()["rejected_email"] == 1
+
+
+def test_password_of_another_cost_is_rehashed_on_login(client):
+    register(client, "cost")
+    old_cost = 4 if BCRYPT_ROUNDS != 4 else 5
+
+    async def set_hash(value):
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(User).where(User.email == "cost@example.com")
+                             .values(hashed_password=value))
+            await db.commit()
+
+    async def stored_hash():
+        async with AsyncSessionLocal() as db:
+            return await db.scalar(select(User.hashed_password)
+                                   .where(User.email == "cost@example.com"))
+
+    client.portal.call(set_hash, bcrypt.using(rounds=old_cost).hash("secret1"))
+    rehashed = password_hasher.rehashed
+    response = client.post("/auth/login", json={"email": "cost@example.com", "password": "secret1"})
+    assert response.status_code == 200
+    assert password_hasher.rehashed == rehashed + 1
+    assert f"${BCRYPT_ROUNDS:02d}$" in client.portal.call(stored_hash)
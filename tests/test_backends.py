@@ -0,0 +1,33 @@
+from ai.backends import CascadeBackend, InferenceBackend
+
+
+class StubBackend(InferenceBackend):
+    def __init__(self, name: str, confidence: float, screens_counterfeits: bool = True):
+        self.name = name
+        self.confidence = confidence
+        self.screens_counterfeits = screens_counterfeits
+        self.calls = 0
+
+    def analyze(self, image_bytes: bytes) -> dict:
+        self.calls += 1
+        return {"currency_code": "SDG", "confidence": self.confidence, "name_en": self.name,
+                "name_ar": self.name, "denomination_value": 100, "is_counterfeit": False}
+
+
+def test_cascade_answers_locally_only_when_confident():
+    local, remote = StubBackend("local", 0.95), StubBackend("remote", 0.8)
+    cascade = CascadeBackend(local, remote, threshold=0.9)
+    assert cascade.analyze(b"")["name_en"] == "local"
+
+    local.confidence = 0.5
+    assert cascade.analyze(b"")["name_en"] == "remote"
+    assert cascade.stats()["local_answers"] == 1
+    assert cascade.stats()["fallbacks"] == 1
+
+
+def test_cascade_never_trusts_a_model_without_counterfeit_classes():
+    local = StubBackend("local", 0.99, screens_counterfeits=False)
+    remote = StubBackend("remote", 0.8)
+    cascade = CascadeBackend(local, remote, threshold=0.9)
+    assert cascade.analyze(b"")["name_en"] == "remote"
+    assert local.calls == 0
@@ -0,0 +1,40 @@
+import app.prediction.routes as routes
+from conftest import banknote_jpeg, register
+
+
+def upload(name: str, data: bytes, content_type: str = "image/jpeg"):
+    return ("files", (name, data, content_type))
+
+
+def test_failed_items_do_not_fail_the_batch(client):
+    headers = register(client, "batch")
+    files = [
+        upload("good-1.jpg", banknote_jpeg(1)),
+        upload("notes.txt", b"not an image", "text/plain"),
+        upload("good-2.jpg", banknote_jpeg(2)),
+    ]
+    response = client.post("/predict/batch", files=files, headers=headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["count"], body["succeeded"], body["failed"]) == (3, 2, 1)
+
+    results = body["results"]
+    assert [item["index"] for item in results] == [0, 1, 2]
+    assert [item["filename"] for item in results] == ["good-1.jpg", "notes.txt", "good-2.jpg"]
+    assert [item["status"] for item in results] == ["success", "error", "success"]
+    assert results[1]["status_code"] == 400
+
+    # Only the successful items were stored, and counted once
+    history = client.get("/predict/history", headers=headers).json()
+    assert sorted(item["id"] for item in history) == sorted(
+        results[i]["id"] for i in (0, 2))
+    stats = client.get("/predict/stats", headers=headers).json()
+    assert stats["totals"]["count"] == 2
+
+
+def test_too_many_files_are_rejected_up_front(client, monkeypatch):
+    headers = register(client, "big-batch")
+    monkeypatch.setattr(routes, "MAX_BATCH_FILES", 2)
+    files = [upload(f"{seed}.jpg", banknote_jpeg(seed)) for seed in range(3)]
+    assert client.post("/predict/batch", files=files, headers=headers).status_code == 413
+    assert client.get("/predict/history", headers=headers).json() == []
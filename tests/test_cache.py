@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import app.prediction.cache as cache
+from ai.backends import get_backend
+from ai.gimini_client import gemini_client
+from app.prediction.cache import make_cache_key, prediction_cache
+from conftest import banknote_jpeg, register
+
+
+def predict(client, headers, image: bytes) -> dict:
+    response = client.post(
+        "/predict/", files={"file": ("n.jpg", image, "image/jpeg")}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def model_calls() -> int:
+    return gemini_client.stats()["calls"]
+
+
+def test_same_image_is_answered_from_the_cache(client):
+    headers = register(client, "cache")
+    image = banknote_jpeg(1)
+    first = predict(client, headers, image)
+    calls = model_calls()
+
+    second = predict(client, headers, image)
+    assert model_calls() == calls
+    assert second["currency_code"] == first["currency_code"]
+    assert second["id"] != first["id"]
+
+    # Persistent tier: another worker (or a restart) without the memory copy
+    prediction_cache._memory.clear()
+    hits = prediction_cache.persistent_hits
+    predict(client, headers, image)
+    assert model_calls() == calls
+    assert prediction_cache.persistent_hits == hits + 1
+
+
+def test_cache_key_covers_the_image_and_the_backend(monkeypatch):
+    digest_a, digest_b = "a" * 64, "b" * 64
+    assert make_cache_key(digest_a) == make_cache_key(digest_a)
+    assert make_cache_key(digest_a) != make_cache_key(digest_b)
+
+    key = make_cache_key(digest_a)
+    monkeypatch.setattr(cache, "get_backend", lambda: SimpleNamespace(
+        name=get_backend().name + ":prompt-v2"))
+    assert make_cache_key(digest_a) != key
+
+
+def test_another_backend_does_not_get_the_old_answers(client, monkeypatch):
+    headers = register(client, "backend")
+    image = banknote_jpeg(2)
+    predict(client, headers, image)
+    calls = model_calls()
+
+    # Model or prompt change: neither tier answers with the old results
+    monkeypatch.setattr(cache, "get_backend", lambda: SimpleNamespace(name="other-model"))
+    hits = prediction_cache.persistent_hits
+    predict(client, headers, image)
+    assert model_calls() == calls + 1
+    assert prediction_cache.persistent_hits == hits
@@ -0,0 +1,50 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.prediction.executor import (
+    BULK,
+    INTERACTIVE,
+    InferenceBusyError,
+    InferenceExecutor,
+    InferenceTimeoutError,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def make_executor(**overrides) -> InferenceExecutor:
+    settings = {"max_concurrency": 1, "max_queue": 2, "timeout": 5,
+                "weights": {INTERACTIVE: 4, BULK: 1}, "max_queue_per_user": 0}
+    return InferenceExecutor(**{**settings, **overrides})
+
+
+async def test_full_queue_rejects_calls():
+    executor = make_executor(max_queue=1)
+    release = threading.Event()
+    running = asyncio.create_task(executor.run(release.wait))
+    await asyncio.sleep(0.05)
+    waiting = asyncio.create_task(executor.run(lambda: "second"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(InferenceBusyError):
+        await executor.run(lambda: "third")
+    release.set()
+    assert await running is True
+    assert await waiting == "second"
+    assert executor.stats()["rejected"] == 1
+    executor.shutdown()
+
+
+async def test_timed_out_call_keeps_its_slot_until_the_thread_ends():
+    executor = make_executor(timeout=0.05)
+    release = threading.Event()
+    with pytest.raises(InferenceTimeoutError):
+        await executor.run(release.wait)
+    assert executor.stats()["running"] == 1
+
+    release.set()
+    assert await executor.run(lambda: "next") == "next"
+    assert executor.stats()["timed_out"] == 1
+    executor.shutdown()
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import banknote_jpeg, register
+
+
+def predict(client, headers, seed) -> int:
+    response = client.post(
+        "/predict/", files={"file": ("n.jpg", banknote_jpeg(seed), "image/jpeg")}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def export(client, headers, **params):
+    return client.get("/predict/export", params=params, headers=headers)
+
+
+def test_csv_and_ndjson_hold_the_same_rows(client):
+    alice, bob = register(client, "alice"), register(client, "bob")
+    ids = [predict(client, alice, seed) for seed in (1, 2)]
+    predict(client, bob, 3)
+
+    response = export(client, alice, format="csv")
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "attachment" in response.headers["content-disposition"]
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [int(row["id"]) for row in rows] == ids
+
+    response = export(client, alice, format="ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == ids
+    assert {line["user_id"] for line in lines} == {int(rows[0]["user_id"])}
+    assert set(lines[0]) == set(rows[0])
+
+
+def test_date_range_filters_rows(client):
+    headers = register(client, "dates")
+    predict(client, headers, 1)
+    tomorrow = (datetime.utcnow() + timedelta(days=1)).isoformat()
+    assert export(client, headers, format="ndjson", date_to=tomorrow).text.count("\n") == 1
+    assert export(client, headers, format="ndjson", date_from=tomorrow).text == ""
+
+
+def test_parquet_export(client):
+    pq = pytest.importorskip("pyarrow.parquet")
+    headers = register(client, "parquet")
+    ids = [predict(client, headers, seed) for seed in (1, 2)]
+    response = export(client, headers, format="parquet")
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.column("id").to_pylist() == ids
+
+
+def test_exporting_every_user_is_for_admins(client):
+    someone, admin = register(client, "someone"), register(client, "admin")
+    predict(client, someone, 1)
+    predict(client, admin, 2)
+
+    assert export(client, someone, scope="all").status_code == 403
+    response = export(client, admin, scope="all", format="ndjson")
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == 2
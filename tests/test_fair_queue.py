@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.prediction.executor import BULK, INTERACTIVE, FairQueue, InferenceBusyError
+from test_executor import make_executor
+
+pytestmark = pytest.mark.anyio
+
+
+async def served_order(queue: FairQueue, calls: list[tuple]) -> list:
+    """Queues `calls` ((flow, weight) pairs) behind a held slot, returns who got it in turn."""
+    order = []
+
+    async def call(flow, weight):
+        await queue.acquire(flow, weight)
+        order.append(flow)
+
+    tasks = []
+    for flow, weight in calls:
+        tasks.append(asyncio.create_task(call(flow, weight)))
+        await asyncio.sleep(0)  # queued in this order
+    for _ in calls:
+        queue.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return order
+
+
+async def test_busy_user_does_not_hold_back_the_others():
+    queue = FairQueue(1)
+    await queue.acquire("holder", 1)
+    order = await served_order(queue, [("alice", 1)] * 3 + [("bob", 1)])
+    assert order.index("bob") <= 1
+
+
+async def test_weights_share_the_slots():
+    queue = FairQueue(1)
+    await queue.acquire("holder", 1)
+    calls = [(BULK, 1)] * 4 + [(INTERACTIVE, 4)] * 4
+    order = await served_order(queue, calls)
+    assert order[:3] == [INTERACTIVE] * 3
+
+
+async def test_per_user_queue_limit():
+    executor = make_executor(max_queue=10, max_queue_per_user=1)
+    release = threading.Event()
+    running = asyncio.create_task(executor.run(release.wait, user_id=1))
+    await asyncio.sleep(0.05)
+    waiting = asyncio.create_task(executor.run(lambda: 1, user_id=1))
+    await asyncio.sleep(0)
+
+    with pytest.raises(InferenceBusyError, match="your"):
+        await executor.run(lambda: 1, user_id=1)
+    # Another user still gets in line
+    other = asyncio.create_task(executor.run(lambda: 2, user_id=2))
+    release.set()
+    assert await asyncio.gather(running, waiting, other) == [True, 1, 2]
+    assert executor.stats()["rejected_user"] == 1
+    executor.shutdown()
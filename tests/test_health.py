@@ -0,0 +1,14 @@
+import app.main as main
+from conftest import register
+
+
+def test_public_health_shows_no_internals(client):
+    assert client.get("/health").json() == {"status": "ok"}
+
+
+def test_health_details_are_admin_only(client):
+    assert client.get("/health/details").status_code == 401
+    assert client.get("/health/details", headers=register(client, "someone")).status_code == 403
+
+    details = client.get("/health/details", headers=register(client, "admin")).json()
+    assert set(main.COMPONENT_STATS) <= set(details)
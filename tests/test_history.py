@@ -0,0 +1,61 @@
+from conftest import banknote_jpeg, register
+
+
+def predict(client, headers, seed) -> int:
+    response = client.post(
+        "/predict/", files={"file": ("n.jpg", banknote_jpeg(seed), "image/jpeg")}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_history_pages_cover_every_prediction_once(client):
+    headers = register(client, "pages")
+    ids = [predict(client, headers, seed) for seed in range(5)]
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, "include_total": True}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/predict/history", params=params, headers=headers)
+        assert response.headers["X-Total-Count"] == "5"
+        seen += [item["id"] for item in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        assert 'rel="next"' in response.headers["Link"]
+    assert seen == ids[::-1]
+
+    assert client.get("/predict/history", params={"cursor": "nope"},
+                      headers=headers).status_code == 400
+
+
+def test_history_etag_changes_with_the_history(client):
+    headers = register(client, "etag")
+    predict(client, headers, 1)
+    first = client.get("/predict/history", headers=headers)
+    etag = first.headers["ETag"]
+
+    response = client.get("/predict/history", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    predict(client, headers, 2)
+    response = client.get("/predict/history", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json()) == 2
+
+
+def test_single_prediction_is_looked_up_before_answering_304(client):
+    alice, bob = register(client, "alice"), register(client, "bob")
+    prediction_id = predict(client, alice, 1)
+    etag = client.get(f"/predict/{prediction_id}", headers=alice).headers["ETag"]
+
+    for tag in (etag, "*"):
+        response = client.get(f"/predict/{prediction_id}", headers={**alice, "If-None-Match": tag})
+        assert response.status_code == 304
+        assert client.get("/predict/999999", headers={**alice, "If-None-Match": tag}).status_code == 404
+    # Someone else's prediction stays invisible, whatever the validators
+    response = client.get(f"/predict/{prediction_id}", headers={**bob, "If-None-Match": "*"})
+    assert response.status_code == 404
@@ -0,0 +1,152 @@
+import asyncio
+import io
+from datetime import datetime, timedelta
+
+import pytest
+from PIL import Image
+from sqlalchemy import func, select, update
+
+import app.prediction.jobs as jobs
+from app.database import AsyncSessionLocal
+from app.models.prediction import Prediction
+from app.models.prediction_job import PredictionJob
+from conftest import banknote_jpeg, register
+
+from app.prediction.jobs import (
+    FAILED, RUNNING, SUCCEEDED, CallbackURLError, check_callback_url, job_worker,
+)
+
+
+def run_next_job(client) -> str | None:
+    """Claims and processes one queued job on the app's event loop."""
+    lease = client.portal.call(job_worker._claim)
+    if lease is None:
+        return None
+    client.portal.call(job_worker._process, lease)
+    return lease.job_id
+
+
+def enqueue(client, headers, seed=1) -> str:
+    response = client.post(
+        "/predict/?mode=async", files={"file": ("note.jpg", banknote_jpeg(seed), "image/jpeg")},
+        headers=headers)
+    assert response.status_code == 202
+    return response.json()["job_id"]
+
+
+def test_async_prediction_runs_to_success(client):
+    headers = register(client, "jobs")
+    response = client.post(
+        "/predict/?mode=async", files={"file": ("note.jpg", banknote_jpeg(1), "image/jpeg")},
+        headers=headers)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    assert run_next_job(client) == job_id
+    job = client.get(f"/predict/jobs/{job_id}", headers=headers).json()
+    assert job["status"] == SUCCEEDED, job["error"]
+    assert job["attempts"] == 1
+    assert job["result"]["currency_code"]
+
+    history = client.get("/predict/history", headers=headers).json()
+    assert [item["id"] for item in history] == [job["result"]["id"]]
+    assert run_next_job(client) is None
+
+
+def test_unusable_photo_fails_the_job_without_retry(client):
+    headers = register(client, "jobs-dark")
+    buffer = io.BytesIO()
+    Image.new("RGB", (800, 400), (5, 5, 5)).save(buffer, "JPEG")
+    dark = buffer.getvalue()
+    job_id = client.post(
+        "/predict/?mode=async", files={"file": ("dark.jpg", dark, "image/jpeg")},
+        headers=headers).json()["job_id"]
+
+    run_next_job(client)
+    job = client.get(f"/predict/jobs/{job_id}", headers=headers).json()
+    assert job["status"] == FAILED
+    assert job["attempts"] == 1
+
+
+async def _take_over(job_id: str):
+    """Another worker claimed the job after our lease expired."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(PredictionJob).where(PredictionJob.id == job_id)
+                         .values(locked_until=datetime.utcnow() + timedelta(hours=1)))
+        await db.commit()
+
+
+async def _predictions() -> int:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(func.count()).select_from(Prediction))).scalar_one()
+
+
+def test_result_of_a_lost_lease_is_dropped(client):
+    headers = register(client, "jobs-lease")
+    job_id = enqueue(client, headers)
+    lease = client.portal.call(job_worker._claim)
+    client.portal.call(_take_over, job_id)
+    lost = job_worker.lost_leases
+
+    client.portal.call(job_worker._process, lease)
+    assert job_worker.lost_leases == lost + 1
+    assert client.portal.call(_predictions) == 0
+    job = client.get(f"/predict/jobs/{job_id}", headers=headers).json()
+    assert job["status"] == RUNNING
+    stats = client.get("/predict/stats", headers=headers).json()
+    assert stats["totals"]["count"] == 0
+
+
+async def _renewed_lease(job_id: str, lease: jobs.Lease):
+    lease.start()
+    first = lease.until
+    await asyncio.sleep(0.25)
+    await lease.stop()
+    async with AsyncSessionLocal() as db:
+        stored = (await db.get(PredictionJob, job_id)).locked_until
+    return first, lease.until, stored
+
+
+def test_lease_is_renewed_while_the_job_runs(client, monkeypatch):
+    headers = register(client, "jobs-renew")
+    job_id = enqueue(client, headers)
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.3)
+    lease = client.portal.call(job_worker._claim)
+    first, renewed, stored = client.portal.call(_renewed_lease, job_id, lease)
+    assert renewed > first
+    assert stored == renewed
+    assert not lease.lost
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("url", [
+    "http://93.184.216.34/hook",
+    "https:///hook",
+    "https://127.0.0.1/hook",
+    "https://localhost:8443/hook",
+    "https://10.1.2.3/hook",
+    "https://169.254.169.254/latest/meta-data",
+    "https://[::1]/hook",
+    "https://[::ffff:192.168.0.1]/hook",
+    "https://0.0.0.0/hook",
+])
+async def test_callback_url_must_be_a_public_https_host(url):
+    with pytest.raises(CallbackURLError):
+        await check_callback_url(url)
+
+
+@pytest.mark.anyio
+async def test_callback_url_allowlist(monkeypatch):
+    await check_callback_url("https://93.184.216.34/hook")
+    monkeypatch.setattr(jobs, "JOB_WEBHOOK_ALLOWED_HOSTS", {"hooks.example.com"})
+    with pytest.raises(CallbackURLError, match="not allowed"):
+        await check_callback_url("https://93.184.216.34/hook")
+
+
+def test_internal_callback_url_is_refused_before_queueing(client):
+    headers = register(client, "jobs-ssrf")
+    response = client.post(
+        "/predict/?mode=async", files={"file": ("note.jpg", banknote_jpeg(1), "image/jpeg")},
+        data={"callback_url": "https://127.0.0.1:8000/auth/me"}, headers=headers)
+    assert response.status_code == 400
+    assert run_next_job(client) is None
@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, WORKDIR
+
+# What create_all built before migrations existed (the three original tables)
+LEGACY_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL PRIMARY KEY, full_name VARCHAR(50) NOT NULL UNIQUE,
+    email VARCHAR(100) NOT NULL UNIQUE, hashed_password VARCHAR(255) NOT NULL,
+    created_at DATETIME);
+CREATE INDEX ix_users_id ON users (id);
+CREATE TABLE system_logs (
+    id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+    action VARCHAR(100) NOT NULL, message TEXT, timestamp DATETIME);
+CREATE INDEX ix_system_logs_id ON system_logs (id);
+CREATE TABLE predictions (
+    id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    currency_code VARCHAR(10) NOT NULL, confidence FLOAT NOT NULL, name_en VARCHAR(100) NOT NULL,
+    name_ar VARCHAR(100) NOT NULL, denomination_value INTEGER, is_counterfeit BOOLEAN NOT NULL,
+    image_path VARCHAR(255) NOT NULL, timestamp DATETIME);
+CREATE INDEX ix_predictions_id ON predictions (id);
+INSERT INTO users (id, full_name, email, hashed_password) VALUES (1, 'a', 'a@x.com', 'x');
+INSERT INTO predictions (user_id, currency_code, confidence, name_en, name_ar,
+    denomination_value, is_counterfeit, image_path, timestamp)
+    VALUES (1, 'SDG', 0.9, '100', 'x', 100, 0, 'a.jpg', '2026-01-01 00:00:00'),
+           (1, 'SDG', 0.8, '100', 'x', 100, 0, 'b.jpg', NULL);
+"""
+
+
+def alembic(path: str, *args: str):
+    env = {**os.environ, "DATABASE_URL": f"sqlite+aiosqlite:///{path}"}
+    result = subprocess.run(
+        [sys.executable, "-m", "alembic", *args], cwd=ROOT, env=env,
+        capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+
+
+def columns(path: str, table: str) -> set[str]:
+    with sqlite3.connect(path) as conn:
+        return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+@pytest.fixture
+def db_path(request):
+    path = os.path.join(WORKDIR, f"migrations-{request.node.name}.db")
+    if os.path.exists(path):
+        os.remove(path)
+    return path
+
+
+def test_empty_database_upgrades_and_downgrades(db_path):
+    alembic(db_path, "upgrade", "head")
+    assert "history_version" in columns(db_path, "users")
+    alembic(db_path, "downgrade", "base")
+    alembic(db_path, "upgrade", "head")
+
+
+def test_legacy_create_all_database_upgrades_without_stamp(db_path):
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+
+    alembic(db_path, "upgrade", "head")
+
+    assert {"phash", "has_derivatives", "timestamp"} <= columns(db_path, "predictions")
+    assert {"history_version", "history_changed_at"} <= columns(db_path, "users")
+    with sqlite3.connect(db_path) as conn:
+        # The prediction without a timestamp gets the oldest one
+        assert conn.execute("SELECT image_path, timestamp FROM predictions ORDER BY id").fetchall() == [
+            ("a.jpg", "2026-01-01 00:00:00"), ("b.jpg", "2026-01-01 00:00:00")]
+        notnull = {row[1]: row[3] for row in conn.execute("PRAGMA table_info(predictions)")}
+        assert notnull["timestamp"] == 1
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert {"prediction_jobs", "prediction_cache", "prediction_user_daily_stats"} <= tables
+
+
+def test_partially_migrated_create_all_database_upgrades(db_path):
+    # A later create_all added the new tables but not predictions.phash
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+        conn.execute("CREATE TABLE prediction_cache (key VARCHAR(64) NOT NULL PRIMARY KEY, "
+                     "result TEXT NOT NULL, created_at DATETIME, hits INTEGER NOT NULL)")
+
+    alembic(db_path, "upgrade", "head")
+    assert "phash" in columns(db_path, "predictions")
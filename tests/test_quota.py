@@ -0,0 +1,140 @@
+import pytest
+
+import app.prediction.routes as routes
+import app.prediction.service as service
+from app.prediction.executor import InferenceBusyError
+from app.prediction.quota import (
+    MINUTE,
+    MemoryUsageStore,
+    QuotaExceededError,
+    UsageQuota,
+)
+from conftest import banknote_jpeg, register
+
+pytestmark = pytest.mark.anyio
+
+
+def test_quota_below_the_batch_size_is_refused():
+    with pytest.raises(ValueError, match="USER_QUOTA_PER_MINUTE"):
+        UsageQuota(per_minute=10, per_day=0, global_per_minute=0,
+                   store=MemoryUsageStore(), batch_size=20)
+    UsageQuota(per_minute=0, per_day=20, global_per_minute=0,
+               store=MemoryUsageStore(), batch_size=20)
+
+
+async def test_per_user_limit_and_headers():
+    quota = UsageQuota(per_minute=2, per_day=0, global_per_minute=0, store=MemoryUsageStore())
+    await quota.acquire(1)
+    await quota.acquire(1)
+    with pytest.raises(QuotaExceededError) as error:
+        await quota.acquire(1)
+    assert error.value.headers["X-RateLimit-Remaining"] == "0"
+    assert int(error.value.headers["Retry-After"]) >= 1
+
+    # Other users have their own counters
+    await quota.acquire(2)
+    assert (await quota.headers(2))["X-RateLimit-Remaining"] == "1"
+    assert quota.stats()["rejected"] == {"minute": 1}
+
+
+async def test_global_limit_covers_all_users():
+    quota = UsageQuota(per_minute=0, per_day=0, global_per_minute=2, store=MemoryUsageStore())
+    await quota.acquire(1)
+    await quota.acquire(2)
+    with pytest.raises(QuotaExceededError, match="capacity"):
+        await quota.acquire(3)
+    # No per-user limit, so no per-user headers
+    assert await quota.headers(1) == {}
+
+
+async def test_previous_window_is_weighted_by_its_overlap(monkeypatch):
+    quota = UsageQuota(per_minute=10, per_day=0, global_per_minute=0, store=MemoryUsageStore())
+    now = 1_000 * MINUTE + 45  # three quarters into a window
+    monkeypatch.setattr("app.prediction.quota.time.time", lambda: now - MINUTE)
+    for _ in range(8):
+        await quota.acquire(1)
+    monkeypatch.setattr("app.prediction.quota.time.time", lambda: now)
+    # 8 calls a window ago, a quarter of it still overlaps: 2 used
+    usage = await quota._usage(1, quota.limits, now)
+    assert usage[0]["used"] == pytest.approx(2)
+    assert (await quota.headers(1))["X-RateLimit-Remaining"] == "8"
+
+
+async def test_refund_gives_the_call_back():
+    quota = UsageQuota(per_minute=1, per_day=5, global_per_minute=0, store=MemoryUsageStore())
+    charge = await quota.acquire(1)
+    await quota.refund(charge)
+    await quota.acquire(1)
+    with pytest.raises(QuotaExceededError):
+        await quota.acquire(1)
+    assert quota.stats()["refunded"] == 1
+
+
+async def test_unlimited_quota_charges_nothing():
+    quota = UsageQuota(per_minute=0, per_day=0, global_per_minute=0, store=MemoryUsageStore())
+    assert await quota.acquire(1) is None
+    await quota.refund(None)
+
+
+class BrokenStore(MemoryUsageStore):
+    async def get_many(self, keys):
+        raise ConnectionError("store down")
+
+
+async def test_store_failure_lets_calls_through():
+    quota = UsageQuota(per_minute=1, per_day=0, global_per_minute=0, store=BrokenStore())
+    for _ in range(3):
+        await quota.acquire(1)
+    assert quota.stats()["errors"] == 3
+
+
+@pytest.fixture
+def limited(monkeypatch):
+    quota = UsageQuota(per_minute=2, per_day=0, global_per_minute=0, store=MemoryUsageStore())
+    monkeypatch.setattr(service, "usage_quota", quota)
+    monkeypatch.setattr(routes, "usage_quota", quota)
+    return quota
+
+
+def test_over_quota_returns_429_and_cache_hits_are_free(client, limited):
+    headers = register(client, "quota")
+    for seed in (1, 2):
+        response = client.post(
+            "/predict/", files={"file": ("n.jpg", banknote_jpeg(seed), "image/jpeg")},
+            headers=headers)
+        assert response.status_code == 200
+    assert response.headers["X-RateLimit-Remaining"] == "0"
+
+    response = client.post(
+        "/predict/", files={"file": ("n.jpg", banknote_jpeg(3), "image/jpeg")}, headers=headers)
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+    # Same image again: answered from the cache, no model call to charge
+    response = client.post(
+        "/predict/", files={"file": ("n.jpg", banknote_jpeg(1), "image/jpeg")}, headers=headers)
+    assert response.status_code == 200
+
+
+class BusyExecutor:
+    async def run(self, func, *args, **kwargs):
+        raise InferenceBusyError("Inference queue is full")
+
+
+def test_rejected_calls_are_not_charged(client, limited, monkeypatch):
+    headers = register(client, "quota-busy")
+    monkeypatch.setattr(service, "inference_executor", BusyExecutor())
+    for seed in range(4):
+        response = client.post(
+            "/predict/", files={"file": ("n.jpg", banknote_jpeg(seed), "image/jpeg")},
+            headers=headers)
+        assert response.status_code == 503
+    assert limited.stats()["refunded"] == 4
+
+    monkeypatch.undo()
+    monkeypatch.setattr(service, "usage_quota", limited)
+    monkeypatch.setattr(routes, "usage_quota", limited)
+    response = client.post(
+        "/predict/", files={"file": ("n.jpg", banknote_jpeg(9), "image/jpeg")}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["X-RateLimit-Remaining"] == "1"
@@ -0,0 +1,137 @@
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from ai.gimini_client import GeminiClient
+from ai.resilience import (
+    CircuitBreaker,
+    GeminiDeadlineError,
+    GeminiInvalidResponseError,
+    GeminiRateLimitedError,
+    GeminiUnavailableError,
+    TokenBucket,
+)
+
+
+class FakeModel:
+    """generate_content() answers from a list: exceptions are raised, the rest returned."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def generate_content(self, contents, request_options=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def make_client(failures: int = 2, reset: float = 0.05) -> GeminiClient:
+    client = GeminiClient()
+    client.max_attempts = 1
+    client.deadline = 5
+    client.breaker = CircuitBreaker(failures, reset)
+    client.limiter = TokenBucket(1000, 1000)
+    return client
+
+
+def open_circuit(client: GeminiClient):
+    for _ in range(client.breaker.failure_threshold):
+        with pytest.raises(GeminiUnavailableError):
+            client.generate(FakeModel(google_exceptions.ServiceUnavailable("down")), [])
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+
+def test_breaker_opens_then_fails_fast():
+    client = make_client()
+    open_circuit(client)
+    model = FakeModel()
+    with pytest.raises(GeminiUnavailableError, match="open"):
+        client.generate(model, [])
+    assert model.calls == 0
+
+
+def test_half_open_trial_success_closes_the_circuit():
+    client = make_client()
+    open_circuit(client)
+    time.sleep(0.06)
+    assert client.generate(FakeModel("answer"), []) == "answer"
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_trial_failure_opens_again():
+    client = make_client()
+    open_circuit(client)
+    time.sleep(0.06)
+    with pytest.raises(GeminiUnavailableError):
+        client.generate(FakeModel(google_exceptions.InternalServerError("boom")), [])
+    assert client.breaker.state == CircuitBreaker.OPEN
+
+
+def test_only_one_half_open_trial_at_a_time():
+    breaker = CircuitBreaker(1, 0.0)
+    breaker.record_failure()
+    breaker.before_call()
+    with pytest.raises(GeminiUnavailableError, match="trial"):
+        breaker.before_call()
+
+
+def test_rate_limited_trial_does_not_wedge_the_breaker():
+    client = make_client()
+    open_circuit(client)
+    time.sleep(0.06)
+    # No token left, refilled every 1000 s: the half-open trial cannot get one
+    client.limiter = TokenBucket(0.001, 0)
+    client.deadline = 0.2
+    with pytest.raises(GeminiRateLimitedError):
+        client.generate(FakeModel(), [])
+    assert client.breaker.state == CircuitBreaker.HALF_OPEN
+
+    # The next call gets the trial instead of "trial call in progress"
+    client.limiter = TokenBucket(1000, 1000)
+    assert client.generate(FakeModel("answer"), []) == "answer"
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_expired_deadline_does_not_wedge_the_breaker():
+    client = make_client()
+    open_circuit(client)
+    time.sleep(0.06)
+    client.deadline = 0
+    with pytest.raises(GeminiDeadlineError):
+        client.generate(FakeModel(), [])
+    client.deadline = 5
+    assert client.generate(FakeModel("answer"), []) == "answer"
+
+
+def test_invalid_replies_are_asked_again_within_the_attempts():
+    client = make_client()
+    client.max_attempts = 3
+    model = FakeModel("bad", "bad", "good")
+
+    def parse(response):
+        if response != "good":
+            raise ValueError("not JSON")
+        return {"ok": True}
+
+    assert client.generate(model, [], parse=parse) == {"ok": True}
+    assert model.calls == 3
+
+    with pytest.raises(GeminiInvalidResponseError):
+        client.generate(FakeModel("bad", "bad", "bad"), [], parse=parse)
+    # Upstream answered every time: no reason to open the circuit
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=100, capacity=2)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    started = time.monotonic()
+    bucket.acquire(timeout=1)
+    assert time.monotonic() - started < 0.5
+    with pytest.raises(GeminiRateLimitedError):
+        TokenBucket(rate=0.001, capacity=0).acquire(timeout=0.01)
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select, update
+
+from app.database import AsyncSessionLocal
+from app.models.prediction import Prediction
+from app.models.system_log import SystemLog
+from app.models.user import User
+from app.prediction.retention import RetentionJob, delete_predictions
+from app.utils.storage import ImageNotFoundError, storage
+from conftest import banknote_jpeg, register
+
+
+def predict(client, headers, seed) -> int:
+    response = client.post(
+        "/predict/", files={"file": ("n.jpg", banknote_jpeg(seed), "image/jpeg")}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def totals(client, headers, scope="user"):
+    return client.get("/predict/stats", params={"scope": scope},
+                      headers=headers).json()["totals"]["count"]
+
+
+def owned_by(email: str):
+    return Prediction.user_id.in_(select(User.id).where(User.email == email))
+
+
+async def _image_paths() -> dict[int, str]:
+    async with AsyncSessionLocal() as db:
+        return dict((await db.execute(select(Prediction.id, Prediction.image_path))).all())
+
+
+async def _image_exists(key: str) -> bool:
+    try:
+        await storage.load(key)
+    except ImageNotFoundError:
+        return False
+    return True
+
+
+async def _age(ids: list[int], days: int):
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(Prediction).where(Prediction.id.in_(ids))
+                         .values(timestamp=datetime.utcnow() - timedelta(days=days)))
+        await db.execute(insert(SystemLog).values(
+            action="OLD", message="old", timestamp=datetime.utcnow() - timedelta(days=days)))
+        await db.commit()
+
+
+async def _log_actions() -> set[str]:
+    async with AsyncSessionLocal() as db:
+        return set((await db.execute(select(SystemLog.action))).scalars())
+
+
+async def _prediction_count() -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count(Prediction.id)))
+
+
+def test_batched_delete_removes_rows_rollups_and_images_once(client):
+    alice, bob = register(client, "alice"), register(client, "bob")
+    for seed in range(5):
+        predict(client, alice, seed)
+    kept = predict(client, bob, 9)
+    paths = client.portal.call(_image_paths)
+
+    deleted = client.portal.call(lambda: delete_predictions(
+        owned_by("alice@example.com"), wait_for_images=True, batch_rows=2))
+    assert deleted["rows"] == 5
+    assert deleted["bytes_freed"] > 0
+    assert totals(client, alice) == 0
+    assert totals(client, bob, "global") == 1
+    for prediction_id, key in paths.items():
+        assert client.portal.call(_image_exists, key) == (prediction_id == kept)
+
+    # Nothing left to match: a second run deletes nothing and adjusts nothing
+    again = client.portal.call(lambda: delete_predictions(
+        owned_by("alice@example.com"), wait_for_images=True, batch_rows=2))
+    assert again["rows"] == 0
+    assert totals(client, bob, "global") == 1
+
+
+def test_retention_deletes_only_what_is_past_its_age(client):
+    headers = register(client, "retention")
+    old = [predict(client, headers, seed) for seed in (1, 2)]
+    predict(client, headers, 3)
+    client.portal.call(_age, old, 40)
+
+    job = RetentionJob(prediction_days=30, log_days=30, image_days=0, interval_hours=24)
+    report = client.portal.call(job.run_once)
+    assert report["predictions"]["rows"] == 2
+    assert report["system_logs"]["rows"] == 1
+    assert client.portal.call(_prediction_count) == 1
+    assert len(client.get("/predict/history", headers=headers).json()) == 1
+    assert "OLD" not in client.portal.call(_log_actions)
+    assert job.stats()["runs"] == 1
@@ -0,0 +1,36 @@
+from ai.gimini_client import gemini_client
+from app.utils.image_utils import dhash_bytes, hamming_distance
+from conftest import banknote_jpeg, register
+
+
+def predict(client, headers, image: bytes) -> dict:
+    response = client.post(
+        "/predict/", files={"file": ("n.jpg", image, "image/jpeg")}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def model_calls() -> int:
+    return gemini_client.stats()["calls"]
+
+
+def test_near_duplicate_of_another_users_photo_goes_to_the_model(client):
+    alice, bob = register(client, "alice"), register(client, "bob")
+    # Same note, photographed a little smaller: other bytes, close dHash
+    photo, near = banknote_jpeg(1), banknote_jpeg(1, size=(780, 390))
+    assert hamming_distance(dhash_bytes(photo), dhash_bytes(near)) <= 4
+
+    predict(client, alice, photo)
+    calls = model_calls()
+    second = predict(client, bob, near)
+    assert model_calls() == calls + 1
+    history = client.get("/predict/history", headers=bob).json()
+    assert [item["id"] for item in history] == [second["id"]]
+
+
+def test_own_near_duplicate_still_gets_a_counterfeit_check(client):
+    headers = register(client, "again")
+    predict(client, headers, banknote_jpeg(1))
+    calls = model_calls()
+    predict(client, headers, banknote_jpeg(1, size=(780, 390)))
+    assert model_calls() == calls + 1
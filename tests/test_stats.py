@@ -0,0 +1,54 @@
+from datetime import date
+
+from sqlalchemy import insert, select
+
+from app.database import AsyncSessionLocal
+from app.models.prediction_stats import GlobalDailyStats
+from conftest import banknote_jpeg, register
+
+
+def predict(client, headers, seed):
+    response = client.post(
+        "/predict/", files={"file": ("n.jpg", banknote_jpeg(seed), "image/jpeg")}, headers=headers)
+    assert response.status_code == 200, response.text
+
+
+def totals(client, headers, scope="user"):
+    response = client.get("/predict/stats", params={"scope": scope}, headers=headers)
+    assert response.status_code == 200
+    return response.json()["totals"]["count"]
+
+
+async def _add_unrelated_zero_row():
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(GlobalDailyStats).values(
+            day=date(2000, 1, 1), currency_code="XXX", denomination_value=0,
+            count=0, counterfeit_count=0, confidence_sum=0.0))
+        await db.commit()
+
+
+async def _global_days():
+    async with AsyncSessionLocal() as db:
+        return set((await db.execute(select(GlobalDailyStats.day))).scalars())
+
+
+def test_rollups_follow_clear_and_profile_delete(client):
+    alice, bob = register(client, "alice"), register(client, "bob")
+    for seed in (1, 2, 3):
+        predict(client, alice, seed)
+    predict(client, bob, 4)
+    assert totals(client, alice) == 3
+    assert totals(client, alice, "global") == 4
+
+    client.portal.call(_add_unrelated_zero_row)
+
+    response = client.delete("/predict/clear", headers=alice)
+    assert response.json()["deleted"] == 3
+    assert totals(client, alice) == 0
+    assert totals(client, bob, "global") == 1
+    # Only the keys the clear decremented are cleaned up
+    assert date(2000, 1, 1) in client.portal.call(_global_days)
+
+    assert client.delete("/auth/me", headers=bob).status_code == 200
+    assert totals(client, alice, "global") == 0
+    assert client.portal.call(_global_days) == {date(2000, 1, 1)}
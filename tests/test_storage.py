@@ -0,0 +1,35 @@
+import app.prediction.service as service
+from app.utils.storage import storage
+from conftest import banknote_jpeg, register
+
+
+def history(client, headers) -> list:
+    return client.get("/predict/history", headers=headers).json()
+
+
+def test_no_prediction_points_to_an_image_that_failed_to_store(client, monkeypatch):
+    headers = register(client, "storage")
+
+    async def failing_save(key, data):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(service, "STORAGE_ASYNC_WRITES", True)
+    monkeypatch.setattr(storage, "_save", failing_save)
+    response = client.post(
+        "/predict/", files={"file": ("n.jpg", banknote_jpeg(1), "image/jpeg")}, headers=headers)
+    assert response.status_code == 503
+
+    files = [("files", (f"{seed}.jpg", banknote_jpeg(seed), "image/jpeg")) for seed in (2, 3)]
+    body = client.post("/predict/batch", files=files, headers=headers).json()
+    assert body["failed"] == 2
+    assert {item["status_code"] for item in body["results"]} == {503}
+    assert history(client, headers) == []
+
+    # Background writes that succeed are waited for, then the row is committed
+    monkeypatch.undo()
+    monkeypatch.setattr(service, "STORAGE_ASYNC_WRITES", True)
+    response = client.post(
+        "/predict/", files={"file": ("n.jpg", banknote_jpeg(4), "image/jpeg")}, headers=headers)
+    assert response.status_code == 200
+    key = client.get(f"/predict/{response.json()['id']}", headers=headers).json()["image_path"]
+    assert client.portal.call(storage.load, key)
@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.prediction.stream import ScanSession, ScanSessions
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, message: dict):
+        self.sent.append(message)
+
+
+class StubSession(ScanSession):
+    """Answers every analyzed frame with the same note, without model or database."""
+
+    def __init__(self, confidence: float = 0.5):
+        super().__init__(FakeWebSocket(), SimpleNamespace(id=1), ScanSessions(10))
+        self.confidence = confidence
+        self.model_calls = 0
+        self.final = None
+
+    async def analyze(self, frame):
+        self.model_calls += 1
+        result = {"currency_code": "SDG", "denomination_value": 100,
+                  "is_counterfeit": False, "confidence": self.confidence}
+        entry = (frame.phash, frame, {"result": result})
+        self.analyzed.append(entry)
+        return entry
+
+    async def finish(self, frame, analyzed):
+        self.final = frame
+
+
+def frame(seq: int, phash: int):
+    return SimpleNamespace(seq=seq, phash=phash)
+
+
+async def test_still_camera_needs_distinct_frames_to_agree():
+    session = StubSession()
+    assert not await session.on_window(frame(1, 0))
+    # The same picture again: answered from the first call, no new evidence
+    for seq in (2, 3, 4):
+        assert not await session.on_window(frame(seq, 0b1))
+    assert session.model_calls == 1
+    assert session.agreement == 1
+    assert [m["reused"] for m in session.websocket.sent] == [False, True, True, True]
+
+    # A different frame with the same answer makes it stable
+    assert await session.on_window(frame(5, (1 << 64) - 1))
+    assert session.model_calls == 2
+    assert session.final.seq == 5
+
+
+async def test_confident_answer_is_final_at_once():
+    session = StubSession(confidence=0.95)
+    assert await session.on_window(frame(1, 0))
+    assert session.agreement == 1
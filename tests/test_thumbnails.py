@@ -0,0 +1,41 @@
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from app.prediction.thumbnails import sign
+from conftest import banknote_jpeg, register
+
+
+def predict(client, headers, seed) -> dict:
+    response = client.post(
+        "/predict/", files={"file": ("n.jpg", banknote_jpeg(seed), "image/jpeg")}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def image(client, prediction_id: int, uid: int, exp: int, sig: str):
+    return client.get(f"/predict/{prediction_id}/image/thumb.webp",
+                      params={"uid": uid, "exp": exp, "sig": sig}, follow_redirects=False)
+
+
+def test_signed_url_names_its_owner_and_expires(client):
+    alice, bob = register(client, "alice"), register(client, "bob")
+    prediction = predict(client, alice, 1)
+    bob_id = client.get("/auth/me", headers=bob).json()["id"]
+
+    url = prediction["derivatives"]["thumb"]["webp"]
+    params = {key: values[0] for key, values in parse_qs(urlsplit(url).query).items()}
+    uid, exp, sig = int(params["uid"]), int(params["exp"]), params["sig"]
+    assert exp > time.time()
+    response = client.get(url, follow_redirects=False)
+    assert response.status_code == 307
+
+    # Tampering with the owner or the expiry breaks the signature
+    assert image(client, prediction["id"], bob_id, exp, sig).status_code == 403
+    assert image(client, prediction["id"], uid, exp + 3600, sig).status_code == 403
+    # Validly signed for someone who does not own the prediction
+    assert image(client, prediction["id"], bob_id, exp,
+                 sign(prediction["id"], bob_id, exp)).status_code == 404
+    # Expired
+    past = int(time.time()) - 1
+    assert image(client, prediction["id"], uid, past,
+                 sign(prediction["id"], uid, past)).status_code == 403
@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import app.auth.utils as auth_utils
+from app.auth.cache import user_cache
+from app.auth.utils import create_access_token
+from conftest import ROOT, register
+
+
+@pytest.fixture(params=[False, True], ids=["lookup", "trust-claims"])
+def trust_claims(request, monkeypatch):
+    monkeypatch.setattr(auth_utils, "AUTH_TRUST_CLAIMS", request.param)
+    monkeypatch.setattr(user_cache, "ttl", 60)
+    return request.param
+
+
+def test_tokens_of_a_deleted_user_are_rejected(client, trust_claims):
+    headers = register(client, "gone")
+    assert client.get("/predict/history", headers=headers).status_code == 200
+    assert client.get("/auth/me", headers=headers).status_code == 200
+    hits = user_cache.hits
+
+    assert client.delete("/auth/me", headers=headers).status_code == 200
+    # The cached snapshot and the signed claims are both still there
+    assert client.get("/predict/history", headers=headers).status_code == 401
+    assert client.get("/auth/me", headers=headers).status_code == 401
+    assert user_cache.stats()["rejected"] >= 2
+    assert user_cache.hits == hits + 1  # only the delete itself
+
+
+def test_admin_is_not_taken_from_token_claims(client, trust_claims):
+    register(client, "admin")
+    headers = register(client, "someone")
+    user_id = client.get("/auth/me", headers=headers).json()["id"]
+    # A validly signed token whose email claim does not match the user row
+    token = create_access_token({"sub": str(user_id), "name": "someone",
+                                 "email": "admin@example.com"})
+    forged = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/health/details", headers=forged).status_code == 403
+    assert client.get("/predict/export", params={"scope": "all"},
+                      headers=forged).status_code == 403
+
+
+def test_trusted_claims_need_the_shared_store():
+    env = {**os.environ, "AUTH_TRUST_CLAIMS": "true", "USER_CACHE_REDIS_URL": ""}
+    result = subprocess.run(
+        [sys.executable, "-c", "import app.main"], cwd=ROOT, env=env,
+        capture_output=True, text=True, timeout=120)
+    assert result.returncode != 0
+    assert "USER_CACHE_REDIS_URL" in result.stderr